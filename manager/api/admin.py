@@ -1,4 +1,4 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 
 # from .models import CustomUser, Vendor, Customer, Transaction, Wallet
 
@@ -8,7 +8,11 @@ from django.contrib import admin
 # admin.site.register(Transaction)
 # admin.site.register(Wallet)
 from django.contrib.auth.admin import UserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from .models import CustomUser, Vendor, Customer, Transaction, Wallet, Notification, Issue
+from .issues import resolve_issues, start_review
 
 
 class CustomUserAdmin(UserAdmin):
@@ -55,43 +59,166 @@ class VendorAdmin(UserAdmin):
     fieldsets = ()
 
 
-class TransactionAdmin(admin.ModelAdmin):
+# Paginator that takes the row count of an unfiltered changelist from the
+# database statistics instead of a COUNT(*) over the whole table
+class EstimatedCountPaginator(Paginator):
+    # below this the estimate is replaced by an exact count
+    EXACT_COUNT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if query.where:
+            return super().count
+        connection = connections[self.object_list.db]
+        table = connection.ops.quote_name(query.model._meta.db_table)
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                    [query.model._meta.db_table],
+                )
+            elif connection.vendor == "mysql":
+                cursor.execute(
+                    "SELECT table_rows FROM information_schema.tables "
+                    "WHERE table_schema = DATABASE() AND table_name = %s",
+                    [query.model._meta.db_table],
+                )
+            elif connection.vendor == "sqlite":
+                # rowids are handed out in increasing order, off by the deleted rows
+                cursor.execute(f"SELECT MAX(rowid) FROM {table}")
+            else:
+                return super().count
+            row = cursor.fetchone()
+        estimate = int(row[0] or 0) if row else 0
+        if estimate < self.EXACT_COUNT_LIMIT:
+            return super().count
+        return estimate
+
+
+# changelist settings shared by the admins of the big tables
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    date_hierarchy = "timestamp"
+    ordering = ("-timestamp",)
+
+
+class TransactionAdmin(LargeTableAdmin):
     list_display = (
         "sender",
         "receiver",
         "transaction_amount",
         "timestamp",
         "transaction_status",
+        "failure_reason",
         "transaction_id",
     )
+    # the wallets are rendered with their user's username
+    list_select_related = ("sender__user", "receiver__user")
+    raw_id_fields = ("sender", "receiver")
 
-    search_fields = ("transaction_id",)
-    readonly_fields = ("transaction_id",)
-    list_filter = ()
+    search_fields = ("=transaction_id",)
+    readonly_fields = ("transaction_id", "failure_reason")
+    list_filter = ("transaction_status", "failure_reason")
     fieldsets = ()
 
+    def get_readonly_fields(self, request, obj=None):
+        # the wallets were moved when it was saved, disputes go through issues
+        if obj is not None:
+            return (
+                "sender",
+                "receiver",
+                "transaction_amount",
+                "transaction_status",
+                "transaction_id",
+                "failure_reason",
+            )
+        return self.readonly_fields
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
-class WalletAdmin(admin.ModelAdmin):
-    list_display = ("user", "balance", "pending")
 
-    search_fields = ("user",)
-    readonly_fields = ("user",)
+class WalletAdmin(admin.ModelAdmin):
+    list_display = ("user", "balance", "pending", "pending_limit")
+    list_editable = ("pending_limit",)
+    list_select_related = ("user",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    search_fields = ("=user__user_id", "=user__username")
+    # balance and pending only change through transfers and top-ups
+    readonly_fields = ("user", "balance", "pending")
     list_filter = ()
     fieldsets = ()
 
+    def save_model(self, request, obj, form, change):
+        # the form holds the balance and pending of when the page was rendered,
+        # only write the edited fields so transfers made since are kept
+        if change:
+            obj.save(update_fields=form.changed_data)
+        else:
+            super().save_model(request, obj, form, change)
+
 
-class NotifAdmin(admin.ModelAdmin):
+class NotifAdmin(LargeTableAdmin):
     list_display = ("user", "timestamp", "subject", "content")
+    list_select_related = ("user",)
     readonly_fields = ("user", "timestamp", "subject", "content")
-    search_fields = ("subject", "content")
+    search_fields = ("=user__user_id", "=user__username")
 
-class IssueAdmin(admin.ModelAdmin):
-    list_display = ("user","subject","content","timestamp","resolved_status")
-    search_fields = ("user","resolved_status","subject")
+class IssueAdmin(LargeTableAdmin):
+    list_display = ("user","subject","content","timestamp","state","resolved_status")
+    list_select_related = ("user",)
+    raw_id_fields = ("user", "transaction", "assignee")
+    search_fields = ("=user__user_id", "=user__username", "=transaction__transaction_id")
     # readonly_fields = ("user","subject","content","timestamp")
-    # readonly_fields = ()
-    list_filter = ()
+    readonly_fields = ("state",)
+    list_filter = ("state",)
     fieldsets = ()
+    actions = ("mark_in_review", "resolve_success", "resolve_pending", "resolve_failed")
+
+    def save_model(self, request, obj, form, change):
+        # resolutions go through the service so the wallets follow the status
+        resolution = obj.resolved_status
+        if change:
+            obj.resolved_status = form.initial["resolved_status"]
+        else:
+            obj.resolved_status = Transaction.IN_REVIEW
+        super().save_model(request, obj, form, change)
+        if resolution != obj.resolved_status and resolution in Issue.RESOLUTIONS:
+            if not resolve_issues([obj.pk], resolution):
+                self.message_user(
+                    request,
+                    "Only issues in review can be resolved, mark it as in review first.",
+                    messages.WARNING,
+                )
+            obj.refresh_from_db()
+
+    def resolve(self, request, queryset, resolved_status):
+        count = resolve_issues(list(queryset.values_list("pk", flat=True)), resolved_status)
+        self.message_user(
+            request,
+            f"{count} issue(s) resolved to {dict(Transaction.TRANSACTION_STATUS)[resolved_status]}.",
+        )
+
+    @admin.action(description="Mark selected issues as in review")
+    def mark_in_review(self, request, queryset):
+        count = start_review(list(queryset.values_list("pk", flat=True)))
+        self.message_user(request, f"{count} issue(s) marked as in review.")
+
+    @admin.action(description="Resolve selected issues as Success")
+    def resolve_success(self, request, queryset):
+        self.resolve(request, queryset, Transaction.SUCCESS)
+
+    @admin.action(description="Resolve selected issues as Pending")
+    def resolve_pending(self, request, queryset):
+        self.resolve(request, queryset, Transaction.PENDING)
+
+    @admin.action(description="Resolve selected issues as Failed")
+    def resolve_failed(self, request, queryset):
+        self.resolve(request, queryset, Transaction.FAILED)
 
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(Vendor, VendorAdmin)
@@ -0,0 +1,133 @@
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncWeek
+
+from .models import Transaction, VendorCustomerRollup, VendorRollup, Wallet
+from .services import BATCH_SIZE, chunked
+
+ROLLUP_FIELDS = ("revenue", "pending", "settled", "transactions")
+TOP_CUSTOMERS = 10
+
+
+def vendor_analytics(wallet, start, end, granularity="day", top=TOP_CUSTOMERS):
+    """
+    Revenue, pending and settled dues of a vendor for [start, end), by hour,
+    day or week, plus totals and the top customers. Only reads the rollups.
+    """
+    rollups = VendorRollup.objects.filter(
+        vendor=wallet,
+        granularity=VendorRollup.HOUR if granularity == "hour" else VendorRollup.DAY,
+        bucket__gte=start,
+        bucket__lt=end,
+    )
+    sums = {field: Sum(field) for field in ROLLUP_FIELDS}
+    if granularity == "week":
+        series = (
+            rollups.annotate(week=TruncWeek("bucket"))
+            .values("week")
+            .annotate(**sums)
+            .order_by("week")
+        )
+        series = [dict(row, bucket=row.pop("week")) for row in series]
+    else:
+        series = list(rollups.order_by("bucket").values("bucket", *ROLLUP_FIELDS))
+
+    totals = {field: sum(row[field] for row in series) for field in ROLLUP_FIELDS}
+    top_customers = (
+        VendorCustomerRollup.objects.filter(
+            vendor=wallet, bucket__gte=start, bucket__lt=end
+        )
+        .values("customer__user__user_id", "customer__user__username")
+        .annotate(
+            revenue=Sum("revenue"),
+            pending=Sum("pending"),
+            transactions=Sum("transactions"),
+        )
+        .order_by("-revenue", "-pending")[:top]
+    )
+    return {
+        "granularity": granularity,
+        "series": series,
+        "totals": totals,
+        "top_customers": [
+            {
+                "user_id": row["customer__user__user_id"],
+                "username": row["customer__user__username"],
+                "revenue": row["revenue"],
+                "pending": row["pending"],
+                "transactions": row["transactions"],
+            }
+            for row in top_customers
+        ],
+    }
+
+
+def add_status_totals(row, status, total, count):
+    # The backfill only knows the current status of a transaction, so cleared
+    # dues count as pending and settled at the time of the original payment.
+    if status == Transaction.SUCCESS:
+        row["revenue"] += total
+    elif status in (Transaction.PENDING, Transaction.IN_REVIEW, Transaction.CLEARED):
+        row["pending"] += total
+        if status == Transaction.CLEARED and "settled" in row:
+            row["settled"] += total
+    else:
+        return
+    row["transactions"] += count
+
+
+def backfill_rollups():
+    """
+    Rebuild all vendor rollups from the transactions, vendor by vendor.
+    Returns the number of rollup rows written.
+    """
+    vendors = Wallet.objects.filter(user__is_vendor=True).values_list("pk", flat=True)
+    count = 0
+    for chunk in chunked(vendors, 100):
+        transactions = Transaction.objects.filter(receiver__in=chunk).order_by()
+        rollups = {}
+        for vendor, hour, status, total, n in (
+            transactions.annotate(hour=TruncHour("timestamp"))
+            .values_list("receiver", "hour", "transaction_status")
+            .annotate(total=Sum("transaction_amount"), n=Count("pk"))
+        ):
+            day = hour.replace(hour=0)
+            for granularity, bucket in ((VendorRollup.HOUR, hour), (VendorRollup.DAY, day)):
+                row = rollups.setdefault(
+                    (vendor, granularity, bucket), dict.fromkeys(ROLLUP_FIELDS, 0)
+                )
+                add_status_totals(row, status, total, n)
+
+        customer_rollups = {}
+        for vendor, customer, day, status, total, n in (
+            transactions.annotate(day=TruncDay("timestamp"))
+            .values_list("receiver", "sender", "day", "transaction_status")
+            .annotate(total=Sum("transaction_amount"), n=Count("pk"))
+        ):
+            row = customer_rollups.setdefault(
+                (vendor, customer, day),
+                {"revenue": 0, "pending": 0, "transactions": 0},
+            )
+            add_status_totals(row, status, total, n)
+
+        rollups = [
+            VendorRollup(vendor_id=vendor, granularity=granularity, bucket=bucket, **row)
+            for (vendor, granularity, bucket), row in rollups.items()
+            if row["transactions"]
+        ]
+        customer_rollups = [
+            VendorCustomerRollup(
+                vendor_id=vendor, customer_id=customer, bucket=bucket, **row
+            )
+            for (vendor, customer, bucket), row in customer_rollups.items()
+            if row["transactions"]
+        ]
+        with transaction.atomic():
+            VendorRollup.objects.filter(vendor__in=chunk).delete()
+            VendorCustomerRollup.objects.filter(vendor__in=chunk).delete()
+            VendorRollup.objects.bulk_create(rollups, batch_size=BATCH_SIZE)
+            VendorCustomerRollup.objects.bulk_create(
+                customer_rollups, batch_size=BATCH_SIZE
+            )
+        count += len(rollups) + len(customer_rollups)
+    return count
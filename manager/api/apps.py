@@ -1,6 +1,55 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from .events import notification_saved, transaction_saved, wallet_saved
+
+        # bump user versions and wake the event streams, see api/events.py
+        post_save.connect(notification_saved, sender=self.get_model("Notification"))
+        post_save.connect(wallet_saved, sender=self.get_model("Wallet"))
+        post_save.connect(transaction_saved, sender=self.get_model("Transaction"))
+
+        from .caching import model_changed
+
+        # invalidate cached responses, see api/caching.py
+        for name in ("CustomUser", "Customer", "Vendor", "Wallet", "Transaction"):
+            post_save.connect(model_changed, sender=self.get_model(name))
+            post_delete.connect(model_changed, sender=self.get_model(name))
+
+        from .caching import cache_stats
+        from .metrics import connection_created as time_queries, registry
+        from .throttles import rejection_stats
+        from .velocity import velocity_stats
+
+        # DB time and the counters kept by other modules, see api/metrics.py
+        connection_created.connect(time_queries)
+        registry.collector(
+            "payment_rejections_total",
+            "Payment requests rejected by the throttles, write limiter and velocity checks.",
+            "reason",
+            rejection_stats,
+        )
+        registry.collector(
+            "velocity_checks_total",
+            "Transfers checked, flagged and blocked by the velocity checks.",
+            "result",
+            velocity_stats,
+        )
+        registry.collector(
+            "response_cache_hits_total",
+            "Cached list responses served from the cache.",
+            "view",
+            lambda: {name: counts["hits"] for name, counts in cache_stats().items()},
+        )
+        registry.collector(
+            "response_cache_misses_total",
+            "Cached list responses rendered because they were not cached.",
+            "view",
+            lambda: {name: counts["misses"] for name, counts in cache_stats().items()},
+        )
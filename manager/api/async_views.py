@@ -0,0 +1,320 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.urls import URLPattern, path
+from django.views import View
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .events import broker
+from .models import CustomUser, Notification, Transaction, Wallet
+from .serializers import (
+    NotificationSerializer,
+    TransactionSerializer,
+    requested_fields,
+    sparse_queryset,
+)
+from .sse import EventStreamResponse, format_event
+from .versions import auser_version, not_modified, set_validators
+
+# seconds between keep-alive comments on an idle stream, the wallet is
+# re-read then too in case it was changed without a notification
+KEEPALIVE_INTERVAL = 15
+# after a wake-up the stream waits this long so a burst is sent as one batch
+COALESCE_DELAY = 0.2
+STREAM_BATCH_SIZE = 100
+
+# Sync views served under ASGI run here instead of on the single thread Django
+# uses for sync code, the size bounds the number of concurrent DB writers.
+sync_view_pool = ThreadPoolExecutor(
+    max_workers=settings.SYNC_VIEW_THREADS, thread_name_prefix="sync-view"
+)
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    # rendered like the DRF views, so both modes return the same payload
+    return HttpResponse(
+        JSONRenderer().render(data), status=status_code, content_type="application/json"
+    )
+
+
+def authenticate(request):
+    return Request(
+        request,
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    ).user
+
+
+class AsyncAPIView(View):
+    """
+    Base for the async read views. Authenticates with the DRF authentication
+    classes and requires an authenticated user, like IsAuthenticated.
+    """
+
+    async def authenticated_user(self, request):
+        try:
+            user = await sync_to_async(authenticate)(request)
+        except exceptions.APIException as e:
+            return None, json_response({"detail": e.detail}, e.status_code)
+        if not user.is_authenticated:
+            # what IsAuthenticated answers, 403 as session auth sends no challenge
+            return None, json_response(
+                {"detail": exceptions.NotAuthenticated.default_detail},
+                status.HTTP_403_FORBIDDEN,
+            )
+        return user, None
+
+    async def conditional(self, request, user):
+        """
+        The user's version and a 304 response if the client's copy is current,
+        see api/versions.py. Only the user and admins get validators.
+        """
+        if not (user.is_superuser or user.user_id == self.kwargs["user_id"]):
+            return None, None
+        version = await auser_version(self.kwargs["user_id"])
+        return version, not_modified(request, version)
+
+
+# async OverviewNavbar
+class AsyncOverviewNavbar(AsyncAPIView):
+    async def get(self, request, *args, **kwargs):
+        user, error = await self.authenticated_user(request)
+        if error:
+            return error
+        version, response = await self.conditional(request, user)
+        if response:
+            return response
+        user = await CustomUser.objects.aget(user_id=self.kwargs["user_id"])
+        wallet = await Wallet.objects.aget(user=user)
+        if user.is_customer:
+            response = json_response({"balance": wallet.balance, "pending_dues": wallet.pending})
+        else:
+            dues = await Transaction.objects.filter(
+                receiver=wallet, transaction_status=Transaction.PENDING
+            ).aaggregate(total=Sum("transaction_amount"))
+            response = json_response(
+                {"balance": wallet.balance, "pending_dues": dues["total"] or 0}
+            )
+        return set_validators(response, request, version)
+
+
+# async OverviewTable
+class AsyncOverviewTable(AsyncAPIView):
+    async def get(self, request, *args, **kwargs):
+        user, error = await self.authenticated_user(request)
+        if error:
+            return error
+        version, response = await self.conditional(request, user)
+        if response:
+            return response
+        user = await CustomUser.objects.aget(user_id=self.kwargs["user_id"])
+        wallet = await Wallet.objects.aget(user=user)
+        if user.is_customer:
+            sent = Transaction.objects.filter(sender=wallet).order_by("-timestamp")
+            transactions_vendor = [
+                transaction
+                async for transaction in sent.filter(receiver__user__is_vendor=True)[:5]
+            ]
+            transactions_non_vendor = [
+                transaction
+                async for transaction in sent.filter(receiver__user__is_customer=True)[:5]
+            ]
+            response = json_response(
+                {
+                    "recent_transactions": {
+                        "transactions_vendor": TransactionSerializer(
+                            transactions_vendor, many=True
+                        ).data,
+                        "transactions_non_vendor": TransactionSerializer(
+                            transactions_non_vendor, many=True
+                        ).data,
+                    }
+                }
+            )
+            return set_validators(response, request, version)
+        transactions = [
+            transaction
+            async for transaction in Transaction.objects.filter(receiver=wallet).order_by(
+                "-timestamp"
+            )[:10]
+        ]
+        response = json_response(
+            {
+                "recent_transactions": {
+                    "transaction_non_vendor": TransactionSerializer(
+                        transactions, many=True
+                    ).data
+                }
+            }
+        )
+        return set_validators(response, request, version)
+
+
+# async UserNotificationList
+class AsyncUserNotificationList(AsyncAPIView):
+    async def get(self, request, *args, **kwargs):
+        user, error = await self.authenticated_user(request)
+        if error:
+            return error
+        if not (user.is_superuser or user.user_id == self.kwargs["user_id"]):
+            return json_response(
+                {"message": "Not Authorized to access."}, status.HTTP_403_FORBIDDEN
+            )
+        version, response = await self.conditional(request, user)
+        if response:
+            return response
+        notifications = [
+            notification
+            async for notification in sparse_queryset(
+                Notification.objects.filter(user_id=self.kwargs["user_id"]),
+                requested_fields(request),
+            )
+        ]
+        try:
+            serializer = NotificationSerializer(
+                notifications, many=True, context={"request": request}
+            )
+        except exceptions.ValidationError as e:
+            return json_response(e.detail, status.HTTP_400_BAD_REQUEST)
+        return set_validators(
+            json_response(serializer.data),
+            request,
+            version,
+        )
+
+
+async def notification_events(user_id, last_event_id):
+    """
+    Notifications of the user with an id above `last_event_id`, then new ones
+    as they are committed, plus a "wallet" event whenever balance or pending
+    changes. Every event carries the id of the latest notification sent, so a
+    client reconnecting with Last-Event-ID resumes where it stopped.
+    """
+    subscription = broker.subscribe(user_id)
+    try:
+        yield f"retry: {KEEPALIVE_INTERVAL * 1000}\n\n"
+        wallet = None
+        while True:
+            notifications = [
+                notification
+                async for notification in Notification.objects.filter(
+                    user_id=user_id, id__gt=last_event_id
+                ).order_by("id")[:STREAM_BATCH_SIZE]
+            ]
+            for notification in notifications:
+                last_event_id = notification.id
+                yield format_event(
+                    "notification",
+                    JSONRenderer().render(NotificationSerializer(notification).data).decode(),
+                    last_event_id,
+                )
+            current = await Wallet.objects.filter(user_id=user_id).values(
+                "balance", "pending"
+            ).afirst()
+            if current != wallet:
+                wallet = current
+                yield format_event(
+                    "wallet", JSONRenderer().render(wallet).decode(), last_event_id
+                )
+            if len(notifications) == STREAM_BATCH_SIZE:
+                continue
+            if await subscription.wait(KEEPALIVE_INTERVAL):
+                await asyncio.sleep(COALESCE_DELAY)
+            else:
+                yield ": keep-alive\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+
+# Server-Sent Events stream of a user's notifications and wallet, ASGI only
+class AsyncNotificationStream(AsyncAPIView):
+    async def get(self, request, *args, **kwargs):
+        user, error = await self.authenticated_user(request)
+        if error:
+            return error
+        if not (user.is_superuser or user.user_id == self.kwargs["user_id"]):
+            return json_response(
+                {"message": "Not Authorized to access."}, status.HTTP_403_FORBIDDEN
+            )
+        last_event_id = request.headers.get(
+            "Last-Event-ID", request.GET.get("last_event_id")
+        )
+        if last_event_id is None:
+            # a new stream starts with what happens from now on
+            latest = await Notification.objects.filter(
+                user_id=self.kwargs["user_id"]
+            ).order_by("-id").afirst()
+            last_event_id = latest.id if latest else 0
+        try:
+            last_event_id = int(last_event_id)
+        except ValueError:
+            return json_response(
+                {"message": "Invalid Last-Event-ID."}, status.HTTP_400_BAD_REQUEST
+            )
+        return EventStreamResponse(
+            notification_events(self.kwargs["user_id"], last_event_id)
+        )
+
+
+def run_sync_view(view, request, *args, **kwargs):
+    # pool threads outlive requests, so they manage their own connections
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, "render"):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def pooled(view):
+    """
+    Wrap a sync view so that under ASGI it runs in `sync_view_pool`.
+    """
+    run = sync_to_async(run_sync_view, thread_sensitive=False, executor=sync_view_pool)
+
+    async def async_view(request, *args, **kwargs):
+        return await run(view, request, *args, **kwargs)
+
+    # DRF views are csrf exempt and do their own checks
+    async_view.csrf_exempt = getattr(view, "csrf_exempt", False)
+    return async_view
+
+
+ASYNC_READ_VIEWS = {
+    "navbar-details": AsyncOverviewNavbar,
+    "overview-details": AsyncOverviewTable,
+    "notification": AsyncUserNotificationList,
+}
+
+
+def asgi_urlpatterns(urlpatterns):
+    """
+    The api urlpatterns for ASGI: async views for the read endpoints, every
+    other view wrapped with `pooled`, and the event stream.
+    """
+    return [
+        path(
+            "users/<str:user_id>/notifications/stream/",
+            AsyncNotificationStream.as_view(),
+            name="notification_stream",
+        )
+    ] + [
+        URLPattern(
+            pattern.pattern,
+            ASYNC_READ_VIEWS[pattern.name].as_view()
+            if pattern.name in ASYNC_READ_VIEWS
+            else pooled(pattern.callback),
+            pattern.default_args,
+            pattern.name,
+        )
+        for pattern in urlpatterns
+    ]
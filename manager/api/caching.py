@@ -0,0 +1,109 @@
+import threading
+import uuid
+from collections import defaultdict
+from functools import wraps
+from hashlib import sha1
+
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+from .versions import user_version
+
+# A cached response is stored under the current generation of every model it
+# depends on. A change to a model gives it a new generation (after commit),
+# which orphans the entries built from the old data; they expire on their own.
+GENERATION_KEY = "response_cache_generation:{}"
+RESPONSE_KEY = "response_cache:{}"
+DEFAULT_TIMEOUT = 300
+
+# which generations a change to a model invalidates. Money moving between
+# wallets is recorded as a transaction, so a transaction touches both.
+INVALIDATES = {
+    "api.CustomUser": ("api.CustomUser",),
+    "api.Wallet": ("api.Wallet",),
+    "api.Transaction": ("api.Transaction", "api.Wallet"),
+}
+
+stats_lock = threading.Lock()
+stats = defaultdict(lambda: {"hits": 0, "misses": 0})
+
+
+def model_label(model):
+    return model._meta.concrete_model._meta.label
+
+
+def invalidate(*models):
+    """
+    Invalidate the cached responses depending on `models` once the current
+    transaction commits. For the service layer, where updates send no signals.
+    """
+    generations = {
+        GENERATION_KEY.format(label): uuid.uuid4().hex
+        for model in models
+        for label in INVALIDATES.get(model_label(model), ())
+    }
+    if generations:
+        transaction.on_commit(lambda: cache.set_many(generations, None))
+
+
+def model_changed(sender, **kwargs):
+    if model_label(sender) in INVALIDATES:
+        invalidate(sender)
+
+
+def generations(labels):
+    keys = [GENERATION_KEY.format(label) for label in labels]
+    current = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in current}
+    if missing:
+        # another process may have created them in between, keep theirs
+        for key, value in missing.items():
+            if not cache.add(key, value, None):
+                missing[key] = cache.get(key, value)
+        current.update(missing)
+    return [current[key] for key in keys]
+
+
+def cached_response(depends_on=(), per_user=False, timeout=DEFAULT_TIMEOUT):
+    """
+    Cache the 200 responses of a DRF view method (`list`, or `get` after the
+    permission checks) per URL and requesting user.
+    `depends_on` are the models the response is built from. With `per_user`
+    the response also depends on the data of the user in the URL, tracked by
+    the user version (see api/versions.py).
+    """
+    labels = sorted(model_label(model) for model in depends_on)
+
+    def decorator(method):
+        name = method.__qualname__
+
+        @wraps(method)
+        def cached_method(self, request, *args, **kwargs):
+            parts = [name, request.get_full_path(), str(request.user.pk)]
+            parts += generations(labels)
+            if per_user:
+                parts.append(user_version(kwargs["user_id"])[0])
+            key = RESPONSE_KEY.format(sha1(":".join(parts).encode()).hexdigest())
+
+            data = cache.get(key)
+            with stats_lock:
+                stats[name]["hits" if data is not None else "misses"] += 1
+            if data is not None:
+                return Response(data)
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data, timeout)
+            return response
+
+        return cached_method
+
+    return decorator
+
+
+def cache_stats():
+    with stats_lock:
+        return {
+            name: dict(counts, hit_rate=counts["hits"] / (counts["hits"] + counts["misses"]))
+            for name, counts in stats.items()
+        }
@@ -0,0 +1,106 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.db import transaction
+
+from .versions import bump_versions
+
+
+class Subscription:
+    """
+    Wake-up flag of one stream. Notifications set the flag from any thread,
+    the stream clears it when it wakes, so a burst of notifications while the
+    stream is busy results in a single wake-up.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    def notify(self):
+        self.loop.call_soon_threadsafe(self.event.set)
+
+    async def wait(self, timeout):
+        # False if nothing happened within `timeout` seconds
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self.event.clear()
+        return True
+
+
+class Broker:
+    """
+    In-process pub/sub between the code that changes a user's notifications or
+    wallet and the event streams of that user. Only the streams served by this
+    process are reached, which is enough for a single-node deployment.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        with self.lock:
+            self.subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions[subscription.user_id]
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self.subscriptions[subscription.user_id]
+
+    def publish(self, user_ids):
+        with self.lock:
+            subscriptions = [
+                subscription
+                for user_id in user_ids
+                for subscription in self.subscriptions.get(user_id, ())
+            ]
+        for subscription in subscriptions:
+            subscription.notify()
+
+
+broker = Broker()
+
+
+def publish_on_commit(user_ids):
+    """
+    Announce that data of the users changed: bump their versions (see
+    api/versions.py) and wake their event streams. Both happen after commit,
+    since readers only see the change then.
+    """
+    user_ids = set(user_ids)
+
+    def publish():
+        bump_versions(user_ids)
+        broker.publish(user_ids)
+
+    transaction.on_commit(publish)
+
+
+def publish_wallets_on_commit(wallet_ids):
+    # for wallet updates done with queryset.update(), which send no signals
+    from .models import Wallet
+
+    publish_on_commit(
+        Wallet.objects.filter(pk__in=list(wallet_ids)).values_list("user_id", flat=True)
+    )
+
+
+def notification_saved(sender, instance, **kwargs):
+    publish_on_commit([instance.user_id])
+
+
+def wallet_saved(sender, instance, **kwargs):
+    publish_on_commit([instance.user_id])
+
+
+def transaction_saved(sender, instance, **kwargs):
+    publish_on_commit([instance.sender.user_id, instance.receiver.user_id])
@@ -0,0 +1,202 @@
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .caching import invalidate
+from .events import publish_on_commit
+from .metrics import transaction_failures
+from .models import (
+    Issue,
+    LedgerEntry,
+    Notification,
+    OutboxEvent,
+    Transaction,
+    VendorRollup,
+    get_time,
+    issue_notifications,
+)
+from .services import BATCH_SIZE, chunked, credit_wallets
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+CURSOR_FORMAT = "%Y%m%d%H%M%S%f"
+ISSUE_FIELDS = (
+    "id",
+    "user_id",
+    "subject",
+    "content",
+    "timestamp",
+    "transaction_id",
+    "state",
+    "resolved_status",
+    "assignee_id",
+)
+
+
+def encode_cursor(issue):
+    return f"{issue['timestamp'].astimezone(dt_timezone.utc):{CURSOR_FORMAT}}-{issue['id']}"
+
+
+def decode_cursor(cursor):
+    timestamp, pk = cursor.split("-")
+    timestamp = datetime.strptime(timestamp, CURSOR_FORMAT)
+    return timestamp.replace(tzinfo=dt_timezone.utc), int(pk)
+
+
+def issue_page(queryset, cursor=None, limit=PAGE_SIZE):
+    """
+    One page of issues ordered by (timestamp, id), starting after `cursor`.
+    Keyset pagination: the index is walked from the cursor, nothing is counted
+    or skipped with OFFSET. Returns the rows and the cursor of the next page
+    (None on the last page). Raises ValueError on a malformed cursor.
+    """
+    queryset = queryset.order_by("timestamp", "id")
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk)
+        )
+    rows = list(queryset.values(*ISSUE_FIELDS)[: limit + 1])
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1])
+    return rows, None
+
+
+def claim_issues(agent_id, limit=1):
+    """
+    Assign up to `limit` of the oldest open issues to the staff user
+    `agent_id` and move them to in review. Rows locked by another agent's
+    claim are skipped rather than waited on, so agents working the queue in
+    parallel never block each other or claim the same issue. Returns the
+    claimed issues.
+    """
+    with transaction.atomic():
+        ids = list(
+            Issue.objects.select_for_update(skip_locked=True)
+            .filter(state=Issue.OPEN)
+            .order_by("timestamp", "id")
+            .values_list("pk", flat=True)[:limit]
+        )
+        # the state condition keeps databases without row locks from double claiming
+        Issue.objects.filter(pk__in=ids, state=Issue.OPEN).update(
+            state=Issue.IN_REVIEW, assignee_id=agent_id
+        )
+        return list(
+            Issue.objects.filter(pk__in=ids, assignee_id=agent_id)
+            .order_by("timestamp", "id")
+            .values(*ISSUE_FIELDS)
+        )
+
+
+def start_review(issue_ids):
+    """
+    Move open issues to in review. Issues in any other state are left alone.
+    Returns the number of issues moved.
+    """
+    count = 0
+    for chunk in chunked(issue_ids):
+        count += Issue.objects.filter(pk__in=chunk, state=Issue.OPEN).update(
+            state=Issue.IN_REVIEW
+        )
+    return count
+
+
+def resolve_issues(issue_ids, resolved_status):
+    """
+    Resolve the given issues and their transactions to `resolved_status`
+    (SUCCESS, PENDING or FAILED). Only issues in review are resolved, open
+    ones have to be claimed or marked in review first. Every step is one
+    conditional UPDATE, so already resolved issues and transactions that left
+    IN_REVIEW in between are skipped instead of being applied twice.
+    Returns the number of issues resolved.
+    """
+    if resolved_status not in Issue.RESOLUTIONS:
+        raise ValidationError(
+            f"Cannot resolve an issue to {dict(Transaction.TRANSACTION_STATUS)[resolved_status]}"
+        )
+
+    now = timezone.now()
+    status_name = dict(Transaction.TRANSACTION_STATUS)[resolved_status]
+    count = 0
+    with transaction.atomic():
+        for chunk in chunked(issue_ids):
+            issues = Issue.objects.select_for_update().filter(
+                pk__in=chunk, state=Issue.IN_REVIEW
+            )
+            transaction_ids = set(issues.values_list("transaction_id", flat=True))
+            count += issues.update(state=Issue.RESOLVED, resolved_status=resolved_status)
+
+            # several issues on one transaction only resolve it once
+            transactions = Transaction.objects.filter(
+                pk__in=transaction_ids, transaction_status=Transaction.IN_REVIEW
+            )
+            transactions = list(
+                transactions.select_for_update().select_related(
+                    "sender__user", "receiver__user"
+                )
+            )
+            failure_reason = None
+            if resolved_status == Transaction.FAILED:
+                failure_reason = Transaction.ISSUE_REJECTED
+                transaction_failures.inc(len(transactions), reason="issue_rejected")
+            Transaction.objects.filter(
+                pk__in=[txn.pk for txn in transactions],
+                transaction_status=Transaction.IN_REVIEW,
+            ).update(transaction_status=resolved_status, failure_reason=failure_reason)
+
+            ledger = []
+            notifications = []
+            events = []
+            debits = {}
+            for txn in transactions:
+                txn.transaction_status = resolved_status
+                txn.failure_reason = failure_reason
+                events.append(OutboxEvent.for_transaction(txn, OutboxEvent.ISSUE_RESOLVED))
+                parties = (txn.sender.user_id, txn.receiver.user_id)
+                content = f"Issue for transaction {txn.transaction_id} resolved to status {status_name} at {get_time(now)}."
+                if resolved_status == Transaction.FAILED:
+                    # revert the pending amount
+                    debits[txn.sender_id] = (
+                        debits.get(txn.sender_id, Decimal("0")) - txn.transaction_amount
+                    )
+                    ledger += LedgerEntry.legs(
+                        txn,
+                        (LedgerEntry.PENDING, -txn.transaction_amount),
+                        (LedgerEntry.RECEIVABLE, -txn.transaction_amount),
+                        kind=LedgerEntry.ADJUSTMENT,
+                    )
+                    notifications += [
+                        Notification(
+                            user_id=parties[0],
+                            subject="Issue resolved.",
+                            content=f"Issue for transaction {txn.transaction_id} resolved to status FAILED at {get_time(now)}, pending amount Rs. {txn.transaction_amount} reverted.",
+                        ),
+                        Notification(
+                            user_id=parties[1],
+                            subject="Issue resolved.",
+                            content=content,
+                        ),
+                    ]
+                else:
+                    # nothing to do to the balances
+                    notifications += issue_notifications(
+                        parties, "Issue resolved.", content
+                    )
+
+            credit_wallets(debits, field="pending")
+            LedgerEntry.objects.bulk_create(ledger, batch_size=BATCH_SIZE)
+            VendorRollup.objects.record(ledger)
+            Notification.objects.bulk_create(notifications, batch_size=BATCH_SIZE)
+            OutboxEvent.objects.bulk_create(events, batch_size=BATCH_SIZE)
+            publish_on_commit(notification.user_id for notification in notifications)
+            invalidate(Transaction)
+    return count
+
+
+def resolve_issue(issue, resolved_status):
+    # True if this call resolved the issue
+    return resolve_issues([issue.pk], resolved_status) == 1
@@ -0,0 +1,188 @@
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, Exists, F, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import BalanceSnapshot, LedgerEntry, Transaction, Wallet
+from .services import BATCH_SIZE, chunked
+
+# Snapshots are taken up to this long ago, most entries have committed by then.
+SNAPSHOT_LAG = timedelta(minutes=1)
+# An entry's timestamp is set before its transaction commits, so an entry may
+# show up after a snapshot that should include it. Snapshots younger than this
+# are re-summed on every run and corrected, entries that commit later than
+# this after their timestamp are not in the snapshots taken meanwhile.
+SNAPSHOT_RECHECK = timedelta(days=1)
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def balance_at(wallet, when, account=LedgerEntry.BALANCE, inclusive=True):
+    """
+    Value of a wallet account at `when`: the latest snapshot taken at or
+    before it plus the entries dated after that snapshot. Entries dated at
+    `when` itself only count when `inclusive`.
+    """
+    before = {f"timestamp__{'lte' if inclusive else 'lt'}": when}
+    entries = LedgerEntry.objects.filter(wallet=wallet, account=account, **before)
+    snapshot = (
+        BalanceSnapshot.objects.filter(wallet=wallet, account=account, **before)
+        .order_by("-timestamp")
+        .first()
+    )
+    total = Decimal("0")
+    if snapshot is not None:
+        total = snapshot.amount
+        entries = entries.filter(timestamp__gt=snapshot.timestamp)
+    return total + (entries.aggregate(total=Sum("amount"))["total"] or 0)
+
+
+def balance_before(wallet, when, account=LedgerEntry.BALANCE):
+    # periods are [start, end), an entry dated at `end` belongs to the next one
+    return balance_at(wallet, when, account, inclusive=False)
+
+
+def take_snapshots():
+    """
+    Snapshot every wallet account that has entries dated after the previous
+    run, then re-sum the snapshots younger than SNAPSHOT_RECHECK from the last
+    snapshot before them, correcting those that missed a late entry.
+    A snapshot holds the sum of the entries dated up to its timestamp.
+    Returns the number of snapshots written.
+    """
+    cutoff = timezone.now() - SNAPSHOT_LAG
+    previous = BalanceSnapshot.objects.aggregate(last=Max("timestamp"))["last"]
+    accounts = LedgerEntry.objects.filter(timestamp__lte=cutoff)
+    if previous is not None:
+        accounts = accounts.filter(timestamp__gt=previous)
+    accounts = accounts.values_list("wallet", "account").distinct().order_by()
+    last_entry_id = LedgerEntry.objects.aggregate(last=Max("id"))["last"]
+
+    settled_until = cutoff - SNAPSHOT_RECHECK
+    settled = BalanceSnapshot.objects.filter(
+        wallet=OuterRef("wallet"),
+        account=OuterRef("account"),
+        timestamp__lt=OuterRef("timestamp"),
+        timestamp__lte=settled_until,
+    ).order_by("-timestamp")
+    count = 0
+    with transaction.atomic():
+        # written as 0 and summed up with the snapshots being rechecked
+        for chunk in chunked(accounts):
+            BalanceSnapshot.objects.bulk_create(
+                BalanceSnapshot(
+                    wallet_id=wallet,
+                    account=account,
+                    amount=0,
+                    last_entry_id=last_entry_id,
+                    timestamp=cutoff,
+                )
+                for wallet, account in chunk
+            )
+            count += len(chunk)
+
+        snapshots = (
+            BalanceSnapshot.objects.filter(
+                Q(timestamp__gt=settled_until) | Q(timestamp=cutoff)
+            )
+            .annotate(
+                since=Coalesce(Subquery(settled.values("timestamp")[:1]), Value(EPOCH))
+            )
+            .annotate(
+                resum=Coalesce(
+                    Subquery(settled.values("amount")[:1]), Value(Decimal("0"))
+                )
+                + total(
+                    LedgerEntry.objects.filter(
+                        wallet=OuterRef("wallet"),
+                        account=OuterRef("account"),
+                        timestamp__gt=OuterRef("since"),
+                        timestamp__lte=OuterRef("timestamp"),
+                    )
+                )
+            )
+            .exclude(amount=F("resum"))
+        )
+        for chunk in chunked(snapshots):
+            for snapshot in chunk:
+                snapshot.amount = snapshot.resum
+            BalanceSnapshot.objects.bulk_update(chunk, ["amount"])
+    return count
+
+
+def total(queryset, group="wallet", field="amount"):
+    # sum of `field` over a correlated subquery, 0 when it has no rows
+    return Coalesce(
+        Subquery(
+            queryset.values(group).annotate(total=Sum(field)).values("total")[:1]
+        ),
+        Value(Decimal("0")),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+def open_ledger():
+    """
+    Write OPENING entries for wallets that predate the ledger, so that their
+    entries add up to the wallet columns. A wallet that already moved money
+    has entries for that, the opening amount of each account is the column
+    minus the sum of those entries, dated before the first of them. Every
+    wallet opened gets a BALANCE opening entry, even of 0, so it is only
+    opened once. Returns the number of entries written.
+    """
+    entries = LedgerEntry.objects.filter(wallet=OuterRef("pk")).order_by()
+    dues = Transaction.objects.filter(
+        receiver=OuterRef("pk"),
+        transaction_status__in=(Transaction.PENDING, Transaction.IN_REVIEW),
+    ).order_by()
+
+    # column, entries and receivable dues are read in one statement, so a
+    # transfer committing meanwhile is either in all of them or in none
+    wallets = (
+        Wallet.objects.exclude(Exists(entries.filter(kind=LedgerEntry.OPENING)))
+        .annotate(
+            receivable=total(dues, "receiver", "transaction_amount"),
+            booked_balance=total(entries.filter(account=LedgerEntry.BALANCE)),
+            booked_pending=total(entries.filter(account=LedgerEntry.PENDING)),
+            booked_receivable=total(entries.filter(account=LedgerEntry.RECEIVABLE)),
+            first_entry=Subquery(entries.order_by("id").values("timestamp")[:1]),
+        )
+        .values_list(
+            "pk",
+            "balance",
+            "pending",
+            "receivable",
+            "booked_balance",
+            "booked_pending",
+            "booked_receivable",
+            "first_entry",
+        )
+    )
+    now = timezone.now()
+    count = 0
+    with transaction.atomic():
+        for chunk in chunked(wallets):
+            opening = []
+            for pk, balance, pending, receivable, *booked, first_entry in chunk:
+                accounts = (
+                    (LedgerEntry.BALANCE, balance - booked[0]),
+                    (LedgerEntry.PENDING, pending - booked[1]),
+                    (LedgerEntry.RECEIVABLE, receivable - booked[2]),
+                )
+                for account, amount in accounts:
+                    if amount or account == LedgerEntry.BALANCE:
+                        opening.append(
+                            LedgerEntry(
+                                wallet_id=pk,
+                                account=account,
+                                amount=amount,
+                                kind=LedgerEntry.OPENING,
+                                timestamp=first_entry or now,
+                            )
+                        )
+            LedgerEntry.objects.bulk_create(opening, batch_size=BATCH_SIZE)
+            count += len(opening)
+    return count
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.analytics import backfill_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the vendor analytics rollups from the transaction history. "
+        "Only needed once, afterwards every transfer keeps them up to date."
+    )
+
+    def handle(self, *args, **options):
+        count = backfill_rollups()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {count} rollup row(s)."))
@@ -0,0 +1,83 @@
+import logging
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from api.middleware import COMPRESSORS
+from api.models import CustomUser, Notification, Transaction, Wallet, generate_txn_id
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure response size and latency of the list endpoints with every "
+        "available encoding, on a throwaway user with generated history."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--transactions", type=int, default=1000)
+        parser.add_argument("--notifications", type=int, default=1000)
+        parser.add_argument("--rounds", type=int, default=20)
+
+    def handle(self, *args, **options):
+        logging.getLogger("django.request").setLevel(logging.ERROR)
+        run = uuid.uuid4().hex[:8]
+        users = [
+            CustomUser.objects.create_user(
+                f"bench_{run}_{type.lower()}", f"bench_{run}_{type.lower()}@bench.local",
+                str(uuid.uuid4().int)[:10], password=uuid.uuid4().hex, type=type,
+            )
+            for type in ("CUSTOMER", "VENDOR")
+        ]
+        try:
+            self.generate(users, options["transactions"], options["notifications"])
+            client = Client()
+            client.force_login(users[0])
+            for path in (
+                f"/api/users/{users[0].user_id}/transactions/",
+                f"/api/users/{users[0].user_id}/notifications/",
+            ):
+                self.bench(client, path, options["rounds"])
+        finally:
+            for user in users:
+                user.delete()
+
+    def generate(self, users, transactions, notifications):
+        sender, receiver = (Wallet.objects.get(user=user) for user in users)
+        Transaction.objects.bulk_create(
+            Transaction(
+                transaction_id=generate_txn_id(),
+                sender=sender,
+                receiver=receiver,
+                transaction_amount=10 + i % 90,
+                transaction_status=i % 3,
+            )
+            for i in range(transactions)
+        )
+        Notification.objects.bulk_create(
+            Notification(
+                user=users[0],
+                subject="Transaction successful.",
+                content=f"Rs. {10 + i % 90} sent to {users[1].username}.",
+            )
+            for i in range(notifications)
+        )
+
+    def bench(self, client, path, rounds):
+        self.stdout.write(path)
+        baseline = None
+        for encoding in ("identity", *COMPRESSORS):
+            # ETag checks are skipped by not sending If-None-Match
+            elapsed = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                response = client.get(path, HTTP_ACCEPT_ENCODING=encoding)
+                elapsed.append(time.perf_counter() - start)
+            size = len(response.content)
+            baseline = baseline or size
+            elapsed.sort()
+            self.stdout.write(
+                f"  {encoding:<9} {size:>9} bytes ({100 - size * 100 / baseline:5.1f}% saved)"
+                f"  median {elapsed[len(elapsed) // 2] * 1000:7.2f} ms"
+            )
@@ -0,0 +1,105 @@
+import asyncio
+import importlib
+import logging
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+from django.urls import clear_url_caches
+
+from api.models import CustomUser
+
+
+def reload_urlconf():
+    # the api urlpatterns depend on ASYNC_VIEWS
+    importlib.reload(importlib.import_module("api.urls"))
+    importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+
+
+def peak_in_flight(spans):
+    events = sorted([(start, 1) for start, _ in spans] + [(end, -1) for _, end in spans])
+    peak = current = 0
+    for _, delta in events:
+        current += delta
+        peak = max(peak, current)
+    return peak
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare one WSGI worker (a sync handler, one request at a time) with "
+        "one ASGI worker (an event loop with concurrent connections) on the "
+        "read endpoints."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--connections", type=int, default=50)
+        parser.add_argument("--requests", type=int, default=10)
+
+    def handle(self, *args, **options):
+        logging.getLogger("django.request").setLevel(logging.ERROR)
+        run = uuid.uuid4().hex[:8]
+        user = CustomUser.objects.create_user(
+            f"bench_{run}", f"bench_{run}@bench.local", str(uuid.uuid4().int)[:10],
+            password=uuid.uuid4().hex, type="VENDOR",
+        )
+        paths = [
+            f"/api/users/{user.user_id}/navbar/",
+            f"/api/users/{user.user_id}/overview/",
+            f"/api/users/{user.user_id}/notifications/",
+        ]
+        total = options["connections"] * options["requests"]
+        try:
+            self.report("WSGI", self.bench_wsgi(paths, user, total), total)
+            with override_settings(ASYNC_VIEWS=True):
+                reload_urlconf()
+                spans = asyncio.run(
+                    self.bench_asgi(
+                        paths, user, options["connections"], options["requests"]
+                    )
+                )
+            self.report("ASGI", spans, total)
+        finally:
+            reload_urlconf()
+            user.delete()
+
+    def bench_wsgi(self, paths, user, total):
+        client = Client()
+        client.force_login(user)
+        spans = []
+        for i in range(total):
+            start = time.perf_counter()
+            client.get(paths[i % len(paths)])
+            spans.append((start, time.perf_counter()))
+        return spans
+
+    async def bench_asgi(self, paths, user, connections, requests):
+        spans = []
+        session = AsyncClient()
+        await sync_to_async(session.force_login)(user)
+
+        async def connection(offset):
+            client = AsyncClient()
+            client.cookies = session.cookies
+            for i in range(requests):
+                start = time.perf_counter()
+                response = await client.get(paths[(offset + i) % len(paths)])
+                assert response.status_code == 200, response.content
+                spans.append((start, time.perf_counter()))
+
+        await asyncio.gather(*(connection(offset) for offset in range(connections)))
+        return spans
+
+    def report(self, mode, spans, total):
+        elapsed = max(end for _, end in spans) - min(start for start, _ in spans)
+        latencies = sorted(end - start for start, end in spans)
+        self.stdout.write(
+            f"{mode}: {total} requests in {elapsed:.2f}s ({total / elapsed:.0f} req/s), "
+            f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+            f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms, "
+            f"peak concurrent connections {peak_in_flight(spans)}"
+        )
@@ -0,0 +1,35 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+from api.outbox import iter_events
+from api.services import BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the outbox events after the given position as JSON lines, in "
+        "position order. Pass the position of the last exported event as "
+        "--after to continue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--after", type=int, default=0)
+        parser.add_argument("--output", help="File to append to, stdout by default.")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        output = open(options["output"], "a") if options["output"] else sys.stdout
+        last, count = options["after"], 0
+        try:
+            for event in iter_events(options["after"], options["batch_size"]):
+                output.write(json.dumps(event, cls=DjangoJSONEncoder) + "\n")
+                last, count = event["position"], count + 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        self.stderr.write(
+            self.style.SUCCESS(f"Exported {count} event(s), last position {last}.")
+        )
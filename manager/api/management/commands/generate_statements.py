@@ -0,0 +1,83 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from api.models import CustomUser
+from api.statements import generate_statement
+
+
+def month_range(month):
+    start = timezone.make_aware(datetime.strptime(month, "%Y-%m"))
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start, end
+
+
+def setup_worker():
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = (
+        "Write monthly statements (CSV or PDF) for the given users, or for all "
+        "users, using a pool of worker processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("month", help="Statement period as YYYY-MM.")
+        parser.add_argument("user_ids", nargs="*")
+        parser.add_argument("--all", action="store_true")
+        parser.add_argument("--pdf", action="store_true")
+        parser.add_argument("--output", default="statements")
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+
+    def handle(self, *args, **options):
+        try:
+            start, end = month_range(options["month"])
+        except ValueError:
+            raise CommandError("Month must be given as YYYY-MM.")
+        user_ids = options["user_ids"]
+        if options["all"]:
+            user_ids = list(CustomUser.objects.values_list("user_id", flat=True))
+        if not user_ids:
+            raise CommandError("Give some user ids or --all.")
+        os.makedirs(options["output"], exist_ok=True)
+
+        # workers open their own connections, inherited ones must not be shared
+        connections.close_all()
+        failed = 0
+        with ProcessPoolExecutor(
+            max_workers=options["workers"], initializer=setup_worker
+        ) as pool:
+            futures = {
+                pool.submit(
+                    generate_statement,
+                    user_id,
+                    start,
+                    end,
+                    options["output"],
+                    options["pdf"],
+                ): user_id
+                for user_id in user_ids
+            }
+            for future in as_completed(futures):
+                try:
+                    summary = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{futures[future]}: {e}")
+                    continue
+                self.stdout.write(
+                    "{user_id}: {transactions} transaction(s) -> {path}".format(**summary)
+                )
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Wrote {len(user_ids) - failed} statement(s), {failed} failed.")
+        )
@@ -0,0 +1,49 @@
+import csv
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from api.services import top_up_wallets
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply wallet top-ups from a CSV file with the columns user_id, amount "
+        "and reference. References that were already applied are skipped, so "
+        "a partially imported file can simply be imported again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("csv_file")
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        counts = {"applied": 0, "duplicate": 0, "invalid": 0}
+        with open(options["csv_file"], newline="") as f:
+            rows = csv.DictReader(f)
+            line = 1
+            while True:
+                batch = list(islice(rows, options["batch_size"]))
+                if not batch:
+                    break
+                try:
+                    results = top_up_wallets(batch)
+                except IntegrityError:
+                    raise CommandError(
+                        f"Batch starting at line {line + 1} conflicts with a "
+                        "concurrent top-up, nothing from it was applied. Run the "
+                        "import again to continue."
+                    )
+                for number, result in enumerate(results, start=line + 1):
+                    counts[result["status"]] += 1
+                    if result["status"] == "invalid":
+                        self.stderr.write(f"Line {number}: {result['errors']}")
+                line += len(batch)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Applied {applied}, skipped {duplicate} duplicate(s) and "
+                "{invalid} invalid row(s).".format(**counts)
+            )
+        )
@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.outbox import prune_events
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete outbox events older than the retention period. Meant to be "
+        "run periodically, e.g. daily from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.OUTBOX_RETENTION_DAYS,
+            help="Keep the events of the last DAYS days.",
+        )
+
+    def handle(self, *args, **options):
+        count = prune_events(timezone.now() - timedelta(days=options["days"]))
+        self.stdout.write(self.style.SUCCESS(f"Deleted {count} event(s)."))
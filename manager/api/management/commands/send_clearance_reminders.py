@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.reminders import send_reminders
+
+
+class Command(BaseCommand):
+    help = (
+        "Send the reminders of queued clearance requests. Meant to be run "
+        "periodically, e.g. every minute from cron, or with --interval."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Keep running and process the queue every INTERVAL seconds.",
+        )
+        parser.add_argument(
+            "--limit", type=int, default=None, help="Requests to process per run."
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed, sent = send_reminders(options["limit"])
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Processed {processed} request(s), sent {sent} reminder(s)."
+                )
+            )
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
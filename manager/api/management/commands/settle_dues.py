@@ -0,0 +1,79 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from api.settlement import CHUNK_SIZE, NIGHTLY, POLICIES, settle_dues
+
+
+def setup_worker():
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = (
+        "Clear the pending dues of wallets whose balance covers them. Run "
+        "nightly from cron, or as a worker with --policy threshold --interval. "
+        "Wallets can be split in shards handled by separate runs or processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--policy", choices=POLICIES, default=NIGHTLY)
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=settings.AUTO_SETTLE_THRESHOLD,
+            help="Share of the pending limit at which the threshold policy settles a wallet.",
+        )
+        parser.add_argument("--shards", type=int, default=1)
+        parser.add_argument(
+            "--shard",
+            type=int,
+            default=None,
+            help="Only settle this shard, by default all shards in parallel.",
+        )
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Keep running and sweep every INTERVAL seconds.",
+        )
+
+    def handle(self, *args, **options):
+        shards = options["shards"]
+        if shards < 1 or not (options["shard"] is None or 0 <= options["shard"] < shards):
+            raise CommandError("Shard must be between 0 and --shards - 1.")
+        if options["shard"] is None:
+            shard_ids = range(shards)
+        else:
+            shard_ids = [options["shard"]]
+        arguments = [
+            (options["policy"], options["threshold"], shard, shards, options["chunk_size"])
+            for shard in shard_ids
+        ]
+
+        while True:
+            if len(arguments) == 1:
+                summaries = [settle_dues(*arguments[0])]
+            else:
+                # workers open their own connections, inherited ones must not be shared
+                connections.close_all()
+                with ProcessPoolExecutor(
+                    max_workers=len(arguments), initializer=setup_worker
+                ) as pool:
+                    summaries = list(pool.map(settle_dues, *zip(*arguments)))
+            for shard, summary in zip(shard_ids, summaries):
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        "Shard {shard}: settled {wallets} wallet(s), cleared "
+                        "{dues} due(s), {conflicts} chunk(s) left for the next "
+                        "run.".format(shard=shard, **summary)
+                    )
+                )
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from api.ledger import open_ledger, take_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Snapshot the ledger balances of all wallets that changed since the "
+        "last run. Meant to be run periodically, e.g. hourly from cron."
+    )
+
+    def handle(self, *args, **options):
+        # wallets that predate the ledger first, a no-op once all are opened
+        opened = open_ledger()
+        if opened:
+            self.stdout.write(f"Wrote {opened} opening entries.")
+        count = take_snapshots()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {count} snapshot(s)."))
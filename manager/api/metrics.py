@@ -0,0 +1,244 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from glob import glob
+
+from django.conf import settings
+
+# seconds, for request and query durations
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Registry:
+    """
+    The metrics of this process. Updates are a dict operation under a lock.
+    Under a pre-fork server every worker writes its values to METRICS_DIR
+    (at most every METRICS_FLUSH_INTERVAL seconds, and on every scrape) and
+    a scrape sums the files of all workers, so whichever worker answers
+    /metrics reports the totals.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        # name -> (help, label name, callable returning {label value: value})
+        self.collectors = {}
+        self.next_flush = 0
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def collector(self, name, help, label, collect):
+        # counters kept elsewhere (throttles, velocity checks, response cache)
+        self.collectors[name] = (help, label, collect)
+
+    def reset(self):
+        # a forked worker starts from zero, its parent's values are the parent's
+        with self.lock:
+            for metric in self.metrics.values():
+                metric.values.clear()
+
+    def snapshot(self):
+        with self.lock:
+            families = {
+                metric.name: {
+                    "type": metric.type,
+                    "help": metric.help,
+                    "labels": list(metric.labels),
+                    "buckets": list(getattr(metric, "buckets", ())),
+                    "values": [
+                        [list(key), list(value) if isinstance(value, list) else value]
+                        for key, value in metric.values.items()
+                    ],
+                }
+                for metric in self.metrics.values()
+            }
+        for name, (help, label, collect) in self.collectors.items():
+            families[name] = {
+                "type": "counter",
+                "help": help,
+                "labels": [label],
+                "buckets": [],
+                "values": [[[str(key)], value] for key, value in collect().items()],
+            }
+        return families
+
+    def path(self):
+        return os.path.join(settings.METRICS_DIR, f"metrics-{os.getpid()}.json")
+
+    def flush(self):
+        path = self.path()
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        # readers never see a half written file
+        os.replace(path + ".tmp", path)
+
+    def maybe_flush(self):
+        if settings.METRICS_DIR and time.monotonic() >= self.next_flush:
+            self.next_flush = time.monotonic() + settings.METRICS_FLUSH_INTERVAL
+            self.flush()
+
+    def collect(self):
+        """
+        The families of this process, or of all workers when METRICS_DIR is
+        set. Files of workers that exited are kept, so totals never go back.
+        """
+        if not settings.METRICS_DIR:
+            return self.snapshot()
+        self.flush()
+        merged = {}
+        for path in glob(os.path.join(settings.METRICS_DIR, "metrics-*.json")):
+            try:
+                with open(path) as f:
+                    families = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, family in families.items():
+                values = merged.setdefault(name, dict(family, values={}))["values"]
+                for key, value in family["values"]:
+                    key = tuple(key)
+                    if isinstance(value, list):
+                        previous = values.get(key, [0] * len(value))
+                        values[key] = [a + b for a, b in zip(previous, value)]
+                    else:
+                        values[key] = values.get(key, 0) + value
+        for family in merged.values():
+            family["values"] = [[list(key), value] for key, value in family["values"].items()]
+        return merged
+
+    def render(self):
+        # text exposition format
+        lines = []
+        for name, family in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            for key, value in sorted(family["values"]):
+                labels = list(zip(family["labels"], key))
+                if family["type"] != "histogram":
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+                    continue
+                # value is the count per bucket, then +Inf, then the sum
+                cumulative = 0
+                for bound, count in zip(family["buckets"] + ["+Inf"], value[:-1]):
+                    cumulative += count
+                    lines.append(
+                        f"{name}_bucket{format_labels(labels + [('le', bound)])} {cumulative}"
+                    )
+                lines.append(f"{name}_sum{format_labels(labels)} {value[-1]}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+registry = Registry()
+os.register_at_fork(after_in_child=registry.reset)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        registry.register(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with registry.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # one count per bucket, +Inf and the sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0]
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+
+http_requests = Counter(
+    "http_requests_total", "Requests by method, route and status.", ("method", "route", "status")
+)
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time until the response was returned, by method and route.",
+    ("method", "route"),
+)
+db_query_duration = Histogram(
+    "db_query_duration_seconds", "Time spent in database queries.", ("alias",)
+)
+transactions = Counter(
+    "transactions_total", "Transactions saved, by resulting status.", ("status",)
+)
+transaction_amount = Counter(
+    "transaction_amount_total", "Amount of the transactions saved, by status.", ("status",)
+)
+transaction_failures = Counter(
+    "transaction_failures_total", "Failed transactions by reason.", ("reason",)
+)
+settlements = Counter(
+    "settlement_total",
+    "Auto-settlement results: wallets settled, dues cleared, chunks in conflict.",
+    ("result",),
+)
+registrations = Counter("registrations_total", "Users registered, by type.", ("type",))
+logins = Counter("logins_total", "Login attempts by result.", ("result",))
+
+
+def status_name(status):
+    # "In Review" -> "in_review"
+    from .models import Transaction
+
+    return dict(Transaction.TRANSACTION_STATUS)[status].lower().replace(" ", "_")
+
+
+def count_transaction(status, amount, count=1):
+    name = status_name(status)
+    transactions.inc(count, status=name)
+    transaction_amount.inc(float(amount), status=name)
+
+
+def time_queries(alias):
+    # connection.execute_wrappers entry observing every query
+    def timed(execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            db_query_duration.observe(time.perf_counter() - start, alias=alias)
+
+    return timed
+
+
+def connection_created(sender, connection, **kwargs):
+    # the wrapper object outlives reconnects, install the timer once
+    if not getattr(connection, "queries_timed", False):
+        connection.queries_timed = True
+        connection.execute_wrappers.append(time_queries(connection.alias))
@@ -0,0 +1,172 @@
+import re
+import time
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from .metrics import http_request_duration, http_requests, registry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# A compressor is (compress, sync flush, finish). The sync flush ends the data
+# given so far on a byte boundary, so the client can decode it without waiting
+# for the rest of the stream.
+
+
+def gzip_compressor():
+    compressor = zlib.compressobj(settings.COMPRESSION_LEVELS["gzip"], zlib.DEFLATED, 31)
+    return (
+        compressor.compress,
+        lambda: compressor.flush(zlib.Z_SYNC_FLUSH),
+        compressor.flush,
+    )
+
+
+def brotli_compressor():
+    compressor = brotli.Compressor(quality=settings.COMPRESSION_LEVELS["br"])
+    return compressor.process, compressor.flush, compressor.finish
+
+
+def zstd_compressor():
+    compressor = zstandard.ZstdCompressor(
+        level=settings.COMPRESSION_LEVELS["zstd"]
+    ).compressobj()
+    return (
+        compressor.compress,
+        lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+        compressor.flush,
+    )
+
+
+# in order of preference, the ones whose library is missing are left out
+COMPRESSORS = {
+    encoding: compressor
+    for encoding, compressor, available in (
+        ("br", brotli_compressor, brotli is not None),
+        ("zstd", zstd_compressor, zstandard is not None),
+        ("gzip", gzip_compressor, True),
+    )
+    if available
+}
+
+ACCEPT_ENCODING_RE = re.compile(r"\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*")
+
+
+def accepted_encoding(header):
+    """
+    The preferred encoding the client accepts (q > 0), or None.
+    """
+    accepted = {}
+    for item in header.split(","):
+        match = ACCEPT_ENCODING_RE.fullmatch(item)
+        if match:
+            try:
+                accepted[match[1].lower()] = float(match[2] or 1)
+            except ValueError:
+                continue
+    return next(
+        (
+            encoding
+            for encoding in COMPRESSORS
+            if accepted.get(encoding, accepted.get("*", 0)) > 0
+        ),
+        None,
+    )
+
+
+def compress(compressor, content):
+    compress_chunk, _, finish = compressor()
+    return compress_chunk(content) + finish()
+
+
+def compress_stream(compressor, chunks):
+    # every chunk is sent as soon as it is produced, e.g. an export's rows
+    compress_chunk, sync_flush, finish = compressor()
+    for chunk in chunks:
+        if chunk:
+            yield compress_chunk(chunk) + sync_flush()
+    yield finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compress JSON responses with brotli, zstd or gzip, whichever the client
+    accepts and is installed, in that order. Only bodies between
+    COMPRESSION_MIN_SIZE (below it the headers cost more than is saved) and
+    COMPRESSION_MAX_SIZE (bounds the CPU spent per request) are compressed,
+    at the fast levels in COMPRESSION_LEVELS. Streaming responses are
+    compressed chunk by chunk.
+    """
+
+    def process_response(self, request, response):
+        content_type = response.get("Content-Type", "").split(";")[0].strip()
+        if (
+            content_type not in settings.COMPRESSION_CONTENT_TYPES
+            or response.has_header("Content-Encoding")
+        ):
+            return response
+        if not response.streaming and not (
+            settings.COMPRESSION_MIN_SIZE
+            <= len(response.content)
+            <= settings.COMPRESSION_MAX_SIZE
+        ):
+            return response
+
+        # the response depends on Accept-Encoding even if this one is not compressed
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = accepted_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(
+                COMPRESSORS[encoding], response.streaming_content
+            )
+            del response["Content-Length"]
+        else:
+            compressed = compress(COMPRESSORS[encoding], response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response["Content-Length"] = str(len(compressed))
+
+        # the bytes differ per encoding, a strong ETag would claim otherwise
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = encoding
+        return response
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """
+    Count requests and observe their duration by method and route pattern
+    (not path, which would make a series per user), see api/metrics.py.
+    """
+
+    def process_request(self, request):
+        request.metrics_start = time.perf_counter()
+
+    def process_response(self, request, response):
+        start = getattr(request, "metrics_start", None)
+        if start is None:
+            return response
+        match = getattr(request, "resolver_match", None)
+        route = match.route if match else "unmatched"
+        http_request_duration.observe(
+            time.perf_counter() - start, method=request.method, route=route
+        )
+        http_requests.inc(method=request.method, route=route, status=response.status_code)
+        registry.maybe_flush()
+        return response
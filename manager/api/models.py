@@ -1,5 +1,6 @@
-from django.db import models
-from django.db.models import Q, OuterRef
+from django.db import models, IntegrityError
+from django.db import transaction as db_transaction
+from django.db.models import F, Q, OuterRef
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
@@ -8,8 +9,12 @@ from django.contrib.auth.models import (
 )
 from django.core.validators import RegexValidator
 from datetime import datetime
+from decimal import Decimal
 from django.utils import timezone
 from django.core.exceptions import ValidationError
+from .caching import invalidate
+from .events import publish_on_commit
+from .metrics import count_transaction, transaction_failures
 import random
 import string
 
@@ -19,7 +24,9 @@ MAX_NOTIF_LEN = 256
 MAX_NOTIF_SUB_LEN = 64
 MAX_ISSUE_LEN = 512
 MAX_ISSUE_SUB_LEN = 64
-PENDING_LIMIT = 100000.0
+MAX_REFERENCE_LEN = 64
+# default dues limit of a new wallet, admins can change it per wallet
+PENDING_LIMIT = Decimal("100000")
 
 
 def get_time(timestamp):
@@ -45,6 +52,10 @@ class Wallet(models.Model):
     user = models.OneToOneField("CustomUser", on_delete=models.CASCADE)
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)
     pending = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)
+    # pending dues the wallet may reach, checked in the same UPDATE that adds them
+    pending_limit = models.DecimalField(
+        max_digits=10, decimal_places=2, default=PENDING_LIMIT
+    )
 
     def __str__(self):
         return f"{self.user.username}'s Wallet"
@@ -54,6 +65,18 @@ class Wallet(models.Model):
         super().save(*args, **kwargs)
 
 
+# Credits added to a wallet from outside (finance uploads, add_balance).
+# The reference makes every top-up idempotent: a reference is only applied once.
+class TopUp(models.Model):
+    reference = models.CharField(max_length=MAX_REFERENCE_LEN, unique=True)
+    wallet = models.ForeignKey("Wallet", on_delete=models.CASCADE)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.reference} - {self.amount}"
+
+
 class Notification(models.Model):
     """
     Class for managing notifications
@@ -66,6 +89,12 @@ class Notification(models.Model):
     content = models.TextField(max_length=MAX_NOTIF_LEN)
     mark_as_read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # admin changelist ordering and date hierarchy
+            models.Index(fields=["timestamp"]),
+        ]
+
 
 # Transaction Model instantiated when a Transaction is created
 class Transaction(models.Model):
@@ -101,8 +130,35 @@ class Transaction(models.Model):
         choices=TRANSACTION_STATUS, default=SUCCESS
     )
 
+    # FAILURE REASON, set with the FAILED status
+    INSUFFICIENT_FUNDS = 0
+    PENDING_LIMIT = 1
+    ISSUE_REJECTED = 2
+
+    FAILURE_REASONS = [
+        (INSUFFICIENT_FUNDS, "Insufficient funds"),
+        (PENDING_LIMIT, "Pending limit"),
+        (ISSUE_REJECTED, "Issue rejected"),
+    ]
+    failure_reason = models.PositiveSmallIntegerField(
+        choices=FAILURE_REASONS, null=True, blank=True
+    )
+
+    # status changes save() makes to a saved transaction, {new: (old, ...)}.
+    # Issue resolutions and settlements update the status in api.issues and
+    # api.settlement.
+    TRANSITIONS = {CLEARED: (PENDING,)}
+
     class Meta:
         unique_together = ["sender", "receiver", "transaction_id"]
+        indexes = [
+            models.Index(fields=["sender", "timestamp"]),
+            models.Index(fields=["receiver", "timestamp"]),
+            # admin changelist ordering and date hierarchy
+            models.Index(fields=["timestamp"]),
+            # failure counts by reason
+            models.Index(fields=["transaction_status", "failure_reason"]),
+        ]
 
     def __str__(self):
         return f"{self.transaction_id} - {self.transaction_status}"
@@ -115,6 +171,7 @@ class Transaction(models.Model):
                 subject="Transaction failed.",
                 content=f"Transaction at {get_time(datetime.now())} failed: amount must be greater than 0.",
             )
+            transaction_failures.inc(reason="invalid_amount")
             raise ValidationError("Transaction amount must be greater than 0")
 
         if self.sender == self.receiver:
@@ -124,12 +181,52 @@ class Transaction(models.Model):
                 subject="Transaction failed.",
                 content=f"Transaction at {get_time(datetime.now())} failed: sender and receiver identical.",
             )
+            transaction_failures.inc(reason="same_wallet")
             raise ValidationError("Sender and Receiver cannot be the same")
 
+    def fail(self, reason):
+        self.transaction_status = self.FAILED
+        self.failure_reason = reason
+        transaction_failures.inc(reason=failure_reason_name(reason))
+
     def save(self, *args, **kwargs):
-        self.clean()
-        if self.transaction_id is None:
-            self.transaction_id = generate_txn_id()
+        # a saved transaction only changes status, the wallets follow the change
+        adding = self._state.adding
+        if adding:
+            self.clean()
+            if self.transaction_id is None:
+                self.transaction_id = generate_txn_id()
+        elif self.transaction_status not in self.TRANSITIONS:
+            raise ValidationError(
+                "A saved transaction can only change from Pending to Cleared"
+            )
+
+        # wallet updates, the transaction row and its ledger entries go in together
+        with db_transaction.atomic():
+            if not adding and not Transaction.objects.filter(
+                pk=self.pk,
+                transaction_status__in=self.TRANSITIONS[self.transaction_status],
+            ).update(transaction_status=self.transaction_status):
+                # already cleared, or resolved, by someone else
+                raise ValidationError("Transaction status changed meanwhile")
+            ledger = self.apply()
+            if adding:
+                super().save(*args, **kwargs)
+                # dated with the transaction, statements put both in the same period
+                for entry in ledger:
+                    entry.timestamp = self.timestamp
+            LedgerEntry.objects.bulk_create(ledger)
+            VendorRollup.objects.record(ledger)
+            OutboxEvent.for_transaction(self).save()
+        count_transaction(self.transaction_status, self.transaction_amount)
+
+    def apply(self):
+        """
+        Update the wallets according to the status, returns the ledger entries.
+        The wallets are only written with UPDATE ... SET col = col +/- amount,
+        the in-memory wallets may be stale and are never saved.
+        """
+        ledger = []
 
         # print("Sender pending in bening: ", self.sender.pending)
         if self.transaction_status == self.CLEARED:
@@ -137,6 +234,11 @@ class Transaction(models.Model):
             # print("Sender pending: ", self.sender.pending)
             # print("Sender balance: ", self.sender.balance)
             self.sender.pending -= self.transaction_amount
+            ledger += LedgerEntry.legs(
+                self,
+                (LedgerEntry.PENDING, -self.transaction_amount),
+                (LedgerEntry.RECEIVABLE, -self.transaction_amount),
+            )
             # print("Sender pending: ", self.sender.pending)
             # self.sender.balance -= self.transaction_amount
             # self.receiver.balance += self.transaction_amount
@@ -154,12 +256,23 @@ class Transaction(models.Model):
                 content=f"Due cleared for Rs. {self.transaction_amount} from {self.sender.user.username} at {get_time(datetime.now())}.",
             )
             # saving the wallets
-            # self.sender.save()
-            super(Wallet, self.sender).save(*args, **kwargs)
-            # self.receiver.save()
+            Wallet.objects.filter(pk=self.sender.pk).update(
+                pending=F("pending") - self.transaction_amount
+            )
+            publish_on_commit([self.sender.user_id])
+            invalidate(Wallet)
         elif self.transaction_status == self.PENDING:
-            if (self.sender.pending + self.transaction_amount) <= PENDING_LIMIT:
+            # race free limit check, the in-memory pending may be stale
+            if Wallet.objects.filter(
+                pk=self.sender.pk,
+                pending__lte=F("pending_limit") - self.transaction_amount,
+            ).update(pending=F("pending") + self.transaction_amount):
                 self.sender.pending += self.transaction_amount
+                ledger += LedgerEntry.legs(
+                    self,
+                    (LedgerEntry.PENDING, self.transaction_amount),
+                    (LedgerEntry.RECEIVABLE, self.transaction_amount),
+                )
                 Notification.objects.create(
                     user=self.sender.user,
                     timestamp=self.timestamp,
@@ -173,11 +286,10 @@ class Transaction(models.Model):
                     subject="Transaction with payment pending.",
                     content=f"Received Rs. {self.transaction_amount} as PENDING from {self.sender.user.username} at {get_time(datetime.now())}.",
                 )
-                # saving the wallets
-                self.sender.save()
-                self.receiver.save()
+                publish_on_commit([self.sender.user_id])
+                invalidate(Wallet)
             else:
-                self.transaction_status = self.FAILED
+                self.fail(self.PENDING_LIMIT)
                 Notification.objects.create(
                     user=self.sender.user,
                     timestamp=self.timestamp,
@@ -185,9 +297,13 @@ class Transaction(models.Model):
                     content=f"Transaction at {get_time(datetime.now())} failed: exceeded pending dues limit.",
                 )
 
-        elif self.sender.balance < self.transaction_amount:
+        # race free overdraft check, the in-memory balance may be stale
+        elif not Wallet.objects.filter(
+            pk=self.sender.pk,
+            balance__gte=self.transaction_amount,
+        ).update(balance=F("balance") - self.transaction_amount):
             # Could ask user if they want to switch to pending mode
-            self.transaction_status = self.FAILED
+            self.fail(self.INSUFFICIENT_FUNDS)
             Notification.objects.create(
                 user=self.sender.user,
                 timestamp=self.timestamp,
@@ -200,6 +316,11 @@ class Transaction(models.Model):
             self.transaction_status = self.SUCCESS
             self.sender.balance -= self.transaction_amount
             self.receiver.balance += self.transaction_amount
+            ledger += LedgerEntry.legs(
+                self,
+                (LedgerEntry.BALANCE, -self.transaction_amount),
+                (LedgerEntry.BALANCE, self.transaction_amount),
+            )
             # print("Sender pending inside valid transaction: ", self.sender.pending)
 
             Notification.objects.create(
@@ -214,25 +335,46 @@ class Transaction(models.Model):
                 subject="Transaction success.",
                 content=f"Rs. {self.transaction_amount} received from {self.sender.user.username} at {get_time(datetime.now())}.",
             )
-            # saving the wallets
-            self.sender.save()
-            self.receiver.save()
-
-        if self.sender.balance < 0:
-            self.transaction_status = self.FAILED
-            self.sender.balance += self.transaction_amount
-            self.receiver.balance -= self.transaction_amount
-            self.sender.save()
-            self.receiver.save()
+            # saving the wallets, the sender was debited by the check above
+            Wallet.objects.filter(pk=self.receiver.pk).update(
+                balance=F("balance") + self.transaction_amount
+            )
+            publish_on_commit([self.sender.user_id, self.receiver.user_id])
+            invalidate(Wallet)
 
         # print("Sender pending final: ", self.sender.pending)
+        return ledger
 
 
-        super().save(*args, **kwargs)
+
+def failure_reason_name(reason):
+    # "Insufficient funds" -> "insufficient_funds", as in the API and metrics
+    return dict(Transaction.FAILURE_REASONS)[reason].lower().replace(" ", "_")
+
+
+def issue_notifications(user_ids, subject, content):
+    # same notification to both parties of the transaction
+    return [
+        Notification(user_id=user_id, subject=subject, content=content)
+        for user_id in user_ids
+    ]
 
 
 # Issues instantiated when a User raises one
+# open -> in review (picked up by staff) -> resolved, see api/issues.py
 class Issue(models.Model):
+    # STATE
+    OPEN = 0
+    IN_REVIEW = 1
+    RESOLVED = 2
+
+    ISSUE_STATES = [
+        (OPEN, "Open"),
+        (IN_REVIEW, "In Review"),
+        (RESOLVED, "Resolved"),
+    ]
+    # transaction statuses an issue can be resolved to
+    RESOLUTIONS = (Transaction.SUCCESS, Transaction.PENDING, Transaction.FAILED)
 
     user = models.ForeignKey("CustomUser", on_delete=models.CASCADE)
     subject = models.CharField(max_length=MAX_ISSUE_SUB_LEN)
@@ -244,103 +386,407 @@ class Issue(models.Model):
     # init_txn_status = transaction.transaction_status
     # transaction_obj = Transaction.objects.get(transaction_id=transaction.transaction_id)
 
+    state = models.PositiveSmallIntegerField(choices=ISSUE_STATES, default=OPEN)
     resolved_status = models.IntegerField(
         choices=Transaction.TRANSACTION_STATUS, default=Transaction.IN_REVIEW
     )
     # init_txn_status = transaction.transaction_status
+    # staff member who claimed the issue from the queue
+    assignee = models.ForeignKey(
+        "CustomUser",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="assigned_issues",
+    )
+
+    class Meta:
+        indexes = [
+            # staff queue and a user's own issues, both paged by (timestamp, id)
+            models.Index(fields=["state", "timestamp", "id"]),
+            models.Index(fields=["user", "timestamp", "id"]),
+        ]
 
     def __str__(self):
         return f"{self.user.username} raised an issue"
 
     def clean(self):
-        if self.transaction is None:
+        # checks for raising an issue, later changes go through api.issues
+        if not self._state.adding:
+            return None
+        if self.transaction_id is None:
             raise ValidationError("Transaction cannot be empty")
-        if (
-            self.transaction.receiver.user.username != self.user.username
-            and self.transaction.sender.user.username != self.user.username
-        ):
+        if self.resolved_status != Transaction.IN_REVIEW:
+            raise ValidationError("New issues are resolved through api.issues")
+        sender_id, receiver_id, transaction_status = Transaction.objects.values_list(
+            "sender__user_id", "receiver__user_id", "transaction_status"
+        ).get(pk=self.transaction_id)
+        if self.user_id not in (sender_id, receiver_id):
             raise ValidationError(
                 f"Not authorized to raise an issue on this transaction"
             )
 
         if (
-            self.transaction.transaction_status != Transaction.PENDING
-            and self.transaction.transaction_status != Transaction.IN_REVIEW
+            transaction_status != Transaction.PENDING
+            and transaction_status != Transaction.IN_REVIEW
         ):
             raise ValidationError(
-                f"Not allowed to raise issue on {Transaction.TRANSACTION_STATUS[self.transaction.transaction_status][1]} transaction"
+                f"Not allowed to raise issue on {Transaction.TRANSACTION_STATUS[transaction_status][1]} transaction"
             )
+        return sender_id, receiver_id
 
     def save(self, *args, **kwargs):
-        self.clean()
+        # only raising an issue has side effects, state changes go through api.issues
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+
+        parties = self.clean()
+        with db_transaction.atomic():
+            # the status condition guards against a resolution in between
+            if not Transaction.objects.filter(
+                pk=self.transaction_id,
+                transaction_status__in=(Transaction.PENDING, Transaction.IN_REVIEW),
+            ).update(transaction_status=Transaction.IN_REVIEW):
+                raise ValidationError("Transaction can no longer be disputed")
+            super().save(*args, **kwargs)
+            Notification.objects.bulk_create(
+                issue_notifications(
+                    parties,
+                    "Issue raised.",
+                    'Issue: "'
+                    + self.content
+                    + f'" for transaction ID {self.transaction_id} raised at {get_time(self.timestamp)}.',
+                )
+            )
+            OutboxEvent.objects.create(
+                kind=OutboxEvent.ISSUE_RAISED,
+                payload={
+                    "issue_id": self.pk,
+                    "transaction_id": self.transaction_id,
+                    "sender_id": parties[0],
+                    "receiver_id": parties[1],
+                    "status": Transaction.IN_REVIEW,
+                },
+            )
+            publish_on_commit(parties)
+            invalidate(Transaction)
 
-        self.transaction.transaction_status = Transaction.IN_REVIEW  # In_Review
-        super(Transaction, self.transaction).save()
 
-        if (
-            self.resolved_status == Transaction.SUCCESS
-            or self.resolved_status == Transaction.PENDING
-        ):
-            # Do nothing to balance
-            self.transaction.transaction_status = self.resolved_status
-            super(Transaction, self.transaction).save()
+# Append-only record of every change to a wallet's balance, pending dues and
+# receivable dues. A transfer writes one entry per side (debit the sender,
+# credit the receiver), the wallet columns are the running sum of these entries.
+class LedgerEntry(models.Model):
+    # ACCOUNT
+    BALANCE = 0
+    PENDING = 1  # dues the wallet owes
+    RECEIVABLE = 2  # dues owed to the wallet
 
-            Notification.objects.create(
-                user=self.transaction.sender.user,
-                timestamp=self.timestamp,
-                subject="Issue resolved.",
-                content=f"Issue for transaction {self.transaction.transaction_id} resolved to status {Transaction.TRANSACTION_STATUS[self.resolved_status][1]} at {get_time(self.timestamp)}.",
-            )
-            Notification.objects.create(
-                user=self.transaction.receiver.user,
-                timestamp=self.timestamp,
-                subject="Issue resolved.",
-                content=f"Issue for transaction {self.transaction.transaction_id} resolved to status {Transaction.TRANSACTION_STATUS[self.resolved_status][1]} at {get_time(self.timestamp)}.",
-            )
+    ACCOUNTS = [
+        (BALANCE, "Balance"),
+        (PENDING, "Pending"),
+        (RECEIVABLE, "Receivable"),
+    ]
 
-        elif self.resolved_status == Transaction.FAILED:
-            # Revert pending amount
-            self.transaction.transaction_status = Transaction.FAILED
-            # print(Transaction.TRANSACTION_STATUS[self.init_txn_status][1])
-            # if self.init_txn_status == Transaction.PENDING:
-            self.transaction.sender.pending -= self.transaction.transaction_amount
-            super(Transaction, self.transaction).save()
-            super(Wallet, self.transaction.sender).save()
+    # KIND
+    OPENING = 0
+    TRANSFER = 1
+    TOP_UP = 2
+    ADJUSTMENT = 3
+
+    KINDS = [
+        (OPENING, "Opening"),
+        (TRANSFER, "Transfer"),
+        (TOP_UP, "Top-up"),
+        (ADJUSTMENT, "Adjustment"),
+    ]
 
-            Notification.objects.create(
-                user=self.transaction.sender.user,
-                timestamp=self.timestamp,
-                subject="Issue resolved.",
-                content=f"Issue for transaction {self.transaction.transaction_id} resolved to status FAILED at {get_time(self.timestamp)}, pending amount Rs. {self.transaction.transaction_amount} reverted.",
-            )
-            Notification.objects.create(
-                user=self.transaction.receiver.user,
-                timestamp=self.timestamp,
-                subject="Issue resolved.",
-                content=f"Issue for transaction {self.transaction.transaction_id} resolved to status FAILED at {get_time(self.timestamp)}.",
-            )
+    wallet = models.ForeignKey("Wallet", on_delete=models.CASCADE)
+    account = models.PositiveSmallIntegerField(choices=ACCOUNTS)
+    kind = models.PositiveSmallIntegerField(choices=KINDS)
+    # signed change of the account
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    transaction = models.ForeignKey(
+        Transaction, on_delete=models.CASCADE, null=True, blank=True
+    )
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # entries after a snapshot are found by timestamp, see api/ledger.py
+            models.Index(fields=["wallet", "account", "timestamp"]),
+        ]
+
+    def __str__(self):
+        return f"{self.wallet_id} {self.ACCOUNTS[self.account][1]} {self.amount}"
+
+    @classmethod
+    def legs(cls, transaction, sender, receiver, kind=TRANSFER):
+        """
+        Both sides of a transfer, `sender` and `receiver` are (account, amount).
+        """
+        return [
+            cls(
+                wallet=transaction.sender,
+                account=sender[0],
+                amount=sender[1],
+                kind=kind,
+                transaction=transaction,
+            ),
+            cls(
+                wallet=transaction.receiver,
+                account=receiver[0],
+                amount=receiver[1],
+                kind=kind,
+                transaction=transaction,
+            ),
+        ]
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValidationError("Ledger entries cannot be modified")
         super().save(*args, **kwargs)
 
-        Notification.objects.create(
-            user=self.transaction.sender.user,
-            timestamp=self.timestamp,
-            subject="Issue raised.",
-            content='Issue: "'
-            + self.content
-            + f'" for transaction ID {self.transaction.transaction_id} raised at {get_time(self.timestamp)}.',
-        )
+    def delete(self, *args, **kwargs):
+        raise ValidationError("Ledger entries cannot be deleted")
+
+
+# Value of a wallet account after all entries dated up to `timestamp`, the
+# last entry id when it was taken is kept for reference.
+# Balance-at-time reads start from the latest snapshot instead of the first entry.
+class BalanceSnapshot(models.Model):
+    wallet = models.ForeignKey("Wallet", on_delete=models.CASCADE)
+    account = models.PositiveSmallIntegerField(choices=LedgerEntry.ACCOUNTS)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    last_entry_id = models.BigIntegerField()
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["wallet", "account", "timestamp"]),
+        ]
+
+    def __str__(self):
+        return f"{self.wallet_id} {LedgerEntry.ACCOUNTS[self.account][1]} {self.amount}"
+
+
+class VendorRollupManager(models.Manager):
+    def bump(self, lookup, **amounts):
+        """
+        Add `amounts` to the row identified by `lookup`, creating it if needed.
+        """
+        increments = {field: F(field) + amount for field, amount in amounts.items()}
+        if self.filter(**lookup).update(**increments):
+            return
+        try:
+            with db_transaction.atomic():
+                self.create(**lookup, **amounts)
+        except IntegrityError:
+            # created concurrently in between
+            self.filter(**lookup).update(**increments)
+
+    def record(self, entries):
+        """
+        Update the vendor rollups from the ledger entries of a transfer.
+        Balance credits count as revenue, receivable entries as pending dues
+        (positive) or settled/reverted dues (negative). Only the receiving
+        side counts, a vendor paying or refunding someone is not revenue, the
+        same as in analytics.backfill_rollups.
+        """
+        for entry in entries:
+            if (
+                entry.kind not in (LedgerEntry.TRANSFER, LedgerEntry.ADJUSTMENT)
+                or entry.wallet_id != entry.transaction.receiver_id
+                or not entry.wallet.user.is_vendor
+            ):
+                continue
+            amounts = {}
+            if entry.account == LedgerEntry.BALANCE:
+                amounts["revenue"] = entry.amount
+            elif entry.amount > 0:
+                amounts["pending"] = entry.amount
+            elif entry.kind == LedgerEntry.TRANSFER:
+                amounts["settled"] = -entry.amount
+            else:
+                amounts["pending"] = entry.amount
+            # a new payment, as opposed to its clearance or a reversal
+            if entry.amount > 0:
+                amounts["transactions"] = 1
+
+            local = timezone.localtime(entry.timestamp)
+            hour = local.replace(minute=0, second=0, microsecond=0)
+            day = hour.replace(hour=0)
+            for granularity, bucket in ((VendorRollup.HOUR, hour), (VendorRollup.DAY, day)):
+                self.bump(
+                    {"vendor": entry.wallet, "granularity": granularity, "bucket": bucket},
+                    **amounts,
+                )
+            amounts.pop("settled", None)
+            if amounts:
+                VendorCustomerRollup.objects.bump(
+                    {
+                        "vendor": entry.wallet,
+                        "customer_id": entry.transaction.sender_id,
+                        "bucket": day,
+                    },
+                    **amounts,
+                )
+
+
+# Per vendor totals by hour and by day, kept up to date by every transfer,
+# so analytics never have to scan the vendor's transactions.
+class VendorRollup(models.Model):
+    HOUR = 0
+    DAY = 1
+
+    GRANULARITIES = [
+        (HOUR, "Hour"),
+        (DAY, "Day"),
+    ]
+
+    vendor = models.ForeignKey("Wallet", on_delete=models.CASCADE)
+    granularity = models.PositiveSmallIntegerField(choices=GRANULARITIES)
+    bucket = models.DateTimeField()
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    pending = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    settled = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    transactions = models.PositiveIntegerField(default=0)
+
+    objects = VendorRollupManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["vendor", "granularity", "bucket"],
+                name="unique_vendor_rollup",
+            ),
+        ]
+
+
+# Per vendor and customer totals by day, for the top customers
+class VendorCustomerRollup(models.Model):
+    vendor = models.ForeignKey(
+        "Wallet", on_delete=models.CASCADE, related_name="customer_rollups"
+    )
+    customer = models.ForeignKey(
+        "Wallet", on_delete=models.CASCADE, related_name="vendor_rollups"
+    )
+    bucket = models.DateTimeField()
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    pending = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    transactions = models.PositiveIntegerField(default=0)
+
+    objects = VendorRollupManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["vendor", "bucket", "customer"],
+                name="unique_vendor_customer_rollup",
+            ),
+        ]
+
+
+# A vendor asking its customers to clear their dues. Requests are queued and
+# turned into reminders in batches by api/reminders.py, a vendor has at most
+# one unprocessed request at a time.
+class ClearanceRequest(models.Model):
+    vendor = models.ForeignKey("CustomUser", on_delete=models.CASCADE)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    reminders_sent = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["vendor"],
+                condition=Q(processed_at__isnull=True),
+                name="unique_pending_clearance_request",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["processed_at", "requested_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.vendor_id} requested clearance at {get_time(self.requested_at)}"
+
 
-        Notification.objects.create(
-            user=self.transaction.receiver.user,
-            timestamp=self.timestamp,
-            subject="Issue raised.",
-            content='Issue: "'
-            + self.content
-            + f'" for transaction ID {self.transaction.transaction_id} raised at {get_time(self.timestamp)}.',
+# Last reminder a customer got for a vendor, enforces the cooldown per pair
+class ClearanceReminder(models.Model):
+    vendor = models.ForeignKey(
+        "CustomUser", on_delete=models.CASCADE, related_name="+"
+    )
+    customer = models.ForeignKey(
+        "CustomUser", on_delete=models.CASCADE, related_name="+"
+    )
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    sent_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["vendor", "customer"], name="unique_clearance_reminder"
+            ),
+        ]
+
+
+# Changes to wallets and transactions for downstream consumers (finance
+# reporting, fraud checks), written in the same DB transaction as the change.
+# Consumers read them in position order, see api/outbox.py.
+class OutboxEvent(models.Model):
+    # KIND
+    TRANSFER = 0
+    SETTLEMENT = 1
+    TOP_UP = 2
+    ISSUE_RAISED = 3
+    ISSUE_RESOLVED = 4
+
+    KINDS = [
+        (TRANSFER, "Transfer"),
+        (SETTLEMENT, "Settlement"),
+        (TOP_UP, "Top-up"),
+        (ISSUE_RAISED, "Issue raised"),
+        (ISSUE_RESOLVED, "Issue resolved"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    kind = models.PositiveSmallIntegerField(choices=KINDS)
+    payload = models.JSONField()
+    timestamp = models.DateTimeField(default=timezone.now)
+    # place in commit order, given once the event is committed
+    position = models.BigIntegerField(null=True, blank=True, unique=True)
+
+    class Meta:
+        indexes = [
+            # pruning
+            models.Index(fields=["timestamp"]),
+        ]
+
+    def __str__(self):
+        return f"{self.id} {self.KINDS[self.kind][1]}"
+
+    @classmethod
+    def for_transaction(cls, transaction, kind=TRANSFER, **extra):
+        # the sender and receiver wallets must be loaded
+        return cls(
+            kind=kind,
+            payload={
+                "transaction_id": transaction.transaction_id,
+                "sender_id": transaction.sender.user_id,
+                "receiver_id": transaction.receiver.user_id,
+                "amount": f"{transaction.transaction_amount:.2f}",
+                "status": transaction.transaction_status,
+                "failure_reason": transaction.failure_reason,
+                **extra,
+            },
         )
 
 
+# Last outbox position given, its row is the lock of assign_positions
+class OutboxSequence(models.Model):
+    last = models.BigIntegerField(default=0)
+
+
 # Now to our User models
 class CustomUserManager(BaseUserManager):
     def create_user(self, username, email, phone_number, password=None, **extra_fields):
@@ -421,18 +867,29 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
 
     USERNAME_FIELD = "username"
     REQUIRED_FIELDS = ["email", "phone_number"]
+    UNIQUE_FIELDS = ("username", "email", "phone_number")
 
     objects = CustomUserManager()
 
+    class Meta:
+        constraints = [
+            # phone number is optional, only non-empty numbers have to be unique
+            models.UniqueConstraint(
+                fields=["phone_number"],
+                condition=~Q(phone_number=""),
+                name="unique_phone_number",
+            ),
+        ]
+
     def __str__(self):
         return self.username
 
     def validate_unique(self, exclude=None):
+        # username and email are unique fields and checked by super()
         super().validate_unique(exclude)
-        if CustomUser.objects.filter(email=self.email).exclude(pk=self.pk).exists():
-            raise ValidationError({"email": "This email address is already in use."})
         if (
-            CustomUser.objects.filter(phone_number=self.phone_number)
+            self.phone_number
+            and CustomUser.objects.filter(phone_number=self.phone_number)
             .exclude(pk=self.pk)
             .exists()
         ):
@@ -440,8 +897,7 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
                 {"phone_number": "This phone number is already in use."}
             )
 
-    def save(self, *args, **kwargs):
-        self.validate_unique()
+    def set_type_flags(self):
         if not self.user_id:
             self.user_id = generate_random_string(USER_ID_LENGTH)
         if not self.type or self.type == None:
@@ -454,25 +910,26 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
             self.is_vendor = False
             self.is_customer = True
 
+    def welcome_notification(self):
+        if self.type == self.Types.VENDOR:
+            content = f"Hello Vendor {self.username}, Welcome to CampusPay!"
+        else:
+            content = f"Hello Customer {self.username}, Welcome to CampusPay!"
+        return Notification(user=self, subject="Welcome!", content=content)
+
+    def save(self, *args, **kwargs):
+        # e.g. last_login updates do not touch the unique fields
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or set(update_fields) & set(self.UNIQUE_FIELDS):
+            self.validate_unique()
+        self.set_type_flags()
+        adding = self._state.adding
+
         super().save(*args, **kwargs)
         # instantiating a wallet for the user
-        if not Wallet.objects.filter(user=self).exists():
+        if adding:
             Wallet.objects.create(user=self)
-
-            if self.type == self.Types.VENDOR:
-                Notification.objects.create(
-                    user=self,
-                    timestamp=datetime.now().timestamp(),
-                    subject="Welcome!",
-                    content=f"Hello Vendor {self.username}, Welcome to CampusPay!",
-                )
-            else:
-                Notification.objects.create(
-                    user=self,
-                    timestamp=datetime.now().timestamp(),
-                    subject="Welcome!",
-                    content=f"Hello Customer {self.username}, Welcome to CampusPay!",
-                )
+            self.welcome_notification().save()
 
 
 class VendorManager(models.Manager):
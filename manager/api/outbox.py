@@ -0,0 +1,82 @@
+from django.db import transaction
+from django.db.models import F
+
+from .models import OutboxEvent, OutboxSequence
+from .services import BATCH_SIZE
+
+EVENT_FIELDS = ("id", "position", "kind", "payload", "timestamp")
+
+
+def assign_positions(limit=BATCH_SIZE):
+    """
+    Give up to `limit` committed events without a position the next
+    positions, in id order. Ids are handed out before commit, so a lower id
+    may commit after a higher one was read. Positions are only given to
+    committed events, one run at a time, so an event committing later always
+    gets a higher position than every event already served.
+    Returns the number of events positioned.
+    """
+    if not OutboxEvent.objects.filter(position=None).exists():
+        return 0
+    OutboxSequence.objects.get_or_create(pk=1)
+    with transaction.atomic():
+        # takes the row (sqlite: the database) lock before anything is read
+        OutboxSequence.objects.filter(pk=1).update(last=F("last"))
+        last = OutboxSequence.objects.get(pk=1).last
+        ids = list(
+            OutboxEvent.objects.filter(position=None)
+            .order_by("id")
+            .values_list("id", flat=True)[:limit]
+        )
+        OutboxEvent.objects.bulk_update(
+            [
+                OutboxEvent(pk=pk, position=position)
+                for position, pk in enumerate(ids, last + 1)
+            ],
+            ["position"],
+            batch_size=BATCH_SIZE,
+        )
+        OutboxSequence.objects.filter(pk=1).update(last=last + len(ids))
+    return len(ids)
+
+
+def read_events(after=0, limit=BATCH_SIZE):
+    """
+    Up to `limit` events with a position greater than `after`, in position
+    order. Consumers pass the position of the last event they processed as
+    `after`, no event can appear before it later.
+    """
+    assign_positions(limit)
+    return list(
+        OutboxEvent.objects.filter(position__gt=after)
+        .order_by("position")
+        .values(*EVENT_FIELDS)[:limit]
+    )
+
+
+def iter_events(after=0, batch_size=BATCH_SIZE):
+    # all events after `after`, read in batches
+    while True:
+        events = read_events(after, batch_size)
+        yield from events
+        if len(events) < batch_size:
+            return
+        after = events[-1]["position"]
+
+
+def prune_events(before, batch_size=BATCH_SIZE):
+    """
+    Delete the events older than `before` in batches, so no long delete holds
+    the table. Events not served yet are kept. Returns the number of events
+    deleted.
+    """
+    count = 0
+    while True:
+        ids = list(
+            OutboxEvent.objects.filter(timestamp__lt=before, position__isnull=False)
+            .order_by("id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            return count
+        count += OutboxEvent.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .events import publish_on_commit
+from .models import (
+    ClearanceReminder,
+    ClearanceRequest,
+    Notification,
+    Transaction,
+)
+from .services import BATCH_SIZE, chunked
+
+
+def request_clearance(vendor):
+    """
+    Queue reminders to the vendor's customers with pending dues. Repeated
+    calls before the queue is processed are absorbed by the pending request.
+    Returns True if a new request was queued.
+    """
+    if ClearanceRequest.objects.filter(vendor=vendor, processed_at=None).exists():
+        return False
+    try:
+        with transaction.atomic():
+            ClearanceRequest.objects.create(vendor=vendor)
+    except IntegrityError:
+        # a concurrent call queued it first
+        return False
+    return True
+
+
+def send_reminders_for(clearance_request, now):
+    """
+    Remind every customer owing the vendor money, except those reminded
+    within CLEARANCE_REMINDER_COOLDOWN. Returns the number of reminders,
+    None if the request was already processed.
+    The request is claimed first with a conditional update, so of two
+    concurrent runs only one sends its reminders.
+    The dues and the cooldown are read after the claim in the same
+    transaction, so they include the reminders of any earlier run.
+    """
+    vendor = clearance_request.vendor
+    with transaction.atomic():
+        claimed = ClearanceRequest.objects.filter(
+            pk=clearance_request.pk, processed_at=None
+        ).update(processed_at=now)
+        if not claimed:
+            return None
+        dues = (
+            Transaction.objects.filter(
+                receiver__user=vendor, transaction_status=Transaction.PENDING
+            )
+            .values_list("sender__user_id")
+            .annotate(total=Sum("transaction_amount"))
+            .order_by()
+        )
+        cooling_down = set(
+            ClearanceReminder.objects.filter(
+                vendor=vendor, sent_at__gt=now - settings.CLEARANCE_REMINDER_COOLDOWN
+            ).values_list("customer_id", flat=True)
+        )
+        dues = [
+            (customer, total) for customer, total in dues if customer not in cooling_down
+        ]
+        for chunk in chunked(dues):
+            Notification.objects.bulk_create(
+                [
+                    Notification(
+                        user_id=customer,
+                        subject="Requesting clearance of pending dues",
+                        content=f"You have pending dues of Rs. {total} with {vendor.user_id}. Kindly clear the dues.",
+                    )
+                    for customer, total in chunk
+                ]
+            )
+            ClearanceReminder.objects.bulk_create(
+                [
+                    ClearanceReminder(
+                        vendor=vendor, customer_id=customer, amount=total, sent_at=now
+                    )
+                    for customer, total in chunk
+                ],
+                update_conflicts=True,
+                unique_fields=["vendor", "customer"],
+                update_fields=["amount", "sent_at"],
+            )
+            publish_on_commit(customer for customer, _ in chunk)
+        ClearanceRequest.objects.filter(pk=clearance_request.pk).update(
+            reminders_sent=len(dues)
+        )
+    clearance_request.processed_at = now
+    clearance_request.reminders_sent = len(dues)
+    return len(dues)
+
+
+def send_reminders(limit=None):
+    """
+    Process the queued clearance requests, oldest first. Requests claimed
+    by a concurrent run in the meantime are skipped.
+    Returns (requests processed, reminders sent).
+    """
+    requests = ClearanceRequest.objects.filter(processed_at=None).select_related(
+        "vendor"
+    ).order_by("requested_at")
+    if limit:
+        requests = requests[:limit]
+    processed = sent = 0
+    for clearance_request in requests:
+        reminders = send_reminders_for(clearance_request, timezone.now())
+        if reminders is None:
+            continue
+        sent += reminders
+        processed += 1
+    return processed, sent
@@ -1,17 +1,100 @@
-from rest_framework import serializers
-from .models import CustomUser, Transaction, Wallet,Notification
+from datetime import timedelta
+from decimal import Decimal
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from .models import (
+    CustomUser,
+    Transaction,
+    Wallet,
+    Notification,
+    USER_ID_LENGTH,
+    MAX_REFERENCE_LEN,
+    MAX_ISSUE_SUB_LEN,
+    MAX_ISSUE_LEN,
+)
 
-class CustomUserSerializer(serializers.ModelSerializer):
+def requested_fields(request):
+    """
+    Field names from ?fields=a,b,c on a GET, None when all fields are wanted.
+    """
+    if request is None or request.method != "GET" or not request.GET.get("fields"):
+        return None
+    return {name.strip() for name in request.GET["fields"].split(",") if name.strip()}
+
+
+def sparse_queryset(queryset, fields):
+    # load only the columns behind the requested fields
+    if fields is None or not hasattr(queryset, "only"):
+        return queryset
+    columns = {field.name for field in queryset.model._meta.concrete_fields}
+    return queryset.only(queryset.model._meta.pk.name, *(fields & columns))
+
+
+# ?fields= narrows the output to the given fields (sparse fieldsets)
+class SparseFieldsMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = requested_fields(self.context.get("request"))
+        if fields is None:
+            return
+        unknown = fields - set(self.fields)
+        if unknown:
+            raise serializers.ValidationError(
+                {"fields": [f"Unknown fields: {', '.join(sorted(unknown))}"]}
+            )
+        for name in set(self.fields) - fields:
+            self.fields.pop(name)
+
+class CustomUserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         fields = "__all__"
 
-class TransactionSerializer(serializers.ModelSerializer):
+class TransactionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = "__all__"
+        # set by Transaction.save when it fails the payment
+        read_only_fields = ("failure_reason",)
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Notification
-        fields = "__all__"
\ No newline at end of file
+        fields = "__all__"
+
+class TopUpSerializer(serializers.Serializer):
+    user_id = serializers.CharField(max_length=USER_ID_LENGTH)
+    amount = serializers.DecimalField(
+        max_digits=10, decimal_places=2, min_value=Decimal("0.01")
+    )
+    reference = serializers.CharField(max_length=MAX_REFERENCE_LEN)
+
+class BulkTransferItemSerializer(serializers.Serializer):
+    receiver_id = serializers.CharField(max_length=USER_ID_LENGTH)
+    amount = serializers.DecimalField(
+        max_digits=10, decimal_places=2, min_value=Decimal("0.01")
+    )
+
+
+class IssueRaiseSerializer(serializers.Serializer):
+    transaction_id = serializers.CharField()
+    subject = serializers.CharField(max_length=MAX_ISSUE_SUB_LEN)
+    content = serializers.CharField(max_length=MAX_ISSUE_LEN)
+
+
+class VendorAnalyticsQuerySerializer(serializers.Serializer):
+    # naive and date-only values are taken in the current time zone
+    start = serializers.DateTimeField(
+        required=False, input_formats=[ISO_8601, "%Y-%m-%d"]
+    )
+    end = serializers.DateTimeField(required=False, input_formats=[ISO_8601, "%Y-%m-%d"])
+    granularity = serializers.ChoiceField(
+        choices=("hour", "day", "week"), default="day"
+    )
+
+    def validate(self, data):
+        data.setdefault("end", timezone.now())
+        data.setdefault("start", data["end"] - timedelta(days=30))
+        if data["start"] >= data["end"]:
+            raise serializers.ValidationError("start must be before end.")
+        return data
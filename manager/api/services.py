@@ -0,0 +1,314 @@
+from decimal import Decimal
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils import timezone
+from rest_framework import serializers
+
+from .caching import invalidate
+from .events import publish_on_commit, publish_wallets_on_commit
+from .metrics import count_transaction, transaction_failures
+from .models import (
+    LedgerEntry,
+    Notification,
+    OutboxEvent,
+    TopUp,
+    Transaction,
+    VendorRollup,
+    Wallet,
+    get_time,
+)
+from .serializers import BulkTransferItemSerializer, TopUpSerializer
+from .velocity import check_transfers
+
+# keeps IN lists and CASE expressions well below the DB parameter limits
+BATCH_SIZE = 500
+# items accepted by one bulk transfer
+MAX_BULK_TRANSFER = 1000
+
+
+def chunked(iterable, size=BATCH_SIZE):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def credit_wallets(credits, field="balance"):
+    """
+    Add the amounts in `credits` ({wallet pk: Decimal}) to `field` of the
+    wallets (balance or pending) with one UPDATE ... SET balance = balance +
+    CASE ... per batch. Negative amounts debit.
+    The addition happens in the DB, so concurrent updates are not lost.
+    """
+    for chunk in chunked(credits.items()):
+        Wallet.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+            **{
+                field: F(field)
+                + Case(
+                    *[When(pk=pk, then=Value(amount)) for pk, amount in chunk],
+                    output_field=DecimalField(max_digits=10, decimal_places=2),
+                )
+            }
+        )
+    publish_wallets_on_commit(credits)
+    invalidate(Wallet)
+
+
+def debit_wallets(debits):
+    """
+    Take the amounts in `debits` ({wallet pk: Decimal}) from the balance of
+    the wallets that can still pay them, in the same UPDATE that checks the
+    balance, so concurrent debits cannot overdraw a wallet whatever the
+    database locks. Returns the number of wallets debited, the caller rolls
+    back when it is short.
+    """
+    debited = 0
+    for chunk in chunked(debits.items()):
+        amounts = Case(
+            *[When(pk=pk, then=Value(amount)) for pk, amount in chunk],
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        )
+        debited += Wallet.objects.filter(
+            pk__in=[pk for pk, _ in chunk], balance__gte=amounts
+        ).update(balance=F("balance") - amounts)
+    publish_wallets_on_commit(debits)
+    invalidate(Wallet)
+    return debited
+
+
+def top_up_wallets(rows):
+    """
+    Apply a batch of top-ups, each a dict with user_id, amount and reference.
+    Returns one result per row, in order, with the status "applied",
+    "duplicate" (reference already used) or "invalid".
+    All credits are applied in one transaction, so either every applied row
+    is visible or none is.
+    """
+    results = [None] * len(rows)
+    valid = {}
+    for index, row in enumerate(rows):
+        serializer = TopUpSerializer(data=row)
+        if not serializer.is_valid():
+            results[index] = {
+                "reference": row.get("reference") if isinstance(row, dict) else None,
+                "status": "invalid",
+                "errors": serializer.errors,
+            }
+        elif serializer.validated_data["reference"] in valid:
+            results[index] = {
+                "reference": serializer.validated_data["reference"],
+                "status": "duplicate",
+            }
+        else:
+            valid[serializer.validated_data["reference"]] = (
+                index,
+                serializer.validated_data,
+            )
+
+    with transaction.atomic():
+        used = set()
+        wallets = {}
+        for chunk in chunked(valid):
+            used.update(
+                TopUp.objects.filter(reference__in=chunk).values_list(
+                    "reference", flat=True
+                )
+            )
+        for chunk in chunked({data["user_id"] for _, data in valid.values()}):
+            wallets.update(
+                Wallet.objects.filter(user_id__in=chunk).values_list("user_id", "pk")
+            )
+
+        top_ups = []
+        credits = {}
+        for reference, (index, data) in valid.items():
+            result = {"reference": reference, "user_id": data["user_id"]}
+            if reference in used:
+                result["status"] = "duplicate"
+            elif data["user_id"] not in wallets:
+                result["status"] = "invalid"
+                result["errors"] = {"user_id": ["User not found."]}
+            else:
+                wallet = wallets[data["user_id"]]
+                result["status"] = "applied"
+                result["amount"] = data["amount"]
+                top_ups.append(
+                    TopUp(reference=reference, wallet_id=wallet, amount=data["amount"])
+                )
+                credits[wallet] = credits.get(wallet, Decimal("0")) + data["amount"]
+            results[index] = result
+
+        # the unique reference makes a concurrent batch with the same
+        # reference fail here instead of crediting twice
+        TopUp.objects.bulk_create(top_ups, batch_size=BATCH_SIZE)
+        LedgerEntry.objects.bulk_create(
+            [
+                LedgerEntry(
+                    wallet_id=top_up.wallet_id,
+                    account=LedgerEntry.BALANCE,
+                    amount=top_up.amount,
+                    kind=LedgerEntry.TOP_UP,
+                )
+                for top_up in top_ups
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        OutboxEvent.objects.bulk_create(
+            [
+                OutboxEvent(
+                    kind=OutboxEvent.TOP_UP,
+                    payload={
+                        "reference": result["reference"],
+                        "user_id": result["user_id"],
+                        "amount": str(result["amount"]),
+                    },
+                )
+                for result in results
+                if result["status"] == "applied"
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        credit_wallets(credits)
+    return results
+
+
+class BulkTransferConflict(Exception):
+    # the sender's balance was spent while the batch was paid, it is rolled back
+    pass
+
+
+def bulk_transfer(sender_id, items):
+    """
+    Pay a batch of items, each a dict with receiver_id and amount, from the
+    wallet of `sender_id`. Returns one result per item, in order, with the
+    status "applied", "failed" (the balance left does not cover it) or
+    "invalid". Items are paid in order until the balance runs out.
+    The items go through the velocity checks together, as one request. The
+    sender is debited once with a balance-guarded UPDATE and all applied
+    items are written with set-based updates and bulk inserts in one
+    transaction. Raises VelocityLimitExceeded, or BulkTransferConflict when
+    the balance changed meanwhile.
+    """
+    results = [None] * len(items)
+    valid = []
+    # one serializer for all items, building its fields per item costs more
+    # than validating them
+    serializer = BulkTransferItemSerializer()
+    for index, item in enumerate(items):
+        try:
+            data = serializer.run_validation(item)
+        except serializers.ValidationError as e:
+            results[index] = {"status": "invalid", "errors": e.detail}
+            continue
+        if data["receiver_id"] == sender_id:
+            results[index] = {
+                "receiver_id": sender_id,
+                "status": "invalid",
+                "errors": {"receiver_id": ["Sender and Receiver cannot be the same"]},
+            }
+        else:
+            valid.append((index, data))
+
+    now = timezone.now()
+    with transaction.atomic():
+        sender = (
+            Wallet.objects.select_for_update(of=("self",))
+            .select_related("user")
+            .get(user_id=sender_id)
+        )
+        receivers = {}
+        for chunk in chunked({data["receiver_id"] for _, data in valid}):
+            receivers.update(
+                (wallet.user_id, wallet)
+                for wallet in Wallet.objects.filter(user_id__in=chunk).select_related("user")
+            )
+        # items the balance will not cover count too, as a single transfer
+        # that fails for funds does
+        check_transfers(
+            sender_id,
+            [
+                (data["receiver_id"], data["amount"])
+                for _, data in valid
+                if data["receiver_id"] in receivers
+            ],
+        )
+
+        balance = sender.balance
+        payments = []
+        for index, data in valid:
+            result = {"receiver_id": data["receiver_id"], "amount": data["amount"]}
+            if data["receiver_id"] not in receivers:
+                result["status"] = "invalid"
+                result["errors"] = {"receiver_id": ["User not found."]}
+            elif data["amount"] > balance:
+                result["status"] = "failed"
+                result["failure_reason"] = Transaction.INSUFFICIENT_FUNDS
+                result["errors"] = {"amount": ["Insufficient funds."]}
+            else:
+                balance -= data["amount"]
+                payment = Transaction(
+                    sender=sender,
+                    receiver=receivers[data["receiver_id"]],
+                    transaction_amount=data["amount"],
+                    transaction_status=Transaction.SUCCESS,
+                )
+                payments.append(payment)
+                result["status"] = "applied"
+                result["transaction_id"] = payment.transaction_id
+            results[index] = result
+        failed = sum(1 for result in results if result["status"] == "failed")
+        if failed:
+            transaction_failures.inc(failed, reason="insufficient_funds")
+        if not payments:
+            return results
+
+        # the balance read above may be stale, the debit checks it again
+        if not debit_wallets({sender.pk: sender.balance - balance}):
+            raise BulkTransferConflict("balance spent meanwhile")
+        Transaction.objects.bulk_create(payments, batch_size=BATCH_SIZE)
+        credits = {}
+        ledger = []
+        receiver_legs = []
+        notifications = []
+        for payment in payments:
+            amount = payment.transaction_amount
+            credits[payment.receiver_id] = credits.get(payment.receiver_id, 0) + amount
+            legs = LedgerEntry.legs(
+                payment, (LedgerEntry.BALANCE, -amount), (LedgerEntry.BALANCE, amount)
+            )
+            for leg in legs:
+                leg.timestamp = payment.timestamp
+            ledger += legs
+            receiver_legs.append(legs[1])
+            notifications.append(
+                Notification(
+                    user_id=payment.receiver.user_id,
+                    subject="Transaction success.",
+                    content=f"Rs. {amount} received from {sender.user.username} at {get_time(now)}.",
+                )
+            )
+        notifications.append(
+            Notification(
+                user_id=sender.user_id,
+                subject="Bulk transfer success.",
+                content=f"Rs. {sender.balance - balance} sent to {len(payments)} receiver(s) at {get_time(now)}.",
+            )
+        )
+
+        credit_wallets(credits)
+        LedgerEntry.objects.bulk_create(ledger, batch_size=BATCH_SIZE)
+        # only the receiving side counts in the rollups
+        VendorRollup.objects.record(receiver_legs)
+        Notification.objects.bulk_create(notifications, batch_size=BATCH_SIZE)
+        OutboxEvent.objects.bulk_create(
+            [OutboxEvent.for_transaction(payment) for payment in payments],
+            batch_size=BATCH_SIZE,
+        )
+        publish_on_commit(notification.user_id for notification in notifications)
+        invalidate(Transaction)
+    count_transaction(Transaction.SUCCESS, sender.balance - balance, len(payments))
+    return results
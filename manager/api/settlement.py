@@ -0,0 +1,192 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from .caching import invalidate
+from .events import publish_on_commit
+from .metrics import count_transaction, settlements
+from .models import (
+    LedgerEntry,
+    Notification,
+    OutboxEvent,
+    Transaction,
+    VendorRollup,
+    Wallet,
+    get_time,
+)
+from .services import BATCH_SIZE, chunked, credit_wallets, debit_wallets
+
+# POLICY
+NIGHTLY = "nightly"  # every wallet that can pay all of its dues
+THRESHOLD = "threshold"  # only wallets whose dues reached a share of their limit
+POLICIES = (NIGHTLY, THRESHOLD)
+
+# wallets settled per database transaction
+CHUNK_SIZE = 100
+
+
+class SettlementConflict(Exception):
+    # dues or balances changed between reading and settling them, the chunk is
+    # rolled back
+    pass
+
+
+def due_wallets(policy=NIGHTLY, threshold=0, shard=0, shards=1):
+    """
+    Wallets with pending dues and a positive balance, in pk order. With
+    `shards` > 1 only the wallets of one shard (pk modulo shards).
+    Whether the balance covers the dues is checked when settling.
+    """
+    wallets = Wallet.objects.filter(pending__gt=0, balance__gt=0)
+    if policy == THRESHOLD:
+        wallets = wallets.filter(pending__gte=F("pending_limit") * threshold)
+    if shards > 1:
+        wallets = wallets.annotate(shard=Mod("pk", shards)).filter(shard=shard)
+    return wallets.order_by("pk")
+
+
+def settle_wallets(wallet_ids):
+    """
+    Clear the pending dues of the given wallets that can pay all of them,
+    the same way clear_dues does: the dues become CLEARED and each vendor gets
+    one successful payment for their total. Set based, a fixed number of
+    queries per batch however many dues there are.
+    Returns the number of wallets settled and of dues cleared.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        wallets = Wallet.objects.select_for_update(of=("self",)).select_related("user")
+        wallets = {wallet.pk: wallet for wallet in wallets.filter(pk__in=wallet_ids)}
+        dues = list(
+            Transaction.objects.select_for_update()
+            .filter(sender__in=wallets, transaction_status=Transaction.PENDING)
+            .only("transaction_id", "sender", "receiver", "transaction_amount")
+        )
+        totals = {}
+        for due in dues:
+            totals[due.sender_id] = (
+                totals.get(due.sender_id, Decimal("0")) + due.transaction_amount
+            )
+        # a first pick, the debit below checks the balance again
+        settled = {pk for pk, total in totals.items() if wallets[pk].balance >= total}
+        dues = [due for due in dues if due.sender_id in settled]
+        if not dues:
+            return 0, 0
+
+        cleared = 0
+        for chunk in chunked(dues):
+            cleared += Transaction.objects.filter(
+                pk__in=[due.pk for due in chunk],
+                transaction_status=Transaction.PENDING,
+            ).update(transaction_status=Transaction.CLEARED)
+        if cleared != len(dues):
+            raise SettlementConflict(f"{len(dues) - cleared} due(s) changed meanwhile")
+        # a transfer committed since the balances were read may have spent them
+        if debit_wallets({pk: totals[pk] for pk in settled}) != len(settled):
+            raise SettlementConflict("balance spent meanwhile")
+
+        receivers = {}
+        for chunk in chunked({due.receiver_id for due in dues}):
+            receivers.update(
+                (wallet.pk, wallet)
+                for wallet in Wallet.objects.filter(pk__in=chunk).select_related("user")
+            )
+
+        ledger = []
+        pairs = {}
+        for due in dues:
+            due.sender, due.receiver = wallets[due.sender_id], receivers[due.receiver_id]
+            ledger += LedgerEntry.legs(
+                due,
+                (LedgerEntry.PENDING, -due.transaction_amount),
+                (LedgerEntry.RECEIVABLE, -due.transaction_amount),
+            )
+            pair = (due.sender_id, due.receiver_id)
+            pairs[pair] = pairs.get(pair, Decimal("0")) + due.transaction_amount
+
+        payments = [
+            Transaction(
+                sender=wallets[sender],
+                receiver=receivers[receiver],
+                transaction_amount=amount,
+                transaction_status=Transaction.SUCCESS,
+            )
+            for (sender, receiver), amount in pairs.items()
+        ]
+        Transaction.objects.bulk_create(payments, batch_size=BATCH_SIZE)
+
+        credits = {}
+        notifications = []
+        cleared_ids = {}
+        for due in dues:
+            cleared_ids.setdefault((due.sender_id, due.receiver_id), []).append(due.pk)
+        events = []
+        for payment in payments:
+            amount = payment.transaction_amount
+            events.append(
+                OutboxEvent.for_transaction(
+                    payment,
+                    OutboxEvent.SETTLEMENT,
+                    cleared=cleared_ids[payment.sender_id, payment.receiver_id],
+                )
+            )
+            ledger += LedgerEntry.legs(
+                payment, (LedgerEntry.BALANCE, -amount), (LedgerEntry.BALANCE, amount)
+            )
+            credits[payment.receiver_id] = credits.get(payment.receiver_id, 0) + amount
+            notifications += [
+                Notification(
+                    user_id=payment.sender.user_id,
+                    subject="Dues cleared.",
+                    content=f"Dues of Rs. {amount} to {payment.receiver.user.username} cleared automatically at {get_time(now)}.",
+                ),
+                Notification(
+                    user_id=payment.receiver.user_id,
+                    subject="Dues cleared.",
+                    content=f"Dues of Rs. {amount} from {payment.sender.user.username} cleared automatically at {get_time(now)}.",
+                ),
+            ]
+
+        credit_wallets({pk: -totals[pk] for pk in settled}, field="pending")
+        credit_wallets(credits)
+        LedgerEntry.objects.bulk_create(ledger, batch_size=BATCH_SIZE)
+        VendorRollup.objects.record(ledger)
+        Notification.objects.bulk_create(notifications, batch_size=BATCH_SIZE)
+        OutboxEvent.objects.bulk_create(events, batch_size=BATCH_SIZE)
+        publish_on_commit(notification.user_id for notification in notifications)
+        invalidate(Transaction)
+    count_transaction(Transaction.CLEARED, sum(totals[pk] for pk in settled), len(dues))
+    count_transaction(Transaction.SUCCESS, sum(pairs.values()), len(payments))
+    return len(settled), len(dues)
+
+
+def settle_dues(policy=NIGHTLY, threshold=0, shard=0, shards=1, chunk_size=CHUNK_SIZE):
+    """
+    Sweep the due wallets of a shard and settle them chunk by chunk, each
+    chunk in its own transaction. Settled wallets drop out of the sweep, so a
+    crashed run is resumed by simply running it again.
+    Returns a summary with the wallets settled, dues cleared and chunks that
+    were skipped because of concurrent changes.
+    """
+    summary = {"wallets": 0, "dues": 0, "conflicts": 0}
+    wallets = due_wallets(policy, threshold, shard, shards).values_list("pk", flat=True)
+    last = None
+    while True:
+        chunk = wallets if last is None else wallets.filter(pk__gt=last)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            for result, count in summary.items():
+                settlements.inc(count, result=result)
+            return summary
+        try:
+            settled, cleared = settle_wallets(chunk)
+        except SettlementConflict:
+            # left for the next run
+            summary["conflicts"] += 1
+        else:
+            summary["wallets"] += settled
+            summary["dues"] += cleared
+        last = chunk[-1]
@@ -0,0 +1,92 @@
+import asyncio
+from contextlib import suppress
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.http import StreamingHttpResponse
+
+# receive channel of the request being handled, to notice disconnects
+current_receive = ContextVar("current_receive")
+
+
+def format_event(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines += [f"data: {line}" for line in data.splitlines()]
+    return "\n".join(lines) + "\n\n"
+
+
+class EventStreamResponse(StreamingHttpResponse):
+    """
+    text/event-stream response fed by an async generator of strings. Needs
+    EventStreamASGIHandler, Django 4.1 only streams sync iterators.
+    """
+
+    def __init__(self, events, *args, **kwargs):
+        super().__init__((), *args, content_type="text/event-stream", **kwargs)
+        self.events = events
+        self["Cache-Control"] = "no-cache"
+        # stops nginx from buffering the stream
+        self["X-Accel-Buffering"] = "no"
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+class EventStreamASGIHandler(ASGIHandler):
+    """
+    ASGIHandler that can send EventStreamResponse, and stops the stream as
+    soon as the client goes away.
+    """
+
+    async def __call__(self, scope, receive, send):
+        current_receive.set(receive)
+        await super().__call__(scope, receive, send)
+
+    async def send_response(self, response, send):
+        if not isinstance(response, EventStreamResponse):
+            return await super().send_response(response, send)
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [
+                    (header.encode("ascii"), value.encode("latin1"))
+                    for header, value in response.items()
+                ],
+            }
+        )
+        disconnected = asyncio.ensure_future(wait_for_disconnect(current_receive.get()))
+        events = response.events
+        try:
+            while True:
+                event = asyncio.ensure_future(events.__anext__())
+                await asyncio.wait(
+                    {event, disconnected}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not event.done():
+                    event.cancel()
+                    with suppress(asyncio.CancelledError):
+                        await event
+                    break
+                try:
+                    chunk = event.result()
+                except StopAsyncIteration:
+                    await send({"type": "http.response.body"})
+                    break
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk.encode(),
+                        "more_body": True,
+                    }
+                )
+        finally:
+            disconnected.cancel()
+            await events.aclose()
+            await sync_to_async(response.close, thread_sensitive=True)()
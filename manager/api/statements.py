@@ -0,0 +1,208 @@
+import csv
+import os
+
+from django.db.models import Q
+
+from .ledger import balance_before
+from .models import Transaction, Wallet
+
+CHUNK_SIZE = 2000
+STATEMENT_FIELDS = (
+    "transaction_id",
+    "timestamp",
+    "direction",
+    "counterparty_id",
+    "counterparty",
+    "amount",
+    "status",
+)
+
+
+def iter_transactions(wallet, start, end, chunk_size=CHUNK_SIZE):
+    """
+    Yield the wallet's transactions in [start, end) ordered by time.
+    Rows are fetched in keyset-paginated chunks, so memory stays bounded and
+    no read transaction is held open between chunks (long reads lock sqlite).
+    """
+    queryset = (
+        Transaction.objects.filter(
+            Q(sender=wallet) | Q(receiver=wallet),
+            timestamp__gte=start,
+            timestamp__lt=end,
+        )
+        .order_by("timestamp", "transaction_id")
+        .values_list(
+            "transaction_id",
+            "timestamp",
+            "sender_id",
+            "sender__user__user_id",
+            "sender__user__username",
+            "receiver__user__user_id",
+            "receiver__user__username",
+            "transaction_amount",
+            "transaction_status",
+        )
+    )
+    last = None
+    while True:
+        chunk = queryset
+        if last is not None:
+            chunk = chunk.filter(
+                Q(timestamp__gt=last[1])
+                | Q(timestamp=last[1], transaction_id__gt=last[0])
+            )
+        rows = list(chunk[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]
+
+
+def statement_rows(wallet, start, end, totals):
+    """
+    Statement lines for the wallet, `totals` is filled on the way with
+    [count, amount] per (counterparty, direction, status).
+    """
+    statuses = dict(Transaction.TRANSACTION_STATUS)
+    for (
+        transaction_id,
+        timestamp,
+        sender_wallet,
+        sender_id,
+        sender_name,
+        receiver_id,
+        receiver_name,
+        amount,
+        status,
+    ) in iter_transactions(wallet, start, end):
+        if sender_wallet == wallet.pk:
+            direction, counterparty_id, counterparty = "sent", receiver_id, receiver_name
+        else:
+            direction, counterparty_id, counterparty = "received", sender_id, sender_name
+        total = totals.setdefault((counterparty, direction, statuses[status]), [0, 0])
+        total[0] += 1
+        total[1] += amount
+        yield (
+            transaction_id,
+            timestamp.isoformat(),
+            direction,
+            counterparty_id,
+            counterparty,
+            amount,
+            statuses[status],
+        )
+
+
+def generate_statement(user_id, start, end, directory, pdf=False):
+    """
+    Write the statement of a user for [start, end) to `directory`, as CSV and
+    optionally as PDF. Rows are written as they are read.
+    Returns a summary with the file name, row count and balances.
+    """
+    wallet = Wallet.objects.select_related("user").get(user__user_id=user_id)
+    name = f"{user_id}_{start:%Y%m%d}_{end:%Y%m%d}"
+    path = os.path.join(directory, name + (".pdf" if pdf else ".csv"))
+    opening = balance_before(wallet, start)
+    closing = balance_before(wallet, end)
+    totals = {}
+    count = 0
+
+    if pdf:
+        with open(path, "wb") as f:
+            writer = SimplePdf(f)
+            writer.line(f"CampusPay statement for {wallet.user.username} ({user_id})")
+            writer.line(f"{start:%d-%m-%Y} to {end:%d-%m-%Y}, opening balance Rs. {opening}")
+            writer.line("")
+            for row in statement_rows(wallet, start, end, totals):
+                writer.line("{0}  {1:.16}  {2:<8} {4:<20.20} {5:>12}  {6}".format(*row))
+                count += 1
+            writer.line("")
+            writer.line(f"Closing balance Rs. {closing}")
+            for (counterparty, direction, status), (n, amount) in sorted(totals.items()):
+                writer.line(f"{counterparty:<20.20} {direction:<8} {status:<10} {n:>6} {amount:>12}")
+            writer.close()
+    else:
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(STATEMENT_FIELDS)
+            for row in statement_rows(wallet, start, end, totals):
+                writer.writerow(row)
+                count += 1
+            writer.writerow([])
+            writer.writerow(("summary", "opening_balance", opening, "closing_balance", closing))
+            writer.writerow(("counterparty", "direction", "status", "count", "amount"))
+            for (counterparty, direction, status), (n, amount) in sorted(totals.items()):
+                writer.writerow((counterparty, direction, status, n, amount))
+
+    return {
+        "user_id": user_id,
+        "path": path,
+        "transactions": count,
+        "opening_balance": opening,
+        "closing_balance": closing,
+    }
+
+
+class SimplePdf:
+    """
+    Minimal text-only PDF writer. Every page is written to the file as soon as
+    it is full, only the page object numbers are kept until `close`.
+    """
+
+    LINES_PER_PAGE = 64
+    # 1 is the catalog, 2 the page tree and 3 the font, written on close
+    FIRST_FREE_OBJECT = 4
+
+    def __init__(self, f):
+        self.f = f
+        self.offsets = {}
+        self.pages = []
+        self.lines = []
+        self.next_object = self.FIRST_FREE_OBJECT
+        self.f.write(b"%PDF-1.4\n")
+
+    def line(self, text):
+        self.lines.append(text)
+        if len(self.lines) == self.LINES_PER_PAGE:
+            self.write_page()
+
+    def write_object(self, number, body):
+        self.offsets[number] = self.f.tell()
+        self.f.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+
+    def write_page(self):
+        text = "\n".join(
+            "(%s) '" % line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            for line in self.lines
+        )
+        stream = f"BT /F1 8 Tf 30 812 Td 12 TL\n{text}\nET".encode("latin-1", "replace")
+        content, page = self.next_object, self.next_object + 1
+        self.next_object += 2
+        self.write_object(
+            content, b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        )
+        self.write_object(
+            page,
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content,
+        )
+        self.pages.append(page)
+        self.lines = []
+
+    def close(self):
+        if self.lines or not self.pages:
+            self.write_page()
+        self.write_object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>")
+        kids = b" ".join(b"%d 0 R" % page for page in self.pages)
+        self.write_object(
+            2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.pages))
+        )
+        self.write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        xref = self.f.tell()
+        self.f.write(b"xref\n0 %d\n0000000000 65535 f \n" % self.next_object)
+        for number in range(1, self.next_object):
+            self.f.write(b"%010d 00000 n \n" % self.offsets[number])
+        self.f.write(
+            b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (self.next_object, xref)
+        )
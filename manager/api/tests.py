@@ -1,3 +1,1614 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from itertools import count
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import transaction as db_transaction
+from django.db.models import Sum
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import (
+    AsyncClient,
+    Client,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import resolve, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from auth_system.tokens import UserRefreshToken
+
+from . import caching, metrics, middleware, services, settlement, throttles, velocity, views
+from .admin import WalletAdmin
+from .async_views import (
+    AsyncNotificationStream,
+    AsyncUserNotificationList,
+    notification_events,
+)
+from .events import broker, publish_on_commit
+from .issues import claim_issues, resolve_issues, start_review
+from .ledger import balance_at, open_ledger, take_snapshots
+from .outbox import iter_events, prune_events, read_events
+from .management.commands import generate_statements
+from .management.commands.bench_serving import reload_urlconf
+from .management.commands.generate_statements import month_range
+from .models import (
+    BalanceSnapshot,
+    ClearanceReminder,
+    ClearanceRequest,
+    CustomUser,
+    Issue,
+    LedgerEntry,
+    Notification,
+    OutboxEvent,
+    TopUp,
+    Transaction,
+    VendorCustomerRollup,
+    VendorRollup,
+    Wallet,
+)
+from .reminders import request_clearance, send_reminders, send_reminders_for
+from .services import BulkTransferConflict, bulk_transfer, top_up_wallets
+from .settlement import SettlementConflict, settle_dues, settle_wallets
+from .statements import STATEMENT_FIELDS, generate_statement
+from .versions import user_version
+
+
+phone_numbers = count(9000000000)
+
+
+def make_user(username, balance=0, **extra_fields):
+    user = CustomUser.objects.create_user(
+        username,
+        f"{username}@example.com",
+        f"+91{next(phone_numbers)}",
+        "password",
+        **extra_fields,
+    )
+    if balance:
+        Wallet.objects.filter(user=user).update(balance=balance)
+    return user
+
+
+def bearer_client(user):
+    # authenticated like the frontend, request.user is a TokenUser
+    client = APIClient()
+    client.credentials(
+        HTTP_AUTHORIZATION=f"Bearer {UserRefreshToken.for_user(user).access_token}"
+    )
+    return client
+
+
+def wallet_of(user):
+    return Wallet.objects.get(user=user)
+
+
+class TopUpTests(TestCase):
+    def setUp(self):
+        self.user = make_user("alice")
+
+    def test_applies_once_per_reference(self):
+        row = {"user_id": self.user.user_id, "amount": "25.00", "reference": "ref-1"}
+        self.assertEqual(top_up_wallets([row])[0]["status"], "applied")
+        self.assertEqual(top_up_wallets([row])[0]["status"], "duplicate")
+        self.assertEqual(wallet_of(self.user).balance, Decimal("25.00"))
+        self.assertEqual(TopUp.objects.count(), 1)
+        self.assertEqual(
+            LedgerEntry.objects.filter(kind=LedgerEntry.TOP_UP).count(), 1
+        )
+
+    def test_duplicate_reference_in_one_batch(self):
+        row = {"user_id": self.user.user_id, "amount": "10.00", "reference": "ref-2"}
+        results = top_up_wallets([row, row])
+        self.assertEqual([r["status"] for r in results], ["applied", "duplicate"])
+        self.assertEqual(wallet_of(self.user).balance, Decimal("10.00"))
+
+    def test_invalid_rows(self):
+        results = top_up_wallets(
+            [
+                "x",
+                {"user_id": "missing", "amount": "5.00", "reference": "ref-3"},
+                {"user_id": self.user.user_id, "amount": "-5", "reference": "ref-4"},
+            ]
+        )
+        self.assertEqual([r["status"] for r in results], ["invalid"] * 3)
+        self.assertIsNone(results[0]["reference"])
+        self.assertEqual(wallet_of(self.user).balance, 0)
+
+
+def booked(wallet, account=LedgerEntry.BALANCE):
+    return LedgerEntry.objects.filter(wallet=wallet, account=account).aggregate(
+        total=Sum("amount")
+    )["total"] or 0
+
+
+def transfer(sender, receiver, amount, status=Transaction.SUCCESS):
+    return Transaction.objects.create(
+        sender=wallet_of(sender),
+        receiver=wallet_of(receiver),
+        transaction_amount=Decimal(amount),
+        transaction_status=status,
+    )
+
+
+class OpenLedgerTests(TestCase):
+    def setUp(self):
+        # balances from before the ledger, no entries
+        self.alice = make_user("alice", balance=100)
+        self.bob = make_user("bob", balance=50)
+        Wallet.objects.filter(user=self.alice).update(pending=30)
+
+    def test_wallet_that_moved_money_before_opening(self):
+        transfer(self.alice, self.bob, "40")
+        transfer(self.alice, self.bob, "20", Transaction.PENDING)
+        # the receivable due is already booked by the transfer
+        self.assertEqual(open_ledger(), 3)
+        for user in (self.alice, self.bob):
+            wallet = wallet_of(user)
+            self.assertEqual(booked(wallet), wallet.balance)
+            self.assertEqual(booked(wallet, LedgerEntry.PENDING), wallet.pending)
+            self.assertEqual(balance_at(wallet, timezone.now()), wallet.balance)
+        self.assertEqual(booked(wallet_of(self.bob), LedgerEntry.RECEIVABLE), 20)
+
+    def test_opens_each_wallet_once(self):
+        open_ledger()
+        self.assertEqual(open_ledger(), 0)
+        transfer(self.bob, self.alice, "10")
+        self.assertEqual(open_ledger(), 0)
+        self.assertEqual(booked(wallet_of(self.alice)), Decimal("110"))
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch("api.ledger.SNAPSHOT_LAG", timedelta(0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.alice = make_user("alice")
+        self.bob = make_user("bob")
+        fund(self.alice, 100)
+        transfer(self.alice, self.bob, "40")
+
+    def late_entry(self, user, amount, timestamp):
+        # dated when its transaction began, visible only once it commits
+        LedgerEntry.objects.create(
+            wallet=wallet_of(user),
+            account=LedgerEntry.BALANCE,
+            amount=amount,
+            kind=LedgerEntry.ADJUSTMENT,
+            timestamp=timestamp,
+        )
+
+    def test_snapshots_add_up(self):
+        self.assertEqual(take_snapshots(), 2)
+        self.assertEqual(take_snapshots(), 0)
+        before = timezone.now()
+        transfer(self.bob, self.alice, "15")
+        self.assertEqual(take_snapshots(), 2)
+        self.assertEqual(BalanceSnapshot.objects.count(), 4)
+        for user, amount in ((self.alice, Decimal("60")), (self.bob, Decimal("40"))):
+            self.assertEqual(balance_at(wallet_of(user), before), amount)
+        for user in (self.alice, self.bob):
+            wallet = wallet_of(user)
+            self.assertEqual(balance_at(wallet, timezone.now()), booked(wallet))
+
+    def test_late_entry_is_picked_up(self):
+        started = timezone.now()
+        take_snapshots()
+        # commits after the snapshot that covers its timestamp
+        self.late_entry(self.bob, "5", started)
+        wallet = wallet_of(self.bob)
+        self.assertEqual(balance_at(wallet, timezone.now()), Decimal("40"))
+        take_snapshots()
+        self.assertEqual(balance_at(wallet, timezone.now()), Decimal("45"))
+        self.assertEqual(
+            BalanceSnapshot.objects.get(wallet=wallet).amount, booked(wallet)
+        )
+
+    @mock.patch("api.ledger.SNAPSHOT_RECHECK", timedelta(0))
+    def test_entry_later_than_the_recheck_is_missed(self):
+        started = timezone.now()
+        take_snapshots()
+        self.late_entry(self.bob, "5", started)
+        take_snapshots()
+        self.assertEqual(balance_at(wallet_of(self.bob), timezone.now()), Decimal("40"))
+
+
+def transfer_at(when, sender, receiver, amount, status=Transaction.SUCCESS):
+    with mock.patch("django.utils.timezone.now", return_value=when):
+        return transfer(sender, receiver, amount, status)
+
+
+def read_statement(path):
+    with open(path, newline="") as f:
+        lines = list(csv.reader(f))
+    blank = lines.index([])
+    rows = [dict(zip(STATEMENT_FIELDS, line)) for line in lines[1:blank]]
+    _, _, opening, _, closing = lines[blank + 1]
+    return rows, Decimal(opening), Decimal(closing)
+
+
+class StatementTests(TransactionTestCase):
+    def setUp(self):
+        self.alice = make_user("alice")
+        self.bob = make_user("bob")
+        fund(self.alice, 100)
+        self.start, self.end = month_range("2030-05")
+        transfer_at(self.start - timedelta(seconds=1), self.alice, self.bob, "10")
+        # a period includes its start and excludes its end
+        transfer_at(self.start, self.alice, self.bob, "20")
+        transfer_at(self.start + timedelta(days=3), self.bob, self.alice, "5")
+        transfer_at(self.start + timedelta(days=4), self.alice, self.bob, "500")
+        transfer_at(self.end, self.alice, self.bob, "7")
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def assertAddsUp(self, path):
+        rows, opening, closing = read_statement(path)
+        moved = sum(
+            Decimal(row["amount"]) * (1 if row["direction"] == "received" else -1)
+            for row in rows
+            if row["status"] == "Success"
+        )
+        self.assertEqual(opening + moved, closing)
+        return rows, opening, closing
+
+    def test_statement(self):
+        summary = generate_statement(
+            self.alice.user_id, self.start, self.end, self.directory
+        )
+        rows, opening, closing = self.assertAddsUp(summary["path"])
+        self.assertEqual((opening, closing), (Decimal("90"), Decimal("75")))
+        self.assertEqual(
+            [(row["direction"], row["amount"], row["status"]) for row in rows],
+            [
+                ("sent", "20.00", "Success"),
+                ("received", "5.00", "Success"),
+                ("sent", "500.00", "Failed"),
+            ],
+        )
+        self.assertEqual(summary["transactions"], 3)
+
+    def test_command(self):
+        # the workers share the test database when they are threads
+        with mock.patch.object(generate_statements, "ProcessPoolExecutor", ThreadPoolExecutor):
+            out = StringIO()
+            call_command(
+                "generate_statements",
+                "2030-05",
+                "--all",
+                "--output",
+                self.directory,
+                "--workers",
+                "2",
+                stdout=out,
+            )
+        self.assertIn("Wrote 2 statement(s), 0 failed.", out.getvalue())
+        for user in (self.alice, self.bob):
+            self.assertAddsUp(
+                os.path.join(self.directory, f"{user.user_id}_20300501_20300601.csv")
+            )
+
+
+class VendorRollupTests(TestCase):
+    def setUp(self):
+        self.vendor = make_user("canteen", balance=500, type=CustomUser.Types.VENDOR)
+        self.customer = make_user("carol", balance=500)
+
+    def day_rollup(self):
+        return VendorRollup.objects.get(
+            vendor=wallet_of(self.vendor), granularity=VendorRollup.DAY
+        )
+
+    def test_payments_and_dues(self):
+        transfer(self.customer, self.vendor, "30")
+        transfer(self.customer, self.vendor, "20", Transaction.PENDING)
+        rollup = self.day_rollup()
+        self.assertEqual(
+            (rollup.revenue, rollup.pending, rollup.transactions),
+            (Decimal("30"), Decimal("20"), 2),
+        )
+        customer = VendorCustomerRollup.objects.get(vendor=wallet_of(self.vendor))
+        self.assertEqual(customer.customer, wallet_of(self.customer))
+
+    def test_refund_is_not_revenue(self):
+        transfer(self.customer, self.vendor, "30")
+        transfer(self.vendor, self.customer, "10")
+        self.assertEqual(self.day_rollup().revenue, Decimal("30"))
+        self.assertFalse(
+            VendorCustomerRollup.objects.filter(customer=wallet_of(self.vendor)).exists()
+        )
+
+
+class VendorAnalyticsTests(TestCase):
+    def setUp(self):
+        self.vendor = make_user("canteen", type=CustomUser.Types.VENDOR)
+        self.client = bearer_client(self.vendor)
+        self.url = reverse("vendor_analytics", args=[self.vendor.user_id])
+
+    def test_query_params(self):
+        for params, expected in (
+            ({}, 200),
+            ({"start": "2026-01-01", "end": "2026-02-01T00:00:00"}, 200),
+            ({"start": "2026-02-01", "end": "2026-01-01"}, 400),
+            ({"start": "2026-13-45T00:00:00"}, 400),
+            ({"start": "yesterday"}, 400),
+            ({"granularity": "year"}, 400),
+        ):
+            with self.subTest(params=params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, expected)
+
+    def test_not_a_vendor(self):
+        customer = make_user("carol")
+        response = bearer_client(customer).get(
+            reverse("vendor_analytics", args=[customer.user_id])
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class IssueWorkflowTests(TestCase):
+    def setUp(self):
+        self.vendor = make_user("canteen", type=CustomUser.Types.VENDOR)
+        self.customer = make_user("carol", balance=100)
+        self.due = transfer(self.customer, self.vendor, "40", Transaction.PENDING)
+
+    def raise_issue(self, transaction=None):
+        return Issue.objects.create(
+            user=self.customer,
+            subject="Wrong amount",
+            content="I was charged twice.",
+            transaction=transaction or self.due,
+        )
+
+    def test_raising_puts_the_transaction_in_review(self):
+        self.raise_issue()
+        self.due.refresh_from_db()
+        self.assertEqual(self.due.transaction_status, Transaction.IN_REVIEW)
+
+    def test_cannot_raise_on_a_settled_transaction(self):
+        payment = transfer(self.customer, self.vendor, "10")
+        with self.assertRaises(ValidationError):
+            self.raise_issue(payment)
+
+    def test_open_issue_is_not_resolved(self):
+        issue = self.raise_issue()
+        self.assertEqual(resolve_issues([issue.pk], Transaction.FAILED), 0)
+        issue.refresh_from_db()
+        self.assertEqual(issue.state, Issue.OPEN)
+
+    def test_claim_and_reject(self):
+        issue = self.raise_issue()
+        agent = make_user("agent", is_staff=True)
+        self.assertEqual([row["id"] for row in claim_issues(agent.user_id)], [issue.pk])
+        self.assertEqual(resolve_issues([issue.pk], Transaction.FAILED), 1)
+        # a second resolution is a no-op
+        self.assertEqual(resolve_issues([issue.pk], Transaction.SUCCESS), 0)
+
+        issue.refresh_from_db()
+        self.due.refresh_from_db()
+        wallet = wallet_of(self.customer)
+        self.assertEqual(issue.state, Issue.RESOLVED)
+        self.assertEqual(self.due.transaction_status, Transaction.FAILED)
+        self.assertEqual(self.due.failure_reason, Transaction.ISSUE_REJECTED)
+        self.assertEqual(wallet.pending, 0)
+        self.assertEqual(booked(wallet, LedgerEntry.PENDING), 0)
+
+    def test_resolve_from_the_admin_change_form(self):
+        issue = self.raise_issue()
+        start_review([issue.pk])
+        admin = CustomUser.objects.create_superuser(
+            "admin", "admin@example.com", "+919999999999", "password"
+        )
+        self.client.force_login(admin)
+        response = self.client.post(
+            reverse("admin:api_issue_change", args=[issue.pk]),
+            {
+                "user": self.customer.pk,
+                "subject": issue.subject,
+                "content": issue.content,
+                "transaction": self.due.pk,
+                "resolved_status": Transaction.SUCCESS,
+                "assignee": "",
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+        issue.refresh_from_db()
+        self.due.refresh_from_db()
+        self.assertEqual(issue.state, Issue.RESOLVED)
+        self.assertEqual(self.due.transaction_status, Transaction.SUCCESS)
+
+
+class IssueApiTests(TestCase):
+    def setUp(self):
+        self.vendor = make_user("canteen", type=CustomUser.Types.VENDOR)
+        self.customer = make_user("carol", balance=100)
+        self.due = transfer(self.customer, self.vendor, "40", Transaction.PENDING)
+        self.url = reverse("user_issues", args=[self.customer.user_id])
+        self.issue = {
+            "transaction_id": self.due.pk,
+            "subject": "Wrong amount",
+            "content": "I was charged twice.",
+        }
+
+    def test_raise_with_a_bearer_token(self):
+        response = bearer_client(self.customer).post(self.url, self.issue)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["user_id"], self.customer.user_id)
+        response = bearer_client(self.customer).get(self.url)
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_raise_for_someone_else(self):
+        response = bearer_client(self.vendor).post(self.url, self.issue)
+        self.assertEqual(response.status_code, 403)
+
+    def test_claim_and_resolve(self):
+        bearer_client(self.customer).post(self.url, self.issue)
+        agent = make_user("agent", is_staff=True)
+        self.client.force_login(agent)
+        claimed = self.client.post(reverse("issue_claim")).data["results"]
+        self.assertEqual(claimed[0]["assignee_id"], agent.user_id)
+        mine = self.client.get(reverse("issue_queue"), {"state": Issue.IN_REVIEW, "mine": 1})
+        self.assertEqual([row["id"] for row in mine.data["results"]], [claimed[0]["id"]])
+
+        resolve = reverse("issue_resolve", args=[claimed[0]["id"]])
+        response = self.client.post(resolve, {"resolved_status": Transaction.SUCCESS})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(resolve, {"resolved_status": Transaction.SUCCESS})
+        self.assertEqual(response.status_code, 409)
+
+
+class WalletAdminTests(TestCase):
+    def setUp(self):
+        self.wallet = wallet_of(make_user("alice", balance=100))
+        admin = CustomUser.objects.create_superuser(
+            "admin", "admin@example.com", "+919999999999", "password"
+        )
+        self.client.force_login(admin)
+
+    def post_with_concurrent_transfer(self, url, data):
+        # a transfer lands between loading the wallet and saving the form
+        save_form = WalletAdmin.save_form
+
+        def concurrent_save_form(admin, request, form, change):
+            Wallet.objects.filter(pk=self.wallet.pk).update(balance=70, pending=5)
+            return save_form(admin, request, form, change)
+
+        with mock.patch.object(WalletAdmin, "save_form", concurrent_save_form):
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.wallet.refresh_from_db()
+        self.assertEqual(
+            (self.wallet.balance, self.wallet.pending, self.wallet.pending_limit),
+            (70, 5, 500),
+        )
+
+    def test_changelist_edit(self):
+        self.post_with_concurrent_transfer(
+            reverse("admin:api_wallet_changelist"),
+            {
+                "form-TOTAL_FORMS": 1,
+                "form-INITIAL_FORMS": 1,
+                "form-0-id": self.wallet.pk,
+                "form-0-pending_limit": "500.00",
+                "_save": "Save",
+            },
+        )
+
+    def test_change_form_edit(self):
+        self.post_with_concurrent_transfer(
+            reverse("admin:api_wallet_change", args=[self.wallet.pk]),
+            {"pending_limit": "500.00"},
+        )
+
+
+class TransactionAdminTests(TestCase):
+    def setUp(self):
+        self.payment = transfer(make_user("alice", balance=100), make_user("bob"), "30")
+        admin = CustomUser.objects.create_superuser(
+            "admin", "admin@example.com", "+919999999999", "password"
+        )
+        self.client.force_login(admin)
+        self.url = reverse("admin:api_transaction_change", args=[self.payment.pk])
+
+    def test_change_form_is_read_only(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("transaction_amount", response.context["adminform"].form.fields)
+        response = self.client.post(
+            self.url, {"transaction_amount": "1", "transaction_status": Transaction.FAILED}
+        )
+        self.assertEqual(response.status_code, 403)
+        self.payment.refresh_from_db()
+        self.assertEqual(
+            (self.payment.transaction_amount, self.payment.transaction_status),
+            (30, Transaction.SUCCESS),
+        )
+        self.assertEqual(LedgerEntry.objects.filter(transaction=self.payment).count(), 2)
+
+
+def fund(user, amount):
+    # through a top-up, so the ledger matches the balance
+    top_up_wallets(
+        [{"user_id": user.user_id, "amount": amount, "reference": f"fund-{user.user_id}"}]
+    )
+
+
+class SettlementTests(TestCase):
+    def setUp(self):
+        self.vendor = make_user("canteen", type=CustomUser.Types.VENDOR)
+        self.customer = make_user("carol")
+        fund(self.customer, "100")
+        self.dues = [
+            transfer(self.customer, self.vendor, amount, Transaction.PENDING)
+            for amount in ("30", "20")
+        ]
+
+    def test_settles_dues_the_balance_covers(self):
+        summary = settle_dues()
+        self.assertEqual(summary, {"wallets": 1, "dues": 2, "conflicts": 0})
+        customer, vendor = wallet_of(self.customer), wallet_of(self.vendor)
+        self.assertEqual((customer.balance, customer.pending), (50, 0))
+        self.assertEqual(vendor.balance, 50)
+        self.assertEqual(
+            Transaction.objects.filter(transaction_status=Transaction.CLEARED).count(), 2
+        )
+        payment = Transaction.objects.get(transaction_status=Transaction.SUCCESS)
+        self.assertEqual(payment.transaction_amount, 50)
+        for wallet in (customer, vendor):
+            self.assertEqual(booked(wallet), wallet.balance)
+            self.assertEqual(booked(wallet, LedgerEntry.PENDING), wallet.pending)
+        self.assertEqual(booked(vendor, LedgerEntry.RECEIVABLE), 0)
+        # nothing left to settle
+        self.assertEqual(settle_dues()["dues"], 0)
+
+    def test_skips_wallets_that_cannot_pay_all_dues(self):
+        transfer(self.customer, self.vendor, "60", Transaction.PENDING)
+        self.assertEqual(settle_dues()["wallets"], 0)
+        self.assertEqual(wallet_of(self.customer).balance, 100)
+
+    def test_balance_spent_meanwhile(self):
+        wallet = wallet_of(self.customer)
+        debit_wallets = settlement.debit_wallets
+
+        def concurrent_debit(debits):
+            Wallet.objects.filter(pk=wallet.pk).update(balance=10)
+            return debit_wallets(debits)
+
+        with mock.patch.object(settlement, "debit_wallets", concurrent_debit):
+            with self.assertRaises(SettlementConflict):
+                settle_wallets([wallet.pk])
+        # rolled back, the simulated transfer with it
+        wallet.refresh_from_db()
+        self.assertEqual(wallet.pending, 50)
+        self.assertEqual(
+            Transaction.objects.filter(transaction_status=Transaction.PENDING).count(), 2
+        )
+
+
+class TransactionApplyTests(TestCase):
+    def setUp(self):
+        self.vendor = make_user("canteen", type=CustomUser.Types.VENDOR)
+        self.customer = make_user("carol")
+        fund(self.customer, "100")
+
+    def test_pending_limit(self):
+        Wallet.objects.filter(user=self.customer).update(pending_limit=50)
+        transfer(self.customer, self.vendor, "30", Transaction.PENDING)
+        over = transfer(self.customer, self.vendor, "30", Transaction.PENDING)
+        self.assertEqual(over.transaction_status, Transaction.FAILED)
+        self.assertEqual(over.failure_reason, Transaction.PENDING_LIMIT)
+        self.assertEqual(wallet_of(self.customer).pending, 30)
+
+    def test_clearing_with_a_stale_wallet_keeps_new_dues(self):
+        due = transfer(self.customer, self.vendor, "30", Transaction.PENDING)
+        stale = Transaction.objects.select_related("sender__user").get(pk=due.pk)
+        transfer(self.customer, self.vendor, "20", Transaction.PENDING)
+        stale.transaction_status = Transaction.CLEARED
+        stale.save()
+        wallet = wallet_of(self.customer)
+        self.assertEqual(wallet.pending, 20)
+        self.assertEqual(booked(wallet, LedgerEntry.PENDING), 20)
+
+    def test_saving_again_moves_nothing(self):
+        payment = transfer(self.customer, self.vendor, "30")
+        for status in (Transaction.SUCCESS, Transaction.FAILED):
+            payment.transaction_status = status
+            with self.assertRaises(ValidationError):
+                payment.save()
+        self.assertEqual(wallet_of(self.customer).balance, 70)
+        self.assertEqual(wallet_of(self.vendor).balance, 30)
+        self.assertEqual(LedgerEntry.objects.filter(transaction=payment).count(), 2)
+        self.assertEqual(OutboxEvent.objects.filter(kind=OutboxEvent.TRANSFER).count(), 1)
+        self.assertEqual(
+            VendorRollup.objects.get(granularity=VendorRollup.DAY).transactions, 1
+        )
+
+    def test_due_is_cleared_once(self):
+        due = transfer(self.customer, self.vendor, "30", Transaction.PENDING)
+        other = Transaction.objects.get(pk=due.pk)
+        due.transaction_status = Transaction.CLEARED
+        due.save()
+        # a second clearing of the same due, e.g. a repeated request
+        other.transaction_status = Transaction.CLEARED
+        with self.assertRaises(ValidationError):
+            other.save()
+        due.refresh_from_db()
+        self.assertEqual(due.transaction_status, Transaction.CLEARED)
+        wallet = wallet_of(self.customer)
+        self.assertEqual((wallet.pending, booked(wallet, LedgerEntry.PENDING)), (0, 0))
+
+    def test_clear_dues_view(self):
+        transfer(self.customer, self.vendor, "30", Transaction.PENDING)
+        transfer(self.customer, self.vendor, "20", Transaction.PENDING)
+        response = bearer_client(self.customer).post(
+            reverse("clear_dues_vendor", args=[self.customer.user_id]),
+            {"receiver_id": self.vendor.user_id},
+        )
+        self.assertEqual(response.data, {"message": "Dues cleared successfully."})
+        self.assertEqual(
+            Transaction.objects.filter(transaction_status=Transaction.CLEARED).count(), 2
+        )
+        wallet = wallet_of(self.customer)
+        self.assertEqual((wallet.balance, wallet.pending), (50, 0))
+        self.assertEqual(wallet_of(self.vendor).balance, 50)
+
+    def test_payment_with_a_stale_wallet(self):
+        stale = wallet_of(self.customer)
+        # spent and limit changed after the wallet was loaded
+        Wallet.objects.filter(pk=stale.pk).update(balance=10, pending_limit=500)
+        payment = Transaction.objects.create(
+            sender=stale, receiver=wallet_of(self.vendor), transaction_amount=50
+        )
+        self.assertEqual(payment.failure_reason, Transaction.INSUFFICIENT_FUNDS)
+        payment = Transaction.objects.create(
+            sender=stale, receiver=wallet_of(self.vendor), transaction_amount=10
+        )
+        self.assertEqual(payment.transaction_status, Transaction.SUCCESS)
+        wallet = wallet_of(self.customer)
+        self.assertEqual((wallet.balance, wallet.pending_limit), (0, 500))
+        self.assertEqual(wallet_of(self.vendor).balance, 10)
+
+
+class ReminderTests(TestCase):
+    def setUp(self):
+        self.vendor = make_user("canteen", type=CustomUser.Types.VENDOR)
+        self.customers = [make_user("carol"), make_user("dave")]
+        for customer in self.customers:
+            fund(customer, "100")
+            transfer(customer, self.vendor, "30", Transaction.PENDING)
+
+    def reminders(self):
+        return Notification.objects.filter(
+            subject="Requesting clearance of pending dues"
+        )
+
+    def test_repeated_requests_are_absorbed(self):
+        response = bearer_client(self.vendor).post(
+            reverse("request_clearance", args=[self.vendor.user_id])
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(request_clearance(self.vendor))
+        self.assertEqual(ClearanceRequest.objects.count(), 1)
+        self.assertEqual(send_reminders(), (1, 2))
+        self.assertEqual(self.reminders().count(), 2)
+        self.assertEqual(ClearanceRequest.objects.get().reminders_sent, 2)
+
+    def test_cooldown(self):
+        request_clearance(self.vendor)
+        send_reminders()
+        transfer(self.customers[0], self.vendor, "10", Transaction.PENDING)
+        newcomer = make_user("erin")
+        fund(newcomer, "100")
+        transfer(newcomer, self.vendor, "5", Transaction.PENDING)
+        self.assertTrue(request_clearance(self.vendor))
+        # only the customer not reminded yet
+        self.assertEqual(send_reminders(), (1, 1))
+        self.assertEqual(self.reminders().filter(user=newcomer).count(), 1)
+        ClearanceReminder.objects.update(
+            sent_at=timezone.now() - timedelta(hours=25)
+        )
+        request_clearance(self.vendor)
+        self.assertEqual(send_reminders(), (1, 3))
+        self.assertEqual(
+            ClearanceReminder.objects.get(customer=self.customers[0]).amount, 40
+        )
+
+    def test_processed_request_is_not_sent_again(self):
+        request_clearance(self.vendor)
+        # loaded by two runs before either processed it
+        first, second = ClearanceRequest.objects.get(), ClearanceRequest.objects.get()
+        self.assertEqual(send_reminders_for(first, timezone.now()), 2)
+        self.assertIsNone(send_reminders_for(second, timezone.now()))
+        self.assertEqual(self.reminders().count(), 2)
+        self.assertEqual(ClearanceRequest.objects.get().reminders_sent, 2)
+        self.assertEqual(send_reminders(), (0, 0))
+
+    def test_run_skips_requests_claimed_meanwhile(self):
+        request_clearance(self.vendor)
+        claim = send_reminders_for
+
+        def claimed_first(clearance_request, now):
+            # another run processes the request after this one listed it
+            claim(ClearanceRequest.objects.get(pk=clearance_request.pk), now)
+            return claim(clearance_request, now)
+
+        with mock.patch("api.reminders.send_reminders_for", claimed_first):
+            self.assertEqual(send_reminders(), (0, 0))
+        self.assertEqual(self.reminders().count(), 2)
+
+
+def outbox_event(n, **fields):
+    return OutboxEvent.objects.create(kind=OutboxEvent.TOP_UP, payload={"n": n}, **fields)
+
+
+class OutboxTests(TestCase):
+    def payloads(self, events):
+        return [event["payload"]["n"] for event in events]
+
+    def test_read_in_position_order(self):
+        for n in range(3):
+            outbox_event(n)
+        events = read_events(0, 2)
+        self.assertEqual(self.payloads(events), [0, 1])
+        self.assertEqual([event["position"] for event in events], [1, 2])
+        self.assertEqual(self.payloads(read_events(2)), [2])
+        self.assertEqual(read_events(3), [])
+
+    def test_late_commit_is_not_skipped(self):
+        first = outbox_event(0)
+        outbox_event(2, id=first.id + 10)
+        self.assertEqual(self.payloads(read_events()), [0, 2])
+        # a lower id committed after a higher one was served
+        outbox_event(1, id=first.id + 5)
+        events = read_events(2)
+        self.assertEqual(self.payloads(events), [1])
+        self.assertEqual(events[0]["position"], 3)
+
+    def test_iter_events(self):
+        for n in range(5):
+            outbox_event(n)
+        self.assertEqual(self.payloads(iter_events(0, 2)), [0, 1, 2, 3, 4])
+        self.assertEqual(self.payloads(iter_events(3, 2)), [3, 4])
+
+    def test_prune_keeps_events_not_served(self):
+        old = timezone.now() - timedelta(days=40)
+        for n in range(3):
+            outbox_event(n, timestamp=old)
+        read_events(0, 2)
+        outbox_event(3, timestamp=old)
+        outbox_event(4)
+        self.assertEqual(prune_events(timezone.now() - timedelta(days=30), 1), 2)
+        self.assertEqual(self.payloads(read_events()), [2, 3, 4])
+
+    def test_feed(self):
+        for n in range(3):
+            outbox_event(n)
+        customer = make_user("carol")
+        response = bearer_client(customer).get(reverse("events"))
+        self.assertEqual(response.status_code, 403)
+        admin = CustomUser.objects.create_superuser(
+            "admin", "admin@example.com", "+919999999999", "password"
+        )
+        self.client.force_login(admin)
+        self.assertEqual(self.client.get(reverse("events"), {"after": "x"}).status_code, 400)
+        response = self.client.get(reverse("events"), {"limit": 2})
+        self.assertEqual(self.payloads(response.json()["results"]), [0, 1])
+        response = self.client.get(reverse("events"), {"after": response.json()["next"]})
+        self.assertEqual(response.json()["next"], 3)
+        self.assertEqual(self.payloads(response.json()["results"]), [2])
+        response = self.client.get(reverse("events"), {"after": 3})
+        self.assertEqual(response.json(), {"results": [], "next": 3})
+
+    def test_export_command(self):
+        for n in range(3):
+            outbox_event(n)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "events.jsonl")
+        err = StringIO()
+        call_command("export_events", "--output", path, "--batch-size", "2", stderr=err)
+        self.assertIn("Exported 3 event(s), last position 3.", err.getvalue())
+        outbox_event(3)
+        call_command("export_events", "--output", path, "--after", "3", stderr=err)
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(self.payloads(lines), [0, 1, 2, 3])
+        self.assertEqual([line["position"] for line in lines], [1, 2, 3, 4])
+
+
+LIMITS = {"sender": (3, 200), "receiver": (5, 1000), "pair": (2, 1000)}
+
+
+class VelocityTrackerTests(TestCase):
+    def setUp(self):
+        self.tracker = velocity.VelocityTracker(60, LIMITS)
+
+    def test_single_transfers(self):
+        for receiver in ("b", "c", "d"):
+            self.assertEqual(self.tracker.admit("a", [(receiver, Decimal("10"))]), ([], 0))
+        exceeded, wait = self.tracker.admit("a", [("e", Decimal("10"))])
+        self.assertEqual(exceeded, ["sender"])
+        self.assertGreater(wait, 0)
+
+    def test_batch_counts_every_transfer(self):
+        transfers = [("b", Decimal("10")), ("c", Decimal("10"))]
+        self.assertEqual(self.tracker.admit("a", transfers)[0], [])
+        self.assertEqual(self.tracker.admit("a", transfers)[0], ["sender"])
+        self.assertEqual(
+            self.tracker.admit("x", [("y", Decimal("10"))] * 3)[0], ["pair"]
+        )
+
+    def test_amount_and_flag_mode(self):
+        transfers = [("b", Decimal("120")), ("c", Decimal("120"))]
+        self.assertEqual(self.tracker.admit("a", transfers, block=False)[0], ["sender"])
+        # flagged transfers are recorded
+        self.assertEqual(self.tracker.admit("a", [("d", Decimal("1"))])[0], ["sender"])
+
+
+class CacheVelocityTrackerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tracker = velocity.CacheVelocityTracker(60, LIMITS)
+
+    def test_batch_counts_every_transfer(self):
+        transfers = [("b", Decimal("10")), ("c", Decimal("10"))]
+        self.assertEqual(self.tracker.admit("a", transfers)[0], [])
+        self.assertEqual(self.tracker.admit("a", transfers)[0], ["sender"])
+        self.assertEqual(self.tracker.admit("a", [("d", Decimal("10"))])[0], [])
+        self.assertEqual(self.tracker.admit("a", [("d", Decimal("10"))])[0], ["sender"])
+
+
+class BulkTransferTests(TestCase):
+    def setUp(self):
+        self.vendor = make_user("canteen", type=CustomUser.Types.VENDOR)
+        fund(self.vendor, "100")
+        self.customers = [make_user(name) for name in ("carol", "dave", "erin")]
+        patcher = mock.patch.object(
+            velocity, "velocity_tracker", velocity.VelocityTracker(60, LIMITS)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def items(self, *amounts):
+        return [
+            {"receiver_id": customer.user_id, "amount": amount}
+            for customer, amount in zip(self.customers, amounts)
+        ]
+
+    def test_pays_in_order_until_the_balance_runs_out(self):
+        results = bulk_transfer(self.vendor.user_id, self.items("40", "70", "30"))
+        self.assertEqual(
+            [result["status"] for result in results], ["applied", "failed", "applied"]
+        )
+        self.assertEqual(results[1]["failure_reason"], Transaction.INSUFFICIENT_FUNDS)
+        balances = [wallet_of(user).balance for user in [self.vendor, *self.customers]]
+        self.assertEqual(balances, [30, 40, 0, 30])
+        for user in [self.vendor, *self.customers]:
+            self.assertEqual(booked(wallet_of(user)), wallet_of(user).balance)
+
+    def test_refunds_are_not_vendor_revenue(self):
+        bulk_transfer(self.vendor.user_id, self.items("10", "10"))
+        self.assertFalse(VendorRollup.objects.exists())
+        self.assertFalse(VendorCustomerRollup.objects.exists())
+
+    def test_velocity_limits(self):
+        client = bearer_client(self.vendor)
+        url = reverse("user_bulk_transfer", args=[self.vendor.user_id])
+        response = client.post(url, self.items("10", "10"), format="json")
+        self.assertEqual(response.data["applied"], 2)
+        response = client.post(url, self.items("10", "10"), format="json")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(wallet_of(self.vendor).balance, 80)
+
+    def test_balance_spent_meanwhile(self):
+        wallet = wallet_of(self.vendor)
+        debit_wallets = services.debit_wallets
+
+        def concurrent_debit(debits):
+            Wallet.objects.filter(pk=wallet.pk).update(balance=50)
+            return debit_wallets(debits)
+
+        with mock.patch.object(services, "debit_wallets", concurrent_debit):
+            with self.assertRaises(BulkTransferConflict):
+                bulk_transfer(self.vendor.user_id, self.items("40", "30"))
+        self.assertFalse(Transaction.objects.filter(sender=wallet).exists())
+        self.assertEqual(wallet_of(self.customers[0]).balance, 0)
+
+
+class FailureReasonTests(TestCase):
+    def setUp(self):
+        self.vendor = make_user("canteen", type=CustomUser.Types.VENDOR)
+        self.customer = make_user("carol")
+        fund(self.customer, "100")
+        Wallet.objects.filter(user=self.customer).update(pending_limit=50)
+        self.client = bearer_client(self.customer)
+        self.url = reverse("user_transactions_post", args=[self.customer.user_id])
+        patcher = mock.patch.object(velocity, "velocity_tracker", velocity.make_tracker())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def pay(self, amount, status=Transaction.SUCCESS):
+        return self.client.post(
+            self.url,
+            {
+                "receiver_id": self.vendor.user_id,
+                "transaction_amount": amount,
+                "transaction_status": status,
+            },
+        )
+
+    def test_failed_payments_say_why(self):
+        self.assertEqual(self.pay("40").status_code, 200)
+        for amount, status, reason in (
+            ("70", Transaction.SUCCESS, Transaction.INSUFFICIENT_FUNDS),
+            ("60", Transaction.PENDING, Transaction.PENDING_LIMIT),
+        ):
+            response = self.pay(amount, status)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data["failure_reason"], reason)
+            transaction = Transaction.objects.get(pk=response.data["transaction_id"])
+            self.assertEqual(transaction.transaction_status, Transaction.FAILED)
+            self.assertEqual(transaction.failure_reason, reason)
+            event = OutboxEvent.objects.filter(
+                payload__transaction_id=transaction.pk
+            ).get()
+            self.assertEqual(event.payload["failure_reason"], reason)
+        wallet = wallet_of(self.customer)
+        self.assertEqual((wallet.balance, wallet.pending), (60, 0))
+
+    def test_successful_payment_has_no_reason(self):
+        transaction = Transaction.objects.get(pk=self.pay("40").data["transaction_id"])
+        self.assertIsNone(transaction.failure_reason)
+
+
+class AsyncViewTests(TransactionTestCase):
+    """
+    The ASGI urlpatterns (ASYNC_VIEWS) answer like the sync views. The pooled
+    sync views run on other threads, so the data has to be committed.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(reload_urlconf)
+        self.vendor = make_user("canteen", type=CustomUser.Types.VENDOR)
+        self.customer = make_user("carol")
+        fund(self.customer, 100)
+        transfer(self.customer, self.vendor, "30")
+        transfer(self.customer, self.vendor, "20", Transaction.PENDING)
+
+    def get_both(self, path, user=None, **headers):
+        """
+        The sync and the async response to the same GET, `headers` are given
+        without the HTTP_ prefix.
+        """
+        if user is not None:
+            token = UserRefreshToken.for_user(user).access_token
+            headers["authorization"] = f"Bearer {token}"
+        environ = {
+            "HTTP_" + name.upper().replace("-", "_"): value
+            for name, value in headers.items()
+        }
+        sync = Client().get(path, **environ)
+        with self.settings(ASYNC_VIEWS=True):
+            reload_urlconf()
+            asynchronous = async_to_sync(self.async_get)(path, **headers)
+        reload_urlconf()
+        return sync, asynchronous
+
+    async def async_get(self, path, **headers):
+        return await AsyncClient().get(path, **headers)
+
+    def assertSameResponse(self, path, user=None, status_code=200, **headers):
+        sync, asynchronous = self.get_both(path, user, **headers)
+        self.assertEqual(sync.status_code, status_code, path)
+        self.assertEqual(asynchronous.status_code, status_code, path)
+        if status_code != 304:
+            self.assertEqual(sync.json(), asynchronous.json(), path)
+        self.assertEqual(sync.get("ETag"), asynchronous.get("ETag"), path)
+        return asynchronous
+
+    def test_read_views(self):
+        for user in (self.customer, self.vendor):
+            for name in ("navbar-details", "overview-details", "notification"):
+                self.assertSameResponse(reverse(name, args=[user.user_id]), user)
+
+    def test_sparse_fieldsets(self):
+        path = reverse("notification", args=[self.customer.user_id])
+        response = self.assertSameResponse(path + "?fields=subject,content", self.customer)
+        self.assertEqual(set(response.json()[0]), {"subject", "content"})
+        self.assertSameResponse(path + "?fields=nope", self.customer, 400)
+
+    def test_forbidden(self):
+        path = reverse("notification", args=[self.vendor.user_id])
+        self.assertSameResponse(path, self.customer, 403)
+        for name in ("navbar-details", "overview-details", "notification"):
+            self.assertSameResponse(reverse(name, args=[self.customer.user_id]), None, 403)
+
+    def test_pooled_sync_views(self):
+        for name in ("user_transactions", "pending_dues", "user_issues"):
+            self.assertSameResponse(
+                reverse(name, args=[self.customer.user_id]), self.customer
+            )
+
+    def test_not_modified(self):
+        path = reverse("navbar-details", args=[self.customer.user_id])
+        etag = self.assertSameResponse(path, self.customer)["ETag"]
+        self.assertSameResponse(path, self.customer, 304, **{"if-none-match": etag})
+
+    def test_asgi_urlpatterns(self):
+        with self.settings(ASYNC_VIEWS=True):
+            reload_urlconf()
+            stream = resolve(
+                reverse("notification_stream", args=[self.customer.user_id])
+            )
+            self.assertIs(stream.func.view_class, AsyncNotificationStream)
+            self.assertIs(
+                resolve(reverse("notification", args=["x"])).func.view_class,
+                AsyncUserNotificationList,
+            )
+            pooled = resolve(reverse("user_transactions", args=["x"])).func
+            self.assertTrue(asyncio.iscoroutinefunction(pooled))
+
+
+class RolledBack(Exception):
+    pass
+
+
+class PublishTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = make_user("alice", balance=100)
+        self.bob = make_user("bob")
+        # subscriptions are woken on the loop they were made on
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.subscription = self.subscribe(self.bob.user_id)
+
+    def subscribe(self, user_id):
+        async def subscribe():
+            return broker.subscribe(user_id)
+
+        subscription = self.loop.run_until_complete(subscribe())
+        self.addCleanup(broker.unsubscribe, subscription)
+        return subscription
+
+    def woken(self, subscription=None):
+        return self.loop.run_until_complete(
+            (subscription or self.subscription).wait(0.05)
+        )
+
+    def test_published_after_commit(self):
+        version = user_version(self.bob.user_id)
+        with self.captureOnCommitCallbacks() as callbacks:
+            publish_on_commit([self.bob.user_id])
+            self.assertFalse(self.woken())
+            self.assertEqual(user_version(self.bob.user_id), version)
+        for callback in callbacks:
+            callback()
+        self.assertTrue(self.woken())
+        # one wake-up per burst
+        self.assertFalse(self.woken())
+        self.assertNotEqual(user_version(self.bob.user_id), version)
+
+    def test_transfer_wakes_both_users(self):
+        alice = self.subscribe(self.alice.user_id)
+        other = self.subscribe(make_user("carol").user_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            transfer(self.alice, self.bob, "10")
+        self.assertTrue(self.woken())
+        self.assertTrue(self.woken(alice))
+        self.assertFalse(self.woken(other))
+
+    def test_rolled_back_publishes_nothing(self):
+        version = user_version(self.bob.user_id)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RolledBack):
+                with db_transaction.atomic():
+                    transfer(self.alice, self.bob, "10")
+                    raise RolledBack
+        self.assertEqual(callbacks, [])
+        self.assertFalse(self.woken())
+        self.assertEqual(user_version(self.bob.user_id), version)
+
+    def test_unsubscribed(self):
+        broker.unsubscribe(self.subscription)
+        broker.publish([self.bob.user_id])
+        self.assertFalse(self.woken())
+        self.assertNotIn(self.bob.user_id, broker.subscriptions)
+
+
+class NotificationStreamTests(TransactionTestCase):
+    # the stream reads on other threads, so the writes have to be committed
+
+    def setUp(self):
+        self.alice = make_user("alice", balance=100)
+        self.bob = make_user("bob")
+
+    def stream(self, write):
+        """
+        The first event of bob's stream after `write` ran, None if there is
+        none within a second.
+        """
+
+        async def read():
+            latest = await Notification.objects.filter(user_id=self.bob.user_id).alatest("id")
+            events = notification_events(self.bob.user_id, latest.id)
+            try:
+                self.assertTrue((await events.__anext__()).startswith("retry:"))
+                self.assertTrue((await events.__anext__()).startswith("event: wallet"))
+                pending = asyncio.ensure_future(events.__anext__())
+                # the stream waits for a wake-up now
+                await asyncio.sleep(0.05)
+                await sync_to_async(write)()
+                try:
+                    return await asyncio.wait_for(pending, 1)
+                except asyncio.TimeoutError:
+                    return None
+            finally:
+                await events.aclose()
+
+        return async_to_sync(read)()
+
+    def test_committed_transfer_is_streamed(self):
+        event = self.stream(lambda: transfer(self.alice, self.bob, "10"))
+        self.assertTrue(event.startswith("event: notification"))
+        self.assertIn("Rs. 10 received from alice", event)
+
+    def test_rolled_back_transfer_is_not_streamed(self):
+        def write():
+            with self.assertRaises(RolledBack):
+                with db_transaction.atomic():
+                    transfer(self.alice, self.bob, "10")
+                    raise RolledBack
+
+        self.assertIsNone(self.stream(write))
+        self.assertNotIn(self.bob.user_id, broker.subscriptions)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = make_user("alice", balance=100)
+        self.bob = make_user("bob")
+        self.client = bearer_client(self.bob)
+        self.path = reverse("navbar-details", args=[self.bob.user_id])
+
+    def test_not_modified(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Last-Modified", response)
+        etag = response["ETag"]
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+        # one version, but each endpoint has its own tag
+        other = self.client.get(reverse("notification", args=[self.bob.user_id]))
+        self.assertNotEqual(other["ETag"], etag)
+
+    def test_write_bumps_the_version(self):
+        etag = self.client.get(self.path)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            transfer(self.alice, self.bob, "10")
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.data["balance"], 10)
+
+    def test_no_validators_for_other_users(self):
+        response = bearer_client(self.alice).get(self.path)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ETag", response)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(caching.stats.clear)
+        self.admin = CustomUser.objects.create_superuser(
+            "admin", "admin@example.com", "+919999999999", "password"
+        )
+        self.client.force_login(self.admin)
+        self.customer = make_user("carol", balance=100)
+        self.vendor = make_user("canteen", type=CustomUser.Types.VENDOR)
+
+    def usernames(self, response):
+        self.assertEqual(response.status_code, 200)
+        return sorted(user["username"] for user in response.json())
+
+    def counts(self, view):
+        stats = caching.stats[f"{view.__name__}.list"]
+        return stats["hits"], stats["misses"]
+
+    def test_cached_until_a_dependency_changes(self):
+        path = reverse("users")
+        usernames = self.usernames(self.client.get(path))
+        # an update that sends no signal is not seen, the cached list is served
+        CustomUser.objects.filter(pk=self.customer.pk).update(username="carla")
+        self.assertEqual(self.usernames(self.client.get(path)), usernames)
+        self.assertEqual(self.counts(views.CustomUserList), (1, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_user("dave")
+        self.assertEqual(
+            self.usernames(self.client.get(path)),
+            sorted(["admin", "canteen", "carla", "dave"]),
+        )
+        self.assertEqual(self.counts(views.CustomUserList), (1, 2))
+
+    def test_not_invalidated_before_commit(self):
+        path = reverse("users")
+        self.client.get(path)
+        with self.captureOnCommitCallbacks():
+            make_user("dave")
+        self.assertNotIn("dave", self.usernames(self.client.get(path)))
+
+    def test_per_user_list_follows_the_user_version(self):
+        client = bearer_client(self.customer)
+        path = reverse("customer_vendor", args=[self.customer.user_id])
+        self.assertEqual(self.usernames(client.get(path)), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            transfer(self.customer, self.vendor, "10")
+        self.assertEqual(self.usernames(client.get(path)), ["canteen"])
+        self.assertEqual(self.counts(views.CustomerVendorList), (0, 2))
+
+    def test_cached_per_requesting_user(self):
+        path = reverse("customer_vendor", args=[self.customer.user_id])
+        bearer_client(self.customer).get(path)
+        self.client.get(path)
+        self.assertEqual(self.counts(views.CustomerVendorList), (0, 2))
+
+
+@override_settings(COMPRESSION_MIN_SIZE=100, COMPRESSION_MAX_SIZE=10000)
+class CompressionMiddlewareTests(SimpleTestCase):
+    body = b'{"items": [%s]}' % b",".join(b'{"amount": "%d.00"}' % i for i in range(50))
+
+    def respond(self, response, accept_encoding="gzip"):
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING=accept_encoding)
+        return middleware.CompressionMiddleware(lambda request: response)(request)
+
+    def json(self, body=None, **headers):
+        response = HttpResponse(body or self.body, content_type="application/json")
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    def test_compressed(self):
+        response = self.respond(self.json())
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertEqual(response["Content-Length"], str(len(response.content)))
+        self.assertEqual(zlib.decompress(response.content, 31), self.body)
+
+    def test_size_thresholds(self):
+        for body in (b'{"a": 1}', b"[%s]" % b",".join([b"1"] * 6000)):
+            response = self.respond(self.json(body))
+            self.assertFalse(response.has_header("Content-Encoding"))
+            # the same bytes whatever the client accepts
+            self.assertFalse(response.has_header("Vary"))
+            self.assertEqual(response.content, body)
+
+    def test_other_content_types_are_left_alone(self):
+        response = self.respond(HttpResponse(self.body, content_type="text/csv"))
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_not_accepted(self):
+        for accept_encoding in ("", "identity", "gzip;q=0", "*;q=0"):
+            response = self.respond(self.json(), accept_encoding)
+            self.assertFalse(response.has_header("Content-Encoding"), accept_encoding)
+            self.assertEqual(response["Vary"], "Accept-Encoding")
+            self.assertEqual(response.content, self.body)
+
+    def test_negotiation(self):
+        compressors = {"br": None, "zstd": None, "gzip": None}
+        with mock.patch.dict(middleware.COMPRESSORS, compressors, clear=True):
+            for header, encoding in (
+                ("gzip, deflate, br", "br"),
+                ("gzip;q=1.0, br;q=0", "gzip"),
+                ("*", "br"),
+                ("*, br;q=0, zstd;q=0", "gzip"),
+                ("ZSTD", "zstd"),
+                ("deflate", None),
+                ("gzip;q=x", None),
+            ):
+                self.assertEqual(middleware.accepted_encoding(header), encoding, header)
+        with mock.patch.dict(middleware.COMPRESSORS, {"gzip": None}, clear=True):
+            self.assertEqual(middleware.accepted_encoding("br, zstd"), None)
+
+    def test_weak_etag(self):
+        response = self.respond(self.json(ETag='"abc"'))
+        self.assertEqual(response["ETag"], 'W/"abc"')
+        response = self.respond(self.json(ETag='W/"abc"'))
+        self.assertEqual(response["ETag"], 'W/"abc"')
+        # not compressed, the strong tag still holds
+        response = self.respond(self.json(ETag='"abc"'), "identity")
+        self.assertEqual(response["ETag"], '"abc"')
+
+    def test_already_encoded(self):
+        response = self.respond(self.json(**{"Content-Encoding": "br"}))
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(response.content, self.body)
+
+    def test_stream_chunks_decode_as_they_arrive(self):
+        chunks = [b'{"row": %d}\n' % i for i in range(20)]
+        response = self.respond(
+            StreamingHttpResponse(iter(chunks), content_type="application/json")
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertFalse(response.has_header("Content-Length"))
+        decompressor = zlib.decompressobj(31)
+        received = b""
+        parts = list(response.streaming_content)
+        for i, part in enumerate(parts[:-1]):
+            received += decompressor.decompress(part)
+            # nothing is held back until the end of the stream
+            self.assertEqual(received, b"".join(chunks[: i + 1]))
+        received += decompressor.decompress(parts[-1]) + decompressor.flush()
+        self.assertEqual(received, b"".join(chunks))
+        self.assertTrue(decompressor.eof)
+
+    @skipUnless(middleware.brotli, "brotli is not installed")
+    def test_brotli_stream(self):
+        chunks = [b'{"row": %d}\n' % i for i in range(20)]
+        response = self.respond(
+            StreamingHttpResponse(iter(chunks), content_type="application/json"), "br"
+        )
+        decompressor = middleware.brotli.Decompressor()
+        received = b""
+        for i, part in enumerate(list(response.streaming_content)[:-1]):
+            received += decompressor.process(part)
+            self.assertEqual(received, b"".join(chunks[: i + 1]))
+
+    @skipUnless(middleware.zstandard, "zstandard is not installed")
+    def test_zstd_stream(self):
+        chunks = [b'{"row": %d}\n' % i for i in range(20)]
+        response = self.respond(
+            StreamingHttpResponse(iter(chunks), content_type="application/json"), "zstd"
+        )
+        decompressor = middleware.zstandard.ZstdDecompressor().decompressobj()
+        received = b""
+        for i, part in enumerate(list(response.streaming_content)[:-1]):
+            received += decompressor.decompress(part)
+            self.assertEqual(received, b"".join(chunks[: i + 1]))
+
+
+class WindowThrottle(throttles.SlidingWindowRateThrottle):
+    scope = "test"
+    rate = "3/min"
+
+    def __init__(self, now=1200.0):
+        super().__init__()
+        self.now = now
+        self.timer = lambda: self.now
+
+    def get_cache_key(self, request, view):
+        return "throttle_test"
+
+
+class ThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(throttles.rejections.clear)
+        self.user = make_user("alice")
+
+    def test_window(self):
+        throttle = WindowThrottle()
+        self.assertEqual([throttle.allow_request(None, None) for _ in range(4)], [True] * 3 + [False])
+        # the full window counts for 2 or less a third into the next one
+        self.assertAlmostEqual(throttle.wait(), 80)
+        # halfway through the next window the previous one counts for half
+        throttle.now += 90
+        self.assertEqual([throttle.allow_request(None, None) for _ in range(2)], [True, False])
+        self.assertAlmostEqual(throttle.wait(), 10)
+        throttle.now += 10
+        self.assertTrue(throttle.allow_request(None, None))
+        self.assertEqual(throttles.rejection_stats(), {"test": 2})
+
+    def test_rejected_requests_do_not_count(self):
+        throttle = WindowThrottle()
+        for _ in range(10):
+            throttle.allow_request(None, None)
+        self.assertEqual(cache.get("throttle_test:20"), 3)
+
+    def test_concurrent_requests(self):
+        allowed = []
+        start = threading.Barrier(12)
+
+        def request():
+            throttle = WindowThrottle()
+            start.wait()
+            allowed.append(throttle.allow_request(None, None))
+
+        threads = [threading.Thread(target=request) for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(allowed.count(True), 3)
+
+    def add_balance(self, client, user):
+        return client.post(
+            reverse("add_balance", args=[user.user_id]), {"amount": "10"}
+        )
+
+    def test_user_limit_does_not_use_the_global_one(self):
+        client = bearer_client(self.user)
+        rates = {"payment_user": "2/min", "payment_global": "100/min"}
+        with mock.patch.object(throttles.SimpleRateThrottle, "THROTTLE_RATES", rates):
+            responses = [self.add_balance(client, self.user) for _ in range(4)]
+        self.assertEqual([r.status_code for r in responses], [200, 200, 429, 429])
+        self.assertIn("Retry-After", responses[2])
+        self.assertEqual(throttles.rejection_stats(), {"payment_user": 2})
+        window = int(time.time() // 60)
+        self.assertEqual(cache.get(f"throttle_payment_global_all:{window}"), 2)
+
+    def test_global_limit_gives_the_user_limit_back(self):
+        other = make_user("bob")
+        rates = {"payment_user": "5/min", "payment_global": "1/min"}
+        with mock.patch.object(throttles.SimpleRateThrottle, "THROTTLE_RATES", rates):
+            self.assertEqual(self.add_balance(bearer_client(self.user), self.user).status_code, 200)
+            self.assertEqual(self.add_balance(bearer_client(other), other).status_code, 429)
+        window = int(time.time() // 60)
+        self.assertEqual(cache.get(f"throttle_payment_user_{other.user_id}:{window}"), 0)
+        self.assertEqual(throttles.rejection_stats(), {"payment_global": 1})
+
+
+class WriteLimiterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(throttles.rejections.clear)
+        self.user = make_user("alice")
+        self.client = bearer_client(self.user)
+
+    def add_balance(self):
+        return self.client.post(
+            reverse("add_balance", args=[self.user.user_id]), {"amount": "10"}
+        )
+
+    def test_queue_full(self):
+        limiter = throttles.WriteLimiter(1, 0, 5)
+        with mock.patch.object(throttles, "write_limiter", limiter):
+            with limiter.admit():
+                response = self.add_balance()
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], "5")
+            self.assertEqual(self.add_balance().status_code, 200)
+        self.assertEqual(throttles.rejection_stats(), {"write_queue_full": 1})
+        self.assertEqual(wallet_of(self.user).balance, 10)
+
+    def test_queue_timeout(self):
+        limiter = throttles.WriteLimiter(1, 1, 0.05)
+        with mock.patch.object(throttles, "write_limiter", limiter):
+            with limiter.admit():
+                response = self.add_balance()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(throttles.rejection_stats(), {"write_queue_timeout": 1})
+        self.assertEqual(limiter.waiting, 0)
+
+    def test_waits_for_a_slot(self):
+        limiter = throttles.WriteLimiter(1, 1, 5)
+        slot = limiter.admit()
+        slot.__enter__()
+        threading.Timer(0.05, slot.__exit__, (None, None, None)).start()
+        with mock.patch.object(throttles, "write_limiter", limiter):
+            self.assertEqual(self.add_balance().status_code, 200)
+
+
+class MetricsFormatTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+        with mock.patch.object(metrics, "registry", self.registry):
+            self.counter = metrics.Counter("things_total", "Things.", ("kind",))
+            self.histogram = metrics.Histogram("wait_seconds", "Waits.", buckets=(0.1, 1))
+        self.registry.collector("other_total", "Other.", "reason", lambda: {"x": 3})
+
+    def record(self):
+        self.counter.inc(kind='a "b"\n')
+        self.counter.inc(2, kind="c")
+        for value in (0.1, 0.5, 4):
+            self.histogram.observe(value)
+
+    def test_render(self):
+        self.record()
+        self.assertEqual(
+            self.registry.render(),
+            "# HELP other_total Other.\n"
+            "# TYPE other_total counter\n"
+            'other_total{reason="x"} 3\n'
+            "# HELP things_total Things.\n"
+            "# TYPE things_total counter\n"
+            'things_total{kind="a \\"b\\"\\n"} 1\n'
+            'things_total{kind="c"} 2\n'
+            "# HELP wait_seconds Waits.\n"
+            "# TYPE wait_seconds histogram\n"
+            'wait_seconds_bucket{le="0.1"} 1\n'
+            'wait_seconds_bucket{le="1"} 2\n'
+            'wait_seconds_bucket{le="+Inf"} 3\n'
+            "wait_seconds_sum 4.6\n"
+            "wait_seconds_count 3\n",
+        )
+
+    def test_workers_are_added_up(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(METRICS_DIR=directory):
+            self.record()
+            # another worker, written by its last flush
+            with mock.patch("os.getpid", return_value=0):
+                self.registry.flush()
+            self.counter.inc(kind="c")
+            text = self.registry.render()
+        self.assertIn('things_total{kind="c"} 5\n', text)
+        self.assertIn('wait_seconds_bucket{le="+Inf"} 6\n', text)
+        self.assertIn("wait_seconds_count 6\n", text)
+        self.assertIn('other_total{reason="x"} 6\n', text)
+        self.assertEqual(len(os.listdir(directory)), 2)
+
+
+class MetricsViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        throttles.rejections.clear()
+        self.addCleanup(throttles.rejections.clear)
+        self.customer = make_user("carol")
+        self.vendor = make_user("canteen", type=CustomUser.Types.VENDOR)
+        fund(self.customer, "50")
+        # only what the test does
+        metrics.registry.reset()
+
+    def scrape(self):
+        admin = CustomUser.objects.create_superuser(
+            "admin", "admin@example.com", "+919999999999", "password"
+        )
+        self.client.force_login(admin)
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        return response.content.decode()
+
+    def test_superusers_only(self):
+        response = bearer_client(self.customer).get(reverse("metrics"))
+        self.assertEqual(response.status_code, 403)
+
+    def test_counters(self):
+        transfer(self.customer, self.vendor, "30")
+        transfer(self.customer, self.vendor, "30")
+        transfer(self.customer, self.vendor, "5", Transaction.PENDING)
+        client = bearer_client(self.customer)
+        rates = {"payment_user": "1/min", "payment_global": "100/min"}
+        with mock.patch.object(throttles.SimpleRateThrottle, "THROTTLE_RATES", rates):
+            for _ in range(2):
+                client.post(
+                    reverse("add_balance", args=[self.customer.user_id]), {"amount": "10"}
+                )
+        text = self.scrape()
+        for line in (
+            'transactions_total{status="success"} 1',
+            'transactions_total{status="failed"} 1',
+            'transactions_total{status="pending"} 1',
+            'transaction_amount_total{status="success"} 30.0',
+            'transaction_failures_total{reason="insufficient_funds"} 1',
+            'payment_rejections_total{reason="payment_user"} 1',
+            'http_requests_total{method="POST",route="api/users/<str:user_id>/add_balance/",status="429"} 1',
+        ):
+            self.assertIn(line + "\n", text)
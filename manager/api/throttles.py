@@ -0,0 +1,200 @@
+import math
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.throttling import BaseThrottle, SimpleRateThrottle
+
+# requests rejected by the throttles and the write limiter of this process
+rejections_lock = threading.Lock()
+rejections = Counter()
+
+
+def count_rejection(reason):
+    with rejections_lock:
+        rejections[reason] += 1
+
+
+def rejection_stats():
+    with rejections_lock:
+        return dict(rejections)
+
+
+class SlidingWindowRateThrottle(SimpleRateThrottle):
+    """
+    Rate limit with the scope's rate from DEFAULT_THROTTLE_RATES, e.g. "30/min".
+    Requests are counted per fixed window of the rate's duration and the
+    count of the previous window is weighted by how much of it the sliding
+    window still covers, so a client that was quiet may burst up to the rate
+    and then settles at it. The counters are cache.add/cache.incr, atomic in
+    the cache backends, so concurrent requests cannot share the last request
+    left, and all workers share them when the cache is shared.
+    """
+
+    # the counter the request was counted in, None if it was not
+    counter = None
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        return self.take()
+
+    def take(self):
+        now = self.timer()
+        window, self.elapsed = divmod(now / self.duration, 1)
+        self.counter = f"{self.key}:{int(window)}"
+        self.previous = cache.get(f"{self.key}:{int(window) - 1}", 0)
+        # kept while it is the current or the previous window
+        cache.add(self.counter, 0, self.duration * 2)
+        try:
+            self.current = cache.incr(self.counter)
+        except ValueError:
+            # expired in between
+            cache.set(self.counter, 1, self.duration * 2)
+            self.current = 1
+        if self.previous * (1 - self.elapsed) + self.current <= self.num_requests:
+            return True
+        self.give_back()
+        count_rejection(self.scope)
+        return False
+
+    def give_back(self):
+        # the request was not let through, it does not count
+        if self.counter is None:
+            return
+        self.current -= 1
+        try:
+            cache.decr(self.counter)
+        except ValueError:
+            pass
+
+    def wait(self):
+        # seconds until the weighted count leaves room for one more request
+        room = self.num_requests - 1 - self.current
+        if room >= 0 and self.previous:
+            return max(0, 1 - room / self.previous - self.elapsed) * self.duration
+        # only once the current window has become the previous one
+        later = max(0, 1 - (self.num_requests - 1) / max(self.current, 1))
+        return (1 - self.elapsed + later) * self.duration
+
+
+class PaymentUserRateThrottle(SlidingWindowRateThrottle):
+    scope = "payment_user"
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {"scope": self.scope, "ident": ident}
+
+
+class PaymentGlobalRateThrottle(SlidingWindowRateThrottle):
+    scope = "payment_global"
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {"scope": self.scope, "ident": "all"}
+
+
+class PaymentRateThrottle(BaseThrottle):
+    """
+    The per-user and the global payment limits as one throttle. DRF checks
+    every throttle of a view, so as separate throttles a request rejected by
+    the user limit would still use up the global one. Here a limit is only
+    checked once the ones before it let the request through, and what they
+    counted is given back when a later one rejects it.
+    """
+
+    limits = (PaymentUserRateThrottle, PaymentGlobalRateThrottle)
+
+    def allow_request(self, request, view):
+        taken = []
+        for throttle in (limit() for limit in self.limits):
+            if not throttle.allow_request(request, view):
+                for other in taken:
+                    other.give_back()
+                self.rejected_by = throttle
+                return False
+            taken.append(throttle)
+        return True
+
+    def wait(self):
+        return self.rejected_by.wait()
+
+
+PAYMENT_THROTTLES = (PaymentRateThrottle,)
+
+
+class WriteQueueFull(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many payments in progress, retry shortly."
+    default_code = "write_queue_full"
+
+    def __init__(self, wait):
+        super().__init__()
+        # sent as Retry-After (whole seconds) by the DRF exception handler
+        self.wait = max(1, math.ceil(wait))
+
+
+class WriteLimiter:
+    """
+    Admission control for the write endpoints of this process: at most
+    `concurrency` run at once, up to `queue_limit` more wait up to `timeout`
+    seconds for a slot, everything beyond that is rejected right away.
+    SQLite runs one writer at a time, piling up more only makes every
+    payment wait on the database lock.
+    """
+
+    def __init__(self, concurrency, queue_limit, timeout):
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+
+    @contextmanager
+    def admit(self):
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                if self.waiting >= self.queue_limit:
+                    count_rejection("write_queue_full")
+                    raise WriteQueueFull(self.timeout)
+                self.waiting += 1
+            try:
+                admitted = self.slots.acquire(timeout=self.timeout)
+            finally:
+                with self.lock:
+                    self.waiting -= 1
+            if not admitted:
+                count_rejection("write_queue_timeout")
+                raise WriteQueueFull(self.timeout)
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+
+write_limiter = WriteLimiter(
+    settings.WRITE_CONCURRENCY, settings.WRITE_QUEUE_LIMIT, settings.WRITE_QUEUE_TIMEOUT
+)
+
+
+def admission_controlled(method):
+    """
+    Run a view method (post) under `write_limiter`, after auth and throttles.
+    """
+
+    @wraps(method)
+    def controlled(self, request, *args, **kwargs):
+        with write_limiter.admit():
+            return method(self, request, *args, **kwargs)
+
+    return controlled
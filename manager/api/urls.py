@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
@@ -10,6 +11,7 @@ urlpatterns = [
     path("users/<str:user_id>/navbar/", views.OverviewNavbar.as_view(), name="navbar-details"),
     path("users/<str:user_id>/overview/", views.OverviewTable.as_view(), name="overview-details"),
     path("users/<str:user_id>/transactions/make/", views.UserMakeTransaction.as_view(), name="user_transactions_post"),
+    path("users/<str:user_id>/transactions/bulk/", views.UserBulkTransfer.as_view(), name="user_bulk_transfer"),
     path("users/<str:user_id>/clear_dues/", views.ClearDues.as_view(), name="clear_dues"),
     path("users/<str:user_id>/clear_vendor_dues/", views.ClearDuesVendor.as_view(), name="clear_dues_vendor"),
     path("users/<str:user_id>/vendors/", views.CustomerVendorList.as_view(), name="customer_vendor"),
@@ -19,7 +21,22 @@ urlpatterns = [
     path("users/<str:user_id>/request_clearance/", views.RequestClearance.as_view(), name="request_clearance"),
     path("users/<str:user_id>/notifications/", views.UserNotificationList.as_view(), name="notification"),
     path("users/<str:user_id>/add_balance/", views.UserAddBalance.as_view(), name="add_balance"), 
+    path("users/<str:user_id>/analytics/", views.VendorAnalytics.as_view(), name="vendor_analytics"),
+    path("users/<str:user_id>/issues/", views.UserIssueList.as_view(), name="user_issues"),
+    path("issues/queue/", views.IssueQueue.as_view(), name="issue_queue"),
+    path("issues/claim/", views.IssueClaim.as_view(), name="issue_claim"),
+    path("issues/<int:issue_id>/resolve/", views.IssueResolve.as_view(), name="issue_resolve"),
+    path("throttles/stats/", views.RejectionStats.as_view(), name="rejection_stats"),
+    path("velocity/stats/", views.VelocityStats.as_view(), name="velocity_stats"),
+    path("cache/stats/", views.ResponseCacheStats.as_view(), name="response_cache_stats"),
+    path("events/", views.EventFeed.as_view(), name="events"),
+    path("wallets/top_up/", views.WalletTopUp.as_view(), name="wallet_top_up"),
     path("transactions/", views.TransactionList.as_view(), name="transactions"),
     path("transactions/<str:transaction_id>/", views.TransactionDetail.as_view(), name="transaction"),
     path("notifications/", views.NotificationList.as_view(), name="notifications"),
 ]
+
+if settings.ASYNC_VIEWS:
+    from .async_views import asgi_urlpatterns
+
+    urlpatterns = asgi_urlpatterns(urlpatterns)
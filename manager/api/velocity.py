@@ -0,0 +1,245 @@
+import logging
+import math
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import Transaction
+from .throttles import count_rejection
+
+logger = logging.getLogger(__name__)
+
+# buckets per window of the shared tracker
+CACHE_BUCKETS = 6
+
+# transfers checked, flagged and blocked by this process
+counts_lock = threading.Lock()
+counts = Counter()
+
+
+def count(*names):
+    with counts_lock:
+        counts.update(names)
+
+
+def velocity_stats():
+    with counts_lock:
+        return dict(counts)
+
+
+class VelocityLimitExceeded(APIException):
+    status_code = status.HTTP_429_TOO_MANY_REQUESTS
+    default_detail = "Too many or too large payments in a short time, retry later."
+    default_code = "velocity_limit_exceeded"
+
+    def __init__(self, wait):
+        super().__init__()
+        # sent as Retry-After (whole seconds) by the DRF exception handler
+        self.wait = max(1, math.ceil(wait))
+
+
+def window_keys(sender, receiver):
+    return {
+        "sender": ("sender", sender),
+        "receiver": ("receiver", receiver),
+        "pair": ("pair", sender, receiver),
+    }
+
+
+def window_totals(sender, transfers):
+    # {(dimension, key): (transfers, amount)} the transfers add to each window
+    totals = {}
+    for receiver, amount in transfers:
+        for dimension, key in window_keys(sender, receiver).items():
+            count, total = totals.get((dimension, key), (0, 0))
+            totals[dimension, key] = (count + 1, total + amount)
+    return totals
+
+
+class SlidingWindow:
+    # (time, amount) of the transfers in the window with their running total
+    __slots__ = ("entries", "amount")
+
+    def __init__(self):
+        self.entries = deque()
+        self.amount = Decimal("0")
+
+    def expire(self, start):
+        while self.entries and self.entries[0][0] <= start:
+            self.amount -= self.entries.popleft()[1]
+
+    def add(self, when, amount):
+        self.entries.append((when, amount))
+        self.amount += amount
+
+
+class VelocityTracker:
+    """
+    Count and amount of the transfers of the last `window` seconds per sender,
+    per receiver and per pair, kept in memory. `limits` maps each dimension to
+    (transfers, amount). A check is a few dict lookups under a lock, no query.
+    The windows are seeded from the recent transactions on first use, so a
+    restart does not reset them.
+    """
+
+    def __init__(self, window, limits):
+        self.window = window
+        self.limits = limits
+        self.windows = {}
+        self.lock = threading.Lock()
+        self.seeded = False
+        self.next_sweep = 0
+
+    def seed(self):
+        since = datetime.fromtimestamp(time.time() - self.window, dt_timezone.utc)
+        recent = (
+            Transaction.objects.filter(timestamp__gt=since)
+            .exclude(transaction_status=Transaction.FAILED)
+            .order_by("timestamp")
+            .values_list(
+                "timestamp", "sender__user_id", "receiver__user_id", "transaction_amount"
+            )
+        )
+        for timestamp, sender, receiver, amount in recent.iterator():
+            for key in window_keys(sender, receiver).values():
+                self.windows.setdefault(key, SlidingWindow()).add(
+                    timestamp.timestamp(), amount
+                )
+        self.seeded = True
+
+    def sweep(self, start):
+        # drop the windows of idle wallets
+        for key, window in list(self.windows.items()):
+            window.expire(start)
+            if not window.entries:
+                del self.windows[key]
+
+    def admit(self, sender, transfers, block=True):
+        """
+        Check the transfers of `sender`, (receiver, amount) each, against the
+        limits as one and record them, unless they exceed them and `block` is
+        set. Returns the exceeded dimensions and the seconds until the oldest
+        transfer of those leaves the window.
+        """
+        now = time.time()
+        start = now - self.window
+        totals = window_totals(sender, transfers)
+        exceeded, wait = [], 0
+        with self.lock:
+            if not self.seeded:
+                self.seed()
+            if now >= self.next_sweep:
+                self.sweep(start)
+                self.next_sweep = now + self.window
+            for (dimension, key), (count, amount) in totals.items():
+                window = self.windows.get(key) or SlidingWindow()
+                window.expire(start)
+                max_count, max_amount = self.limits[dimension]
+                if (
+                    len(window.entries) + count > max_count
+                    or window.amount + amount > max_amount
+                ):
+                    if dimension not in exceeded:
+                        exceeded.append(dimension)
+                    oldest = window.entries[0][0] if window.entries else now
+                    wait = max(wait, oldest - start)
+            if exceeded and block:
+                return exceeded, wait
+            for receiver, amount in transfers:
+                for key in window_keys(sender, receiver).values():
+                    self.windows.setdefault(key, SlidingWindow()).add(now, amount)
+        return exceeded, wait
+
+
+class CacheVelocityTracker:
+    """
+    Same checks with the windows in the cache, shared by all workers when the
+    cache is. Each window is split in CACHE_BUCKETS counters, so it slides by
+    a bucket at a time. A check and its record are not atomic, concurrent
+    transfers may all pass the last free slot.
+    """
+
+    def __init__(self, window, limits):
+        self.window = window
+        self.limits = limits
+        self.bucket = window / CACHE_BUCKETS
+
+    def bucket_keys(self, key, now):
+        current = int(now // self.bucket)
+        ident = ":".join(key)
+        return [
+            f"velocity:{ident}:{bucket}"
+            for bucket in range(current - CACHE_BUCKETS + 1, current + 1)
+        ]
+
+    def admit(self, sender, transfers, block=True):
+        now = time.time()
+        totals = window_totals(sender, transfers)
+        totals = {
+            (dimension, tuple(self.bucket_keys(key, now))): (count, int(amount * 100))
+            for (dimension, key), (count, amount) in totals.items()
+        }
+        # [count, amount in paise] per bucket
+        values = cache.get_many([k for _, bucket_keys in totals for k in bucket_keys])
+        exceeded = []
+        for (dimension, bucket_keys), (count, paise) in totals.items():
+            buckets = [values.get(k, (0, 0)) for k in bucket_keys]
+            max_count, max_amount = self.limits[dimension]
+            if (
+                sum(n for n, _ in buckets) + count > max_count
+                or sum(p for _, p in buckets) + paise > max_amount * 100
+            ) and dimension not in exceeded:
+                exceeded.append(dimension)
+        if exceeded and block:
+            return exceeded, self.bucket
+        for (_, bucket_keys), (count, paise) in totals.items():
+            n, p = values.get(bucket_keys[-1], (0, 0))
+            cache.set(bucket_keys[-1], (n + count, p + paise), self.window + self.bucket)
+        return exceeded, self.bucket
+
+
+def make_tracker():
+    tracker = CacheVelocityTracker if settings.VELOCITY_SHARED else VelocityTracker
+    return tracker(settings.VELOCITY_WINDOW, settings.VELOCITY_LIMITS)
+
+
+velocity_tracker = make_tracker()
+
+
+def check_velocity(sender, receiver, amount):
+    # a single transfer between two user ids
+    check_transfers(sender, [(receiver, amount)])
+
+
+def check_transfers(sender, transfers):
+    """
+    Run transfers from the user id `sender`, (receiver user id, amount) each,
+    through the velocity tracker as one, e.g. the items of a bulk transfer.
+    With VELOCITY_ACTION "block" anomalous transfers raise
+    VelocityLimitExceeded (429), with "flag" they are only logged and counted.
+    """
+    block = settings.VELOCITY_ACTION == "block"
+    exceeded, wait = velocity_tracker.admit(sender, transfers, block)
+    if not exceeded:
+        count("checked")
+        return
+    action = "blocked" if block else "flagged"
+    count("checked", *(f"{action}_{dimension}" for dimension in exceeded))
+    logger.warning(
+        "%d transfer(s) of Rs. %s from %s %s, velocity limits exceeded: %s",
+        len(transfers),
+        sum(amount for _, amount in transfers),
+        sender,
+        action,
+        ", ".join(exceeded),
+    )
+    if block:
+        count_rejection("velocity")
+        raise VelocityLimitExceeded(wait)
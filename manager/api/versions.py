@@ -0,0 +1,100 @@
+import time
+import uuid
+from functools import wraps
+from hashlib import sha1
+
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+# Every write that touches a user's wallet, transactions or notifications gives
+# the user a new version (bumped after commit from api/events.py). Read views
+# derive their ETag and Last-Modified from it, so a client whose copy is current
+# gets a 304 before any query runs. The versions live in the cache, a lost
+# entry only costs one full response per client.
+VERSION_KEY = "user_version:{}"
+VERSION_TIMEOUT = 7 * 24 * 3600
+
+
+def new_version():
+    return uuid.uuid4().hex, int(time.time())
+
+
+def bump_versions(user_ids):
+    cache.set_many(
+        {VERSION_KEY.format(user_id): new_version() for user_id in user_ids},
+        VERSION_TIMEOUT,
+    )
+
+
+def user_version(user_id):
+    """
+    (token, modified) of the user, `modified` in epoch seconds.
+    """
+    version = cache.get(VERSION_KEY.format(user_id))
+    if version is None:
+        version = new_version()
+        # a concurrent bump wins over this fresh version
+        if not cache.add(VERSION_KEY.format(user_id), version, VERSION_TIMEOUT):
+            version = cache.get(VERSION_KEY.format(user_id), version)
+    return version
+
+
+async def auser_version(user_id):
+    version = await cache.aget(VERSION_KEY.format(user_id))
+    if version is None:
+        version = new_version()
+        if not await cache.aadd(VERSION_KEY.format(user_id), version, VERSION_TIMEOUT):
+            version = await cache.aget(VERSION_KEY.format(user_id), version)
+    return version
+
+
+def make_etag(request, version):
+    # one user version covers several endpoints, the URL tells them apart
+    return quote_etag(
+        sha1(f"{version[0]}:{request.get_full_path()}".encode()).hexdigest()
+    )
+
+
+def not_modified(request, version):
+    """
+    304 response if the client's copy is current, else None.
+    """
+    etag = make_etag(request, version)
+    response = get_conditional_response(request, etag=etag, last_modified=version[1])
+    if response is not None:
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(version[1])
+    return response
+
+
+def set_validators(response, request, version):
+    # version is None for requests that get no validators
+    if version is not None and response.status_code == 200:
+        response["ETag"] = make_etag(request, version)
+        response["Last-Modified"] = http_date(version[1])
+    return response
+
+
+def conditional_user_get(get):
+    """
+    Decorator for the `get` of user-scoped DRF views (url with user_id).
+    The version is read before the view runs, so the validators can only be
+    older than the data, never newer.
+    """
+
+    @wraps(get)
+    def conditional_get(self, request, *args, **kwargs):
+        user_id = kwargs["user_id"]
+        # only the user and admins get validators, everyone else the usual checks
+        if not (
+            request.user.is_superuser or getattr(request.user, "user_id", None) == user_id
+        ):
+            return get(self, request, *args, **kwargs)
+        version = user_version(user_id)
+        response = not_modified(request, version)
+        if response is not None:
+            return response
+        return set_validators(get(self, request, *args, **kwargs), request, version)
+
+    return conditional_get
@@ -1,24 +1,72 @@
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404, render
 from rest_framework import generics
 from rest_framework.views import APIView
-from .models import CustomUser, Customer, Vendor, Transaction, Wallet, Notification
+from .models import (
+    CustomUser,
+    Customer,
+    Vendor,
+    Transaction,
+    Wallet,
+    Notification,
+    Issue,
+    generate_txn_id,
+)
 from .serializers import (
     CustomUserSerializer,
     TransactionSerializer,
     NotificationSerializer,
+    IssueRaiseSerializer,
+    VendorAnalyticsQuerySerializer,
+    requested_fields,
+    sparse_queryset,
+)
+from .services import (
+    MAX_BULK_TRANSFER,
+    BulkTransferConflict,
+    bulk_transfer,
+    top_up_wallets,
+)
+from .analytics import vendor_analytics
+from .versions import conditional_user_get
+from .caching import cache_stats, cached_response
+from .throttles import PAYMENT_THROTTLES, admission_controlled, rejection_stats
+from .velocity import check_velocity, velocity_stats
+from .metrics import registry
+from django.http import HttpResponse
+from .reminders import request_clearance
+from .outbox import read_events
+from .issues import (
+    MAX_PAGE_SIZE,
+    PAGE_SIZE,
+    ISSUE_FIELDS,
+    claim_issues,
+    issue_page,
+    resolve_issues,
 )
 from rest_framework import status, serializers, permissions
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
 from django.db.models import Q
 import json
 from django.core.serializers.json import DjangoJSONEncoder
 from decimal import Decimal
-from datetime import datetime
+from datetime import datetime, timedelta
+from django.utils import timezone
 
 from rest_framework.response import Response
 
 # Create your views here.
+# ?fields= on generic views: the serializer drops the other fields (see
+# SparseFieldsMixin) and the query skips their columns
+class SparseQuerysetMixin:
+    def filter_queryset(self, queryset):
+        return sparse_queryset(
+            super().filter_queryset(queryset), requested_fields(self.request)
+        )
+
+
 # List of all CustomUsers
-class CustomUserList(generics.ListCreateAPIView):
+class CustomUserList(SparseQuerysetMixin, generics.ListCreateAPIView):
     permissions_classes = (permissions.IsAuthenticated,)
 
     # if user is not admin, send a 403 error
@@ -38,9 +86,13 @@ class CustomUserList(generics.ListCreateAPIView):
     queryset = CustomUser.objects.all()
     serializer_class = CustomUserSerializer
 
+    @cached_response(depends_on=(CustomUser,))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
 # Detail of a CustomUser
-class CustomUserDetail(generics.RetrieveAPIView):
+class CustomUserDetail(SparseQuerysetMixin, generics.RetrieveAPIView):
     # if user is the same as the user_id, or user is admin, send the data
     permissions_classes = (permissions.IsAuthenticated,)
 
@@ -64,13 +116,13 @@ class CustomUserDetail(generics.RetrieveAPIView):
     serializer_class = CustomUserSerializer
 
     def get_object(self):
-        queryset = self.get_queryset()
+        queryset = self.filter_queryset(self.get_queryset())
         obj = queryset.get(user_id=self.kwargs["user_id"])
         return obj
 
 
 # List of all the customers
-class CustomerList(generics.ListCreateAPIView):
+class CustomerList(SparseQuerysetMixin, generics.ListCreateAPIView):
     permission_classes = (permissions.IsAuthenticated,)
 
     def get(self, request, *args, **kwargs):
@@ -89,9 +141,13 @@ class CustomerList(generics.ListCreateAPIView):
     queryset = Customer.objects.all()
     serializer_class = CustomUserSerializer
 
+    @cached_response(depends_on=(CustomUser,))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
 # List of all the Vendors
-class VendorList(generics.ListCreateAPIView):
+class VendorList(SparseQuerysetMixin, generics.ListCreateAPIView):
     permission_classes = (permissions.IsAuthenticated,)
 
     def get(self, request, *args, **kwargs):
@@ -110,9 +166,13 @@ class VendorList(generics.ListCreateAPIView):
     queryset = Vendor.objects.all()
     serializer_class = CustomUserSerializer
 
+    @cached_response(depends_on=(CustomUser,))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
 # list of all the transactions
-class TransactionList(generics.ListCreateAPIView):
+class TransactionList(SparseQuerysetMixin, generics.ListCreateAPIView):
     permission_classes = (permissions.IsAuthenticated,)
 
     def get(self, request, *args, **kwargs):
@@ -133,7 +193,7 @@ class TransactionList(generics.ListCreateAPIView):
 
 
 # detail of a transaction
-class TransactionDetail(generics.RetrieveAPIView):
+class TransactionDetail(SparseQuerysetMixin, generics.RetrieveAPIView):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
     permission_classes = (permissions.IsAuthenticated,)
@@ -152,7 +212,7 @@ class TransactionDetail(generics.RetrieveAPIView):
         return super().get(request, *args, **kwargs)
 
     def get_object(self):
-        queryset = self.get_queryset()
+        queryset = self.filter_queryset(self.get_queryset())
         obj = queryset.get(transaction_id=self.kwargs["transaction_id"])
         return obj
 
@@ -190,22 +250,34 @@ class TransactionDetail(generics.RetrieveAPIView):
 class UserTransactionList(APIView):
     permission_classes = (permissions.IsAuthenticated,)
 
+    @conditional_user_get
     def get(self, request, *args, **kwargs):
         user_id = self.kwargs["user_id"]
         sender = CustomUser.objects.get(user_id=user_id)
         wallet = Wallet.objects.get(user=sender)
         transactions = Transaction.objects.filter(Q(sender=wallet) | Q(receiver=wallet))
-        data = []
-        for transaction in transactions:
-            item = {
-                "transaction_id": transaction.transaction_id,
-                "timestamp": transaction.timestamp,
-                "transaction_amount": transaction.transaction_amount,
-                "transaction_status": transaction.transaction_status,
-                "sender": transaction.sender.user.user_id,
-                "receiver": transaction.receiver.user.user_id
-            }
-            data.append(item)
+        # item key -> column, the wallets are reported by their user's id
+        columns = {
+            "transaction_id": "transaction_id",
+            "timestamp": "timestamp",
+            "transaction_amount": "transaction_amount",
+            "transaction_status": "transaction_status",
+            "failure_reason": "failure_reason",
+            "sender": "sender__user_id",
+            "receiver": "receiver__user_id",
+        }
+        fields = requested_fields(request)
+        if fields is not None:
+            unknown = fields - set(columns)
+            if unknown:
+                raise serializers.ValidationError(
+                    {"fields": [f"Unknown fields: {', '.join(sorted(unknown))}"]}
+                )
+            columns = {key: column for key, column in columns.items() if key in fields}
+        data = [
+            dict(zip(columns, row))
+            for row in transactions.values_list(*columns.values())
+        ]
         
         # response_data = json.dumps(data, cls=CustomJSONEncoder)
         # print(response_data)
@@ -213,13 +285,21 @@ class UserTransactionList(APIView):
         
 
 
+FAILURE_MESSAGES = {
+    Transaction.INSUFFICIENT_FUNDS: "Insufficient Balance",
+    Transaction.PENDING_LIMIT: "Pending dues limit exceeded",
+    Transaction.ISSUE_REJECTED: "Transaction failed",
+}
+
+
 class UserMakeTransaction(APIView):
     permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = PAYMENT_THROTTLES
 
+    @admission_controlled
     def post(self, request, *args, **kwargs):
         receiver_id = request.data.get("receiver_id")
         sender_id = self.kwargs["user_id"]
-        print(receiver_id, sender_id)
 
         sender = CustomUser.objects.get(user_id=sender_id)
         wallet_sender = Wallet.objects.get(user=sender)
@@ -236,18 +316,61 @@ class UserMakeTransaction(APIView):
 
         serializer = TransactionSerializer(data=transaction_data)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
-        # if wallet balance less than transaction amount
-        if wallet_sender.balance < int(transaction_data["transaction_amount"]):
+        check_velocity(
+            sender_id, receiver_id, serializer.validated_data["transaction_amount"]
+        )
+        transaction = serializer.save()
+        result = {
+            "transaction_id": transaction.transaction_id,
+            "transaction_status": transaction.transaction_status,
+        }
+        # the engine records why it failed the payment, no need to re-check the balance
+        if transaction.transaction_status == Transaction.FAILED:
             return Response(
-                {"message": "Insufficient Balance"},
+                {
+                    "message": FAILURE_MESSAGES[transaction.failure_reason],
+                    "failure_reason": transaction.failure_reason,
+                    **result,
+                },
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        return Response({"message": "Transaction updated"})
+        return Response({"message": "Transaction updated", **result})
+
+
+# pays a list of {receiver_id, amount} from the user's wallet, e.g. stipends or refunds
+class UserBulkTransfer(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = PAYMENT_THROTTLES
+
+    @admission_controlled
+    def post(self, request, *args, **kwargs):
+        if not (request.user.is_superuser or request.user.user_id == self.kwargs["user_id"]):
+            return Response({"message": "Not Authorized to access."}, status=status.HTTP_403_FORBIDDEN)
+        if not isinstance(request.data, list) or not request.data:
+            return Response(
+                {"message": "Expected a list of transfers."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(request.data) > MAX_BULK_TRANSFER:
+            return Response(
+                {"message": f"At most {MAX_BULK_TRANSFER} transfers per request."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            results = bulk_transfer(self.kwargs["user_id"], request.data)
+        except Wallet.DoesNotExist:
+            return Response({"message": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+        except BulkTransferConflict:
+            return Response(
+                {"message": "The balance changed during the transfer, retry the batch."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        applied = sum(1 for result in results if result["status"] == "applied")
+        return Response({"applied": applied, "results": results})
 
 
 # list of all the vendors only if the user is a customer
-class CustomerVendorList(generics.ListAPIView):
+class CustomerVendorList(SparseQuerysetMixin, generics.ListAPIView):
     serializer_class = CustomUserSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
@@ -279,9 +402,13 @@ class CustomerVendorList(generics.ListAPIView):
                 vendors.append(transaction.receiver.user)
         return vendors
 
+    @cached_response(depends_on=(CustomUser,), per_user=True)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
 # list of all the customers only if the user is a vendor
-class VendorCustomerList(generics.ListAPIView):
+class VendorCustomerList(SparseQuerysetMixin, generics.ListAPIView):
     serializer_class = CustomUserSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
@@ -313,9 +440,13 @@ class VendorCustomerList(generics.ListAPIView):
                 customers.append(transaction.sender.user)
         return customers
 
+    @cached_response(depends_on=(CustomUser,), per_user=True)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
 # list of all the notifications
-class NotificationList(generics.ListAPIView):
+class NotificationList(SparseQuerysetMixin, generics.ListAPIView):
     permission_classes = (permissions.IsAuthenticated,)
 
     def get(self, request, *args, **kwargs):
@@ -336,10 +467,11 @@ class NotificationList(generics.ListAPIView):
 
 
 # list of all the notifications of a user
-class UserNotificationList(generics.ListAPIView):
+class UserNotificationList(SparseQuerysetMixin, generics.ListAPIView):
     serializer_class = NotificationSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
+    @conditional_user_get
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response(
@@ -366,6 +498,7 @@ class PendingDuesList(generics.ListAPIView):
     serializer_class = TransactionSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
+    @conditional_user_get
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response(
@@ -410,6 +543,7 @@ class PendingDuesVendor(generics.ListAPIView):
     serializer_class = TransactionSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
+    @conditional_user_get
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response(
@@ -451,8 +585,10 @@ class PendingDuesVendor(generics.ListAPIView):
 
 class ClearDues(APIView):
     permissions_classes = (permissions.IsAuthenticated,)
+    throttle_classes = PAYMENT_THROTTLES
 
     # send the total dues of a customer to all the vendors
+    @admission_controlled
     def post(self, request, *args, **kwargs):
         user_id = self.kwargs["user_id"]
         user = CustomUser.objects.get(user_id=user_id)
@@ -496,7 +632,6 @@ class ClearDues(APIView):
                     transaction_amount=pending_dues[receiver],
                     transaction_status=0,
                 )
-                print("New Transaction instantiated while clearing dues")
                 # transaction.save()
             return Response({"message": "Dues cleared successfully."})
         
@@ -504,7 +639,9 @@ class ClearDues(APIView):
 # clearing all the dues of a customer to a particular vendor
 class ClearDuesVendor(APIView):
     permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = PAYMENT_THROTTLES
 
+    @admission_controlled
     def post(self, request, *args, **kwargs):
         user_id = self.kwargs["user_id"]
         receiver_id = request.data["receiver_id"]
@@ -545,19 +682,57 @@ class ClearDuesVendor(APIView):
         
 class UserAddBalance(APIView):
     permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = PAYMENT_THROTTLES
     
+    @admission_controlled
     def post(self, request, *args, **kwargs):
-        user_id = self.kwargs["user_id"]
-        user = CustomUser.objects.get(user_id=user_id)
-        wallet = Wallet.objects.get(user=user)
-
-        wallet.balance += request.data["amount"]
-        wallet.save()
+        # a client generated reference makes retries safe, otherwise every call is a new top-up
+        row = {
+            "user_id": self.kwargs["user_id"],
+            "amount": request.data.get("amount"),
+            "reference": request.data.get("reference") or f"add_balance-{generate_txn_id()}",
+        }
+        try:
+            result = top_up_wallets([row])[0]
+        except IntegrityError:
+            return Response(
+                {"message": "Top-up with this reference is already in progress."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        if result["status"] == "invalid":
+            return Response(result["errors"], status=status.HTTP_400_BAD_REQUEST)
         return Response({"message": "Balance addition successful!"})
+
+
+# batch top-up for finance, takes a list of {user_id, amount, reference}
+class WalletTopUp(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_superuser:
+            return Response(
+                {"message": "Not Authorized to access."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        if not isinstance(request.data, list):
+            return Response(
+                {"message": "Expected a list of top-ups."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            results = top_up_wallets(request.data)
+        except IntegrityError:
+            return Response(
+                {"message": "Some references are being applied concurrently, retry the batch."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        applied = sum(1 for result in results if result["status"] == "applied")
+        return Response({"applied": applied, "results": results})
     
 class OverviewNavbar(APIView):
     permission_classes = (permissions.IsAuthenticated,)
 
+    @conditional_user_get
     def get(self, request, *args, **kwargs):
         user_id = self.kwargs["user_id"]
         user = CustomUser.objects.get(user_id=user_id)
@@ -575,8 +750,9 @@ class OverviewNavbar(APIView):
             return Response(response)
         
 class OverviewTable(APIView):
-    permission_class = (permissions.IsAuthenticated,)
+    permission_classes = (permissions.IsAuthenticated,)
 
+    @conditional_user_get
     def get(self, request, *args, **kwargs):
         user_id = self.kwargs["user_id"]
         user = CustomUser.objects.get(user_id=user_id)
@@ -605,38 +781,242 @@ class OverviewTable(APIView):
 # writing a POST request so that when it is called, notifications are sent to all customers, who have pending dues
 class RequestClearance(APIView):
     permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = PAYMENT_THROTTLES
 
+    @admission_controlled
     def post(self, request, *args, **kwargs):
-        user_id = self.kwargs["user_id"]
-        user = CustomUser.objects.get(user_id=user_id)
-        wallet = Wallet.objects.get(user=user)
-        transactions = Transaction.objects.filter(receiver=wallet, transaction_status=2)
-        # for transaction in transactions:
-        #     receiver = transaction.receiver.user
-        #     if receiver.is_customer:
-        #         notification = Notification.objects.create(
-        #             user=receiver,
-        #             message="You have pending dues of Rs. " + str(transaction.transaction_amount) + " with " + str(user.user_id) + ". Kindly clear the dues.",
-        #             notification_type=1,
-        #         )
-        #         notification.save()
-
-        # calculate the total dues pending with each customer and send a single notification
-        pending_dues = {}
-        for transaction in transactions:
-            sender = transaction.sender.user
-            if sender not in pending_dues:
-                pending_dues[sender] = 0
-            pending_dues[sender] += transaction.transaction_amount
-        print(pending_dues)
-        for sender in pending_dues:
-            print(sender.user_id)
-            Notification.objects.create(
-                user=sender,
-                subject="Requesting clearance of pending dues",
-                content="You have pending dues of Rs. " + str(pending_dues[sender]) + " with " + str(user.user_id) + ". Kindly clear the dues.",
-            )
-            # notification.save()
-
-        return Response({"message": "Notifications sent successfully!"})
+        if not (request.user.is_superuser or request.user.user_id == self.kwargs["user_id"]):
+            return Response({"message": "Not Authorized to access."}, status=status.HTTP_403_FORBIDDEN)
+        user = CustomUser.objects.get(user_id=self.kwargs["user_id"])
+        # reminders go out in batches from send_clearance_reminders, repeated
+        # requests before that are absorbed by the queued one
+        request_clearance(user)
+        return Response(
+            {"message": "Clearance reminders queued."}, status=status.HTTP_202_ACCEPTED
+        )
+
+
+
+# revenue, dues and top customers of a vendor, answered from the rollup tables
+class VendorAnalytics(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        if not (
+            request.user.is_superuser or request.user.user_id == self.kwargs["user_id"]
+        ):
+            return Response(
+                {"message": "Not Authorized to access."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        query = VendorAnalyticsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        wallet = get_object_or_404(
+            Wallet, user__user_id=self.kwargs["user_id"], user__is_vendor=True
+        )
+        start, end, granularity = (
+            query.validated_data[field] for field in ("start", "end", "granularity")
+        )
+        return Response(vendor_analytics(wallet, start, end, granularity))
+
+
+def page_size(request):
+    try:
+        return min(max(int(request.query_params.get("limit", PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return PAGE_SIZE
+
 
+def is_support_staff(user):
+    return user.is_staff or user.is_superuser
+
+
+# issues raised by a user (GET, keyset paginated with ?cursor=) and raising a new one (POST)
+class UserIssueList(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        if not (
+            request.user.is_superuser or request.user.user_id == self.kwargs["user_id"]
+        ):
+            return Response(
+                {"message": "Not Authorized to access."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        try:
+            issues, cursor = issue_page(
+                Issue.objects.filter(user_id=self.kwargs["user_id"]),
+                request.query_params.get("cursor"),
+                page_size(request),
+            )
+        except ValueError:
+            return Response({"message": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"results": issues, "next": cursor})
+
+    def post(self, request, *args, **kwargs):
+        if request.user.user_id != self.kwargs["user_id"]:
+            return Response(
+                {"message": "Not Authorized to access."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        serializer = IssueRaiseSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # request.user is a TokenUser for Bearer clients, not a CustomUser
+        issue = Issue(user_id=request.user.user_id, **serializer.validated_data)
+        try:
+            issue.save()
+        except Transaction.DoesNotExist:
+            return Response(
+                {"message": "Transaction not found."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        except ValidationError as e:
+            return Response({"message": e.messages}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {field: getattr(issue, field) for field in ISSUE_FIELDS},
+            status=status.HTTP_201_CREATED,
+        )
+
+
+# support queue, oldest first, ?state= (default open) and ?cursor= for the next page
+class IssueQueue(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        if not is_support_staff(request.user):
+            return Response(
+                {"message": "Not Authorized to access."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        state = request.query_params.get("state", str(Issue.OPEN))
+        if state not in {str(value) for value, _ in Issue.ISSUE_STATES}:
+            return Response({"message": "Invalid state."}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = Issue.objects.filter(state=state)
+        if request.query_params.get("mine"):
+            queryset = queryset.filter(assignee_id=request.user.user_id)
+        try:
+            issues, cursor = issue_page(
+                queryset, request.query_params.get("cursor"), page_size(request)
+            )
+        except ValueError:
+            return Response({"message": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"results": issues, "next": cursor})
+
+
+# claim the oldest open issues, concurrent claims never return the same issue
+class IssueClaim(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        if not is_support_staff(request.user):
+            return Response(
+                {"message": "Not Authorized to access."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        try:
+            limit = min(max(int(request.data.get("limit", 1)), 1), MAX_PAGE_SIZE)
+        except (TypeError, ValueError):
+            return Response({"message": "Invalid limit."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"results": claim_issues(request.user.user_id, limit)})
+
+
+class IssueResolve(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        if not is_support_staff(request.user):
+            return Response(
+                {"message": "Not Authorized to access."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        try:
+            resolved_status = int(request.data.get("resolved_status"))
+        except (TypeError, ValueError):
+            resolved_status = None
+        if resolved_status not in Issue.RESOLUTIONS:
+            return Response(
+                {"message": "Invalid resolved_status."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not resolve_issues([self.kwargs["issue_id"]], resolved_status):
+            return Response(
+                {"message": "Issue not found, not in review or already resolved."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        return Response({"message": "Issue resolved."})
+
+
+# hit/miss counters of the response cache in this process
+class ResponseCacheStats(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_superuser:
+            return Response(
+                {"message": "Not Authorized to access."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        return Response(cache_stats())
+
+
+# requests rejected by the payment throttles and the write limiter in this process
+class RejectionStats(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_superuser:
+            return Response(
+                {"message": "Not Authorized to access."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        return Response(rejection_stats())
+
+
+# transfers checked, flagged and blocked by the velocity checks in this process
+class VelocityStats(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_superuser:
+            return Response(
+                {"message": "Not Authorized to access."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        return Response(velocity_stats())
+
+
+# all metrics in the Prometheus text format, for superusers (session auth, access
+# tokens do not carry the superuser flag)
+class Metrics(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_superuser:
+            return Response(
+                {"message": "Not Authorized to access."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        return HttpResponse(
+            registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+
+# wallet and transaction changes in commit order for downstream consumers,
+# read incrementally with ?after=<position of the last event processed>
+class EventFeed(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_superuser:
+            return Response(
+                {"message": "Not Authorized to access."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        try:
+            after = int(request.query_params.get("after", 0))
+        except ValueError:
+            return Response({"message": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+        events = read_events(after, page_size(request))
+        return Response(
+            {"results": events, "next": events[-1]["position"] if events else after}
+        )
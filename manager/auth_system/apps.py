@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class AuthSystemConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'auth_system'
+
+    def ready(self):
+        from django.contrib.auth.signals import user_logged_in, user_login_failed
+
+        from api.metrics import logins
+
+        # session logins, JWT logins are counted by TokenLoginSerializer
+        user_logged_in.connect(
+            lambda **kwargs: logins.inc(result="success"), weak=False
+        )
+        user_login_failed.connect(
+            lambda **kwargs: logins.inc(result="failure"), weak=False
+        )
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher,
+    PBKDF2PasswordHasher,
+    ScryptPasswordHasher,
+)
+
+# Password hashers whose cost parameters come from settings.PASSWORD_HASHER_PARAMS.
+# Django rehashes a password on the next successful login whenever the stored
+# parameters differ from the current ones (or the preferred hasher changed),
+# so tuning the values here upgrades/downgrades users transparently.
+
+
+def get_params(algorithm):
+    return getattr(settings, "PASSWORD_HASHER_PARAMS", {}).get(algorithm, {})
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return get_params(self.algorithm).get(
+            "iterations", PBKDF2PasswordHasher.iterations
+        )
+
+
+class TunedScryptPasswordHasher(ScryptPasswordHasher):
+    @property
+    def work_factor(self):
+        return get_params(self.algorithm).get(
+            "work_factor", ScryptPasswordHasher.work_factor
+        )
+
+    @property
+    def block_size(self):
+        return get_params(self.algorithm).get(
+            "block_size", ScryptPasswordHasher.block_size
+        )
+
+    @property
+    def parallelism(self):
+        return get_params(self.algorithm).get(
+            "parallelism", ScryptPasswordHasher.parallelism
+        )
+
+    @property
+    def maxmem(self):
+        return get_params(self.algorithm).get("maxmem", ScryptPasswordHasher.maxmem)
+
+
+# needs argon2-cffi, only put it first in PASSWORD_HASHERS once it is installed
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    @property
+    def time_cost(self):
+        return get_params(self.algorithm).get(
+            "time_cost", Argon2PasswordHasher.time_cost
+        )
+
+    @property
+    def memory_cost(self):
+        return get_params(self.algorithm).get(
+            "memory_cost", Argon2PasswordHasher.memory_cost
+        )
+
+    @property
+    def parallelism(self):
+        return get_params(self.algorithm).get(
+            "parallelism", Argon2PasswordHasher.parallelism
+        )
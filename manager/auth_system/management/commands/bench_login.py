@@ -0,0 +1,91 @@
+import logging
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+
+UserModel = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure password hashing cost and login throughput under a "
+        "credential-stuffing like burst. All rows are rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--attempts", type=int, default=200)
+        parser.add_argument("--ips", type=int, default=4)
+        parser.add_argument("--rounds", type=int, default=5)
+
+    def handle(self, *args, **options):
+        # every rejected attempt would otherwise be logged as a warning
+        logging.getLogger("django.request").setLevel(logging.ERROR)
+        self.bench_hashers(options["rounds"])
+        with transaction.atomic():
+            self.bench_attack(options["attempts"], options["ips"])
+            transaction.set_rollback(True)
+
+    def bench_hashers(self, rounds):
+        self.stdout.write("Hasher cost (ms per hash):")
+        for hasher in get_hashers():
+            try:
+                hasher.encode("benchmark-password", hasher.salt())
+            except ValueError as e:
+                self.stdout.write(f"  {hasher.algorithm:<15} unavailable ({e})")
+                continue
+            start = time.perf_counter()
+            for _ in range(rounds):
+                hasher.encode("benchmark-password", hasher.salt())
+            elapsed = (time.perf_counter() - start) / rounds
+            self.stdout.write(f"  {hasher.algorithm:<15} {elapsed * 1000:8.2f}")
+
+    def bench_attack(self, attempts, ips):
+        run = uuid.uuid4().hex[:8]
+        username = f"bench_{run}"
+        password = "Bench-password-1"
+        UserModel.objects.create_user(
+            username, f"{username}@bench.local", str(uuid.uuid4().int)[:10],
+            password=password,
+        )
+        client = Client()
+        subnet = int(run[:2], 16)
+
+        # the victim username is hammered from a few addresses, with wrong passwords
+        codes = {}
+        start = time.perf_counter()
+        for i in range(attempts):
+            response = client.post(
+                "/auth/login/",
+                {"username": username, "password": f"wrong-{i}"},
+                content_type="application/json",
+                REMOTE_ADDR=f"10.{subnet}.0.{i % ips}",
+            )
+            codes[response.status_code] = codes.get(response.status_code, 0) + 1
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"Attack: {attempts} attempts in {elapsed:.2f}s "
+            f"({attempts / elapsed:.0f} req/s), status codes {codes}"
+        )
+
+        # a legitimate user on another address is unaffected by the burst
+        other = f"bench_{run}_ok"
+        UserModel.objects.create_user(
+            other, f"{other}@bench.local", str(uuid.uuid4().int)[:10],
+            password=password,
+        )
+        start = time.perf_counter()
+        response = client.post(
+            "/auth/login/",
+            {"username": other, "password": password},
+            content_type="application/json",
+            REMOTE_ADDR="10.255.0.1",
+        )
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"Legitimate login: status {response.status_code} in {elapsed * 1000:.1f} ms"
+        )
@@ -0,0 +1,62 @@
+import csv
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError
+from rest_framework import serializers
+
+from auth_system.services import bulk_register_users, register_user
+
+
+class Command(BaseCommand):
+    help = (
+        "Register users from a CSV file with the columns username, email, "
+        "phone_number, type and (optionally) password. Users without a password "
+        "get an unusable one and can set it through the password reset flow."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("csv_file")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        created = 0
+        failed = 0
+        with open(options["csv_file"], newline="") as f:
+            rows = csv.DictReader(f)
+            offset = 1  # data rows start on line 2, after the header
+            while True:
+                batch = list(islice(rows, options["batch_size"]))
+                if not batch:
+                    break
+                try:
+                    users, errors = bulk_register_users(batch)
+                except IntegrityError:
+                    # someone registered concurrently, insert this batch row by row
+                    users, errors = self.register_one_by_one(batch)
+                created += len(users)
+                failed += len(errors)
+                for number, error in errors:
+                    self.stderr.write(f"Line {offset + number}: {error}")
+                offset += len(batch)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Registered {created} user(s), skipped {failed}.")
+        )
+
+    def register_one_by_one(self, batch):
+        users, errors = [], []
+        for number, row in enumerate(batch, start=1):
+            try:
+                users.append(
+                    register_user(
+                        row.get("username"),
+                        row.get("email") or "",
+                        row.get("phone_number"),
+                        row.get("password"),
+                        row.get("type") or None,
+                    )
+                )
+            except serializers.ValidationError as e:
+                errors.append((number, e.detail))
+        return users, errors
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from auth_system.models import DeniedToken
+
+
+class Command(BaseCommand):
+    help = "Delete denylisted refresh tokens that have already expired."
+
+    def handle(self, *args, **options):
+        deleted = DeniedToken.objects.prune()
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} expired token(s)."))
@@ -1,3 +1,27 @@
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
+
+JTI_LENGTH = 32
+
+
+class DeniedTokenManager(models.Manager):
+    def is_denied(self, jti):
+        return self.filter(jti=jti).exists()
+
+    def prune(self):
+        # expired tokens fail signature/exp checks anyway, no need to keep them
+        return self.filter(expires_at__lte=timezone.now()).delete()[0]
+
+
+# Refresh tokens that were rotated or logged out. Only the jti and the expiry are
+# kept, so the table stays small and can be pruned once the tokens would have expired.
+class DeniedToken(models.Model):
+    jti = models.CharField(max_length=JTI_LENGTH, primary_key=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    objects = DeniedTokenManager()
+
+    def __str__(self):
+        return self.jti
@@ -2,6 +2,15 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model, authenticate
 from django.utils.http import urlsafe_base64_decode
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer,
+)
+
+from api.metrics import logins
+
+from .services import register_user
+from .tokens import UserRefreshToken
 
 
 UserModel = get_user_model()
@@ -23,7 +32,13 @@ class UserRegisterSerializer(serializers.ModelSerializer):
             "password",
             "confirm_password",
         )
-        extra_kwargs = {"password": {"write_only": True}, "type": {"required": True}}
+        # uniqueness is enforced by the DB constraints in register_user
+        extra_kwargs = {
+            "password": {"write_only": True},
+            "type": {"required": True},
+            "username": {"validators": []},
+            "email": {"validators": []},
+        }
 
     def validate(self, data):
         if data["password"] != data.pop("confirm_password"):
@@ -31,10 +46,7 @@ class UserRegisterSerializer(serializers.ModelSerializer):
         return data
 
     def create(self, validated_data):
-        # password = validated_data.pop("password")
-        user = UserModel.objects.create_user(**validated_data)
-        user.save()
-        return user
+        return register_user(**validated_data)
 
 
 class UserLoginSerializer(serializers.ModelSerializer):
@@ -51,11 +63,15 @@ class UserLoginSerializer(serializers.ModelSerializer):
         password = data.get("password", None)
         if username is None:
             raise serializers.ValidationError("A username is required to login")
-        user = authenticate(username=username, password=password)
+        user = authenticate(
+            self.context.get("request"), username=username, password=password
+        )
         if user is None:
             raise serializers.ValidationError("A user with this username and password is not found")
         if not user.is_active:
             raise serializers.ValidationError("This user has been deactivated")
+        # handed to the view so that the password is only hashed once per login
+        data["user"] = user
         return data
     
 
@@ -118,3 +134,38 @@ class UpdateProfileSerializer(serializers.ModelSerializer):
 
         return data
 
+
+
+# JWT login, refresh and logout for clients that do not want session cookies
+class TokenLoginSerializer(TokenObtainPairSerializer):
+    token_class = UserRefreshToken
+
+    def validate(self, data):
+        data = super().validate(data)
+        # failures are counted by the user_login_failed signal
+        logins.inc(result="success")
+        data["user_id"] = self.user.user_id
+        data["type"] = self.user.type
+        return data
+
+
+class TokenRefreshRotateSerializer(TokenRefreshSerializer):
+    token_class = UserRefreshToken
+
+    def validate(self, data):
+        refresh = self.token_class(data["refresh"])
+        access = refresh.access_token
+        # the old refresh token is denied before a new one is handed out
+        refresh.deny()
+        refresh.set_jti()
+        refresh.set_exp()
+        refresh.set_iat()
+        return {"access": str(access), "refresh": str(refresh)}
+
+
+class TokenLogoutSerializer(serializers.Serializer):
+    refresh = serializers.CharField(write_only=True)
+
+    def validate(self, data):
+        UserRefreshToken(data["refresh"]).deny()
+        return data
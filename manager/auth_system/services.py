@@ -0,0 +1,180 @@
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from rest_framework import serializers
+
+from api.caching import invalidate
+from api.metrics import registrations
+from api.models import Notification, Wallet
+
+UserModel = get_user_model()
+
+UNIQUE_ERRORS = {
+    "username": "This username is already registered",
+    "email": "This email is already registered",
+    "phone_number": "This phone number is already registered",
+}
+
+
+def violated_constraint(error):
+    """
+    Name of the unique constraint an IntegrityError reports. postgres and
+    mysql name the constraint (or index), sqlite only lists the columns, as
+    "table.column[, table.column]".
+    """
+    cause = error.__cause__
+    diag = getattr(cause, "diag", None)
+    if diag is not None:
+        return diag.constraint_name
+    message = str(cause or error)
+    if message.startswith("UNIQUE constraint failed: "):
+        return message[len("UNIQUE constraint failed: ") :]
+    if " for key '" in message:
+        # mysql 8 prefixes the key with the table name
+        return message.rsplit(" for key '", 1)[1].rstrip("'").split(".")[-1]
+    return None
+
+
+def unique_constraints():
+    """
+    {constraint name: field} for the unique fields of the user table, as the
+    database reports them in an IntegrityError.
+    """
+    table = UserModel._meta.db_table
+    columns = {
+        UserModel._meta.get_field(field).column: field
+        for field in UserModel.UNIQUE_FIELDS
+    }
+    names = {f"{table}.{column}": field for column, field in columns.items()}
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    for name, constraint in constraints.items():
+        if constraint["unique"] and len(constraint["columns"]) == 1:
+            field = columns.get(constraint["columns"][0])
+            if field is not None:
+                names[name] = field
+    return names
+
+
+def unique_violation(error):
+    """
+    Map an IntegrityError raised on insert to a {field: message} dict, by the
+    name of the constraint it violated. Anything else, e.g. a user_id
+    collision, asks the client to retry.
+    """
+    field = unique_constraints().get(violated_constraint(error))
+    if field is not None:
+        return {field: [UNIQUE_ERRORS[field]]}
+    return {"non_field_errors": ["Registration failed, please try again"]}
+
+
+def build_user(username, email, phone_number="", password=None, type=None):
+    user = UserModel(
+        username=username,
+        email=UserModel.objects.normalize_email(email),
+        phone_number=phone_number or "",
+        type=type,
+    )
+    if password:
+        user.set_password(password)
+    else:
+        user.set_unusable_password()
+    user.set_type_flags()
+    return user
+
+
+def register_user(username, email, phone_number="", password=None, type=None):
+    """
+    Create a user with its wallet and welcome notification in one atomic block.
+    Uniqueness is left to the DB constraints instead of existence queries, so a
+    registration costs three INSERTs.
+    """
+    user = build_user(username, email, phone_number, password, type)
+    try:
+        with transaction.atomic():
+            # skips CustomUser.save, which would run the existence queries again
+            super(UserModel, user).save(force_insert=True)
+            Wallet.objects.create(user=user)
+            user.welcome_notification().save()
+    except IntegrityError as e:
+        raise serializers.ValidationError(unique_violation(e))
+    registrations.inc(type=user.type)
+    return user
+
+
+def bulk_register_users(rows):
+    """
+    Register many users at once, e.g. for semester onboarding.
+    `rows` are dicts with the register_user arguments. Returns the created
+    users and a list of (row number, errors) for the rows that were skipped.
+    Conflicts with existing users are found with one query, users, wallets and
+    notifications are then inserted with bulk_create inside one transaction.
+    """
+    errors = []
+    users = []
+    seen = {field: set() for field in UserModel.UNIQUE_FIELDS}
+    for number, row in enumerate(rows, start=1):
+        user = build_user(
+            row.get("username"),
+            row.get("email") or "",
+            row.get("phone_number"),
+            row.get("password"),
+            row.get("type") or None,
+        )
+        try:
+            user.clean_fields(exclude=["password", "user_id", "last_login"])
+        except DjangoValidationError as e:
+            errors.append((number, e.message_dict))
+            continue
+        duplicate = next(
+            (
+                field
+                for field in UserModel.UNIQUE_FIELDS
+                if getattr(user, field) and getattr(user, field) in seen[field]
+            ),
+            None,
+        )
+        if duplicate is not None:
+            errors.append((number, {duplicate: "Duplicate value in the import"}))
+            continue
+        for field in UserModel.UNIQUE_FIELDS:
+            if getattr(user, field):
+                seen[field].add(getattr(user, field))
+        users.append((number, user))
+
+    existing = UserModel.objects.filter(
+        Q(username__in=seen["username"])
+        | Q(email__in=seen["email"])
+        | Q(phone_number__in=seen["phone_number"])
+    ).values_list(*UserModel.UNIQUE_FIELDS)
+    taken = {field: set() for field in UserModel.UNIQUE_FIELDS}
+    for values in existing:
+        for field, value in zip(UserModel.UNIQUE_FIELDS, values):
+            taken[field].add(value)
+
+    new_users = []
+    for number, user in users:
+        field = next(
+            (
+                f
+                for f in UserModel.UNIQUE_FIELDS
+                if getattr(user, f) and getattr(user, f) in taken[f]
+            ),
+            None,
+        )
+        if field is not None:
+            errors.append((number, {field: UNIQUE_ERRORS[field]}))
+        else:
+            new_users.append(user)
+
+    with transaction.atomic():
+        UserModel.objects.bulk_create(new_users)
+        Wallet.objects.bulk_create([Wallet(user=user) for user in new_users])
+        Notification.objects.bulk_create(
+            [user.welcome_notification() for user in new_users]
+        )
+        invalidate(UserModel, Wallet)
+    for user in new_users:
+        registrations.inc(type=user.type)
+    return new_users, errors
@@ -1,3 +1,269 @@
-from django.test import TestCase
+import base64
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import check_password, get_hasher
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import serializers
+from rest_framework.test import APIClient
+
+from api.models import CustomUser, Notification, Wallet
+
+from .models import DeniedToken
+from .services import bulk_register_users, register_user
+from .throttles import LoginIPRateThrottle, LoginUsernameRateThrottle
+
+
+class TokenTests(TestCase):
+    def setUp(self):
+        # login throttles keep their state in the cache
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            "alice", "alice@example.com", "+919000000001", "password"
+        )
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post(
+            reverse("token"), {"username": "alice", "password": "password"}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def refresh(self, token):
+        return self.client.post(reverse("token-refresh"), {"refresh": token})
+
+    def test_login(self):
+        tokens = self.login()
+        self.assertEqual(tokens["user_id"], self.user.user_id)
+        self.assertEqual(tokens["type"], CustomUser.Types.CUSTOMER)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        response = self.client.get(reverse("notification", args=[self.user.user_id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_wrong_password(self):
+        response = self.client.post(
+            reverse("token"), {"username": "alice", "password": "wrong"}
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_refresh_rotates(self):
+        tokens = self.login()
+        response = self.refresh(tokens["refresh"])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data["refresh"], tokens["refresh"])
+        # the old refresh token is denied, the new one works
+        self.assertEqual(self.refresh(tokens["refresh"]).status_code, 401)
+        self.assertEqual(self.refresh(response.data["refresh"]).status_code, 200)
+        self.assertEqual(DeniedToken.objects.count(), 2)
+
+    def test_logout_denies_the_refresh_token(self):
+        tokens = self.login()
+        response = self.client.post(reverse("token-logout"), {"refresh": tokens["refresh"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.refresh(tokens["refresh"]).status_code, 401)
+
+    def test_basic_auth_is_not_accepted(self):
+        credentials = base64.b64encode(b"alice:password").decode()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Basic {credentials}")
+        response = self.client.get(reverse("notification", args=[self.user.user_id]))
+        self.assertIn(response.status_code, (401, 403))
+
+
+class LoginThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            "alice", "alice@example.com", "+919000000001", "password"
+        )
+        self.client = APIClient()
+
+    def login(self, username, password="wrong", url="token"):
+        return self.client.post(
+            reverse(url), {"username": username, "password": password}, format="json"
+        )
+
+    @mock.patch.object(LoginUsernameRateThrottle, "THROTTLE_RATES", {"login_username": "3/min"})
+    def test_username_limit(self):
+        for _ in range(3):
+            self.assertEqual(self.login("alice").status_code, 401)
+        # spacing and case do not make a new username
+        self.assertEqual(self.login(" ALICE ", "password").status_code, 429)
+        self.assertEqual(self.login("Alice", "password", url="login").status_code, 429)
+        # other usernames are not affected
+        self.assertEqual(self.login("bob").status_code, 401)
+
+    @mock.patch.object(LoginIPRateThrottle, "THROTTLE_RATES", {"login_ip": "2/min"})
+    def test_ip_limit(self):
+        self.assertEqual(self.login("alice").status_code, 401)
+        self.assertEqual(self.login("bob").status_code, 401)
+        self.assertEqual(self.login("carol").status_code, 429)
+
+    def test_body_without_username(self):
+        for body in (["alice"], "alice", {}):
+            response = self.client.post(reverse("token"), body, format="json")
+            self.assertEqual(response.status_code, 400)
+
+
+class HasherTests(TestCase):
+    @override_settings(PASSWORD_HASHER_PARAMS={"pbkdf2_sha256": {"iterations": 1000}})
+    def test_iterations_from_settings(self):
+        user = CustomUser.objects.create_user(
+            "alice", "alice@example.com", "+919000000001", "password"
+        )
+        algorithm, iterations, _, _ = user.password.split("$")
+        self.assertEqual((algorithm, iterations), ("pbkdf2_sha256", "1000"))
+
+    def test_rehash_on_login_when_params_change(self):
+        with override_settings(
+            PASSWORD_HASHER_PARAMS={"pbkdf2_sha256": {"iterations": 1000}}
+        ):
+            user = CustomUser.objects.create_user(
+                "alice", "alice@example.com", "+919000000001", "password"
+            )
+        with override_settings(
+            PASSWORD_HASHER_PARAMS={"pbkdf2_sha256": {"iterations": 2000}}
+        ):
+            self.assertTrue(user.check_password("password"))
+            user.refresh_from_db()
+            self.assertEqual(user.password.split("$")[1], "2000")
+            self.assertTrue(check_password("password", user.password))
+
+    @override_settings(PASSWORD_HASHER_PARAMS={"scrypt": {"work_factor": 2 ** 10}})
+    def test_scrypt_params(self):
+        hasher = get_hasher("scrypt")
+        encoded = hasher.encode("password", hasher.salt())
+        self.assertEqual(encoded.split("$")[1], str(2 ** 10))
+        self.assertTrue(hasher.verify("password", encoded))
+
+
+def user_row(username, phone_number="", **extra):
+    return {
+        "username": username,
+        "email": f"{username}@example.com",
+        "phone_number": phone_number,
+        **extra,
+    }
+
+
+class RegistrationTests(TestCase):
+    def register(self, name, **extra):
+        data = {
+            **user_row(name),
+            "type": CustomUser.Types.CUSTOMER,
+            "password": "correct-horse-battery",
+            "confirm_password": "correct-horse-battery",
+            **extra,
+        }
+        return APIClient().post(reverse("register"), data, format="json")
+
+    def test_register(self):
+        response = self.register("alice", phone_number="+919000000001")
+        self.assertEqual(response.status_code, 201)
+        user = CustomUser.objects.get(username="alice")
+        self.assertTrue(user.is_customer)
+        self.assertTrue(user.check_password("correct-horse-battery"))
+        self.assertTrue(Wallet.objects.filter(user=user).exists())
+        self.assertEqual(Notification.objects.filter(user=user).count(), 1)
+
+    def test_duplicates_map_to_their_field(self):
+        self.register("alice", phone_number="+919000000001")
+        cases = {
+            "username": {"email": "other@example.com"},
+            "email": {"username": "bob"},
+            "phone_number": {
+                "username": "bob",
+                "email": "bob@example.com",
+                "phone_number": "+919000000001",
+            },
+        }
+        for field, extra in cases.items():
+            response = self.register("alice", **extra)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(list(response.data), [field])
+        self.assertEqual(CustomUser.objects.count(), 1)
+        self.assertEqual(Wallet.objects.count(), 1)
+
+    def test_username_that_looks_like_another_field(self):
+        # the username appears in the DB message, the constraint decides
+        register_user("email", "email@example.com")
+        with self.assertRaises(serializers.ValidationError) as raised:
+            register_user("phone_number", "email@example.com")
+        self.assertEqual(list(raised.exception.detail), ["email"])
+
+    def test_empty_phone_numbers_do_not_conflict(self):
+        register_user("alice", "alice@example.com")
+        register_user("bob", "bob@example.com")
+        self.assertEqual(CustomUser.objects.filter(phone_number="").count(), 2)
+
+
+class BulkRegistrationTests(TestCase):
+    def test_bulk_register(self):
+        register_user("taken", "taken@example.com", "+919000000009")
+        rows = [
+            user_row("alice", "+919000000001", type=CustomUser.Types.VENDOR),
+            user_row("bob"),
+            user_row("alice"),  # duplicate in the batch
+            user_row("carol", "+919000000009"),  # taken by an existing user
+            user_row("dave", "not a number"),
+        ]
+        users, errors = bulk_register_users(rows)
+        self.assertEqual([user.username for user in users], ["alice", "bob"])
+        errors = dict(errors)
+        self.assertEqual(sorted(errors), [3, 4, 5])
+        self.assertEqual(list(errors[3]), ["username"])
+        self.assertEqual(list(errors[4]), ["phone_number"])
+        self.assertEqual(list(errors[5]), ["phone_number"])
+        alice = CustomUser.objects.get(username="alice")
+        self.assertTrue(alice.is_vendor)
+        self.assertFalse(alice.has_usable_password())
+        self.assertEqual(Wallet.objects.count(), 3)
+
+    def test_concurrent_duplicate_raises(self):
+        register_user("alice", "alice@example.com")
+        # the existence check misses a user registered after it ran
+        with mock.patch.object(
+            CustomUser.objects, "filter", return_value=CustomUser.objects.none()
+        ):
+            with self.assertRaises(IntegrityError):
+                bulk_register_users([user_row("bob"), user_row("alice")])
+        self.assertFalse(CustomUser.objects.filter(username="bob").exists())
+
+
+class ImportUsersTests(TestCase):
+    def import_users(self, *lines):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+            f.write("username,email,phone_number,type\n")
+            f.write("".join(f"{line}\n" for line in lines))
+        self.addCleanup(os.unlink, f.name)
+        out, err = StringIO(), StringIO()
+        call_command("import_users", f.name, "--batch-size", "2", stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import(self):
+        out, err = self.import_users(
+            "alice,alice@example.com,+919000000001,VENDOR",
+            "bob,bob@example.com,,",
+            "alice,other@example.com,,",
+        )
+        self.assertIn("Registered 2 user(s), skipped 1.", out)
+        self.assertIn("Line 4:", err)
+        self.assertEqual(CustomUser.objects.count(), 2)
+
+    def test_concurrent_duplicate_falls_back_to_single_rows(self):
+        register_user("alice", "alice@example.com")
+        with mock.patch.object(
+            CustomUser.objects, "filter", return_value=CustomUser.objects.none()
+        ):
+            out, err = self.import_users(
+                "bob,bob@example.com,,", "carol,alice@example.com,,"
+            )
+        self.assertIn("Registered 1 user(s), skipped 1.", out)
+        self.assertIn("Line 3: {'email'", err)
+        self.assertTrue(CustomUser.objects.filter(username="bob").exists())
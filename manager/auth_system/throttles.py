@@ -0,0 +1,31 @@
+import hashlib
+
+from rest_framework.throttling import SimpleRateThrottle
+
+# DRF keeps the timestamps of recent requests in the cache, so these behave as a
+# sliding window. They run before the view, i.e. before any password is hashed.
+
+
+class LoginIPRateThrottle(SimpleRateThrottle):
+    scope = "login_ip"
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {
+            "scope": self.scope,
+            "ident": self.get_ident(request),
+        }
+
+
+class LoginUsernameRateThrottle(SimpleRateThrottle):
+    scope = "login_username"
+
+    def get_cache_key(self, request, view):
+        # a JSON list or scalar body has no username, the view rejects it
+        if not isinstance(request.data, dict):
+            return None
+        username = str(request.data.get("username") or "").strip().casefold()
+        if not username:
+            return None
+        # usernames may contain characters that some cache backends reject in keys
+        ident = hashlib.sha1(username.encode()).hexdigest()
+        return self.cache_format % {"scope": self.scope, "ident": ident}
@@ -0,0 +1,37 @@
+from django.db import IntegrityError, transaction
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken, TokenError
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from .models import DeniedToken
+
+
+class UserRefreshToken(RefreshToken):
+    """
+    Refresh token carrying the `user_id` and `type` claims.
+    Both claims are copied into the access tokens, so API views can authorize a
+    request from the token alone, without loading the user.
+    Rotated and logged out refresh tokens are kept in the DeniedToken table.
+    """
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token["type"] = user.type
+        return token
+
+    def verify(self, *args, **kwargs):
+        super().verify(*args, **kwargs)
+        if DeniedToken.objects.is_denied(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError("Token is no longer valid")
+
+    def deny(self):
+        # the primary key makes a second use of the same refresh token fail here
+        try:
+            with transaction.atomic():
+                DeniedToken.objects.create(
+                    jti=self.payload[api_settings.JTI_CLAIM],
+                    expires_at=datetime_from_epoch(self.payload["exp"]),
+                )
+        except IntegrityError:
+            raise TokenError("Token is no longer valid")
@@ -5,6 +5,9 @@ urlpatterns = [
     path("register/", views.UserRegister.as_view(), name="register"),
     path("login/", views.UserLogin.as_view(), name="login"),
     path("logout/", views.UserLogout.as_view(), name="logout"),
+    path("token/", views.UserTokenLogin.as_view(), name="token"),
+    path("token/refresh/", views.UserTokenRefresh.as_view(), name="token-refresh"),
+    path("token/logout/", views.UserTokenLogout.as_view(), name="token-logout"),
     path("user/", views.UserView.as_view(), name="user"),
     path("password-reset/", views.PasswordReset.as_view(), name="password-reset"),
     path("password-reset/<str:encoded_pk>/<str:token>/", views.ResetPasswordAPI.as_view(), name="reset-password"),
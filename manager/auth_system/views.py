@@ -7,7 +7,10 @@ from .serializers import (
     UserSerializer,
     EmailSerializer,
     PasswordResetSerializer,
-    UpdateProfileSerializer
+    UpdateProfileSerializer,
+    TokenLoginSerializer,
+    TokenRefreshRotateSerializer,
+    TokenLogoutSerializer,
 )
 from django.contrib.auth import get_user_model, authenticate, login, logout
 from rest_framework.authentication import SessionAuthentication
@@ -16,6 +19,8 @@ from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.urls import reverse
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
+from rest_framework_simplejwt.views import TokenViewBase
+from .throttles import LoginIPRateThrottle, LoginUsernameRateThrottle
 
 UserModel = get_user_model()
 
@@ -23,16 +28,8 @@ UserModel = get_user_model()
 class UserRegister(APIView):
     permission_classes = (permissions.AllowAny,)
 
-    def clean_data(self, data):
-        if UserModel.objects.filter(email=data["email"]).exists():
-            raise serializers.ValidationError("This email is already registered")
-        if UserModel.objects.filter(phone_number=data["phone_number"]).exists():
-            raise serializers.ValidationError("This phone number is already registered")
-        return data
-
     def post(self, request, format=None):
-        data = self.clean_data(request.data)
-        serializer = UserRegisterSerializer(data=data)
+        serializer = UserRegisterSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.save()
             if user:
@@ -45,14 +42,13 @@ class UserLogin(APIView):
     serializer_class = UserLoginSerializer
     permission_classes = (permissions.AllowAny,)
     authentication_classes = (SessionAuthentication,)
+    throttle_classes = (LoginIPRateThrottle, LoginUsernameRateThrottle)
 
     def post(self, request):
         data = request.data
-        serializer = self.serializer_class(data=data)
+        serializer = self.serializer_class(data=data, context={"request": request})
         if serializer.is_valid():
-            username = serializer.validated_data["username"]
-            password = serializer.validated_data["password"]
-            user = authenticate(request, username=username, password=password)
+            user = serializer.validated_data["user"]
             if user is not None:
                 login(request, user)
                 return Response(
@@ -71,6 +67,27 @@ class UserLogin(APIView):
         return Response(serializer.errors, status.HTTP_400_BAD_REQUEST)
 
 
+# JWT alternative to UserLogin, returns an access/refresh pair instead of a session
+class UserTokenLogin(TokenViewBase):
+    serializer_class = TokenLoginSerializer
+    throttle_classes = (LoginIPRateThrottle, LoginUsernameRateThrottle)
+
+
+# exchanges a refresh token for a new pair, the old refresh token stops working
+class UserTokenRefresh(TokenViewBase):
+    serializer_class = TokenRefreshRotateSerializer
+
+
+class UserTokenLogout(TokenViewBase):
+    serializer_class = TokenLogoutSerializer
+
+    def post(self, request, *args, **kwargs):
+        super().post(request, *args, **kwargs)
+        return Response(
+            {"message": "User logged out succesfully"}, status=status.HTTP_200_OK
+        )
+
+
 class UserLogout(APIView):
     permission_classes = (permissions.AllowAny,)
     authentication_classes = ()
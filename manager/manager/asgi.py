@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'manager.settings')
+# serve the read endpoints with async views, see api/async_views.py
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+from api.sse import EventStreamASGIHandler  # noqa: E402
+
+# the stock ASGIHandler plus Server-Sent Events, see api/sse.py
+application = EventStreamASGIHandler()
@@ -10,7 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
+from datetime import timedelta
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -53,8 +55,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -65,6 +69,13 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'manager.urls'
 
+# See api/middleware.py. brotli and zstd are used when the "brotli" and
+# "zstandard" packages are installed, gzip otherwise.
+COMPRESSION_CONTENT_TYPES = {'application/json'}
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_MAX_SIZE = 8 * 1024 * 1024
+COMPRESSION_LEVELS = {'gzip': 6, 'br': 4, 'zstd': 3}
+
 SESSION_COOKIE_HTTPONLY = False
 
 TEMPLATES = [
@@ -115,8 +126,83 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# The first hasher is used for new passwords, the others only verify existing
+# hashes (and get upgraded on the next login). Cost parameters are read from
+# PASSWORD_HASHER_PARAMS, lowering them makes logins cheaper but weaker.
+# To switch to argon2, `pip install argon2-cffi` and move it to the top.
+PASSWORD_HASHERS = [
+    'auth_system.hashers.TunedPBKDF2PasswordHasher',
+    'auth_system.hashers.TunedScryptPasswordHasher',
+    'auth_system.hashers.TunedArgon2PasswordHasher',
+]
+
+PASSWORD_HASHER_PARAMS = {
+    'pbkdf2_sha256': {'iterations': 390000},
+    'scrypt': {'work_factor': 2 ** 14, 'block_size': 8, 'parallelism': 1},
+    'argon2': {'time_cost': 2, 'memory_cost': 102400, 'parallelism': 8},
+}
+
 AUTH_USER_MODEL = 'api.CustomUser'
 
+# Throttle state, user versions and cached responses live here. LocMemCache is
+# per process, set REDIS_URL to share them between workers.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Set by asgi.py: read endpoints are served by async views and the sync views
+# run in a thread pool of SYNC_VIEW_THREADS, see api/async_views.py.
+# SQLite allows one writer at a time, so a few threads are enough.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == '1'
+SYNC_VIEW_THREADS = int(os.environ.get('SYNC_VIEW_THREADS', 4))
+
+# Payment endpoints running at once per process, how many more may wait for a
+# slot and for how long (seconds) before getting a 503, see api/throttles.py.
+WRITE_CONCURRENCY = 2
+WRITE_QUEUE_LIMIT = 16
+WRITE_QUEUE_TIMEOUT = 2
+
+# A customer gets at most one clearance reminder per vendor in this window,
+# see api/reminders.py.
+CLEARANCE_REMINDER_COOLDOWN = timedelta(hours=24)
+
+# Share of its pending limit at which the threshold policy of settle_dues
+# clears a wallet, before payments start failing, see api/settlement.py.
+AUTO_SETTLE_THRESHOLD = 0.8
+
+# Sliding window velocity checks on transactions/make/, see api/velocity.py.
+# Limits are (transfers, amount in Rs.) per VELOCITY_WINDOW seconds.
+VELOCITY_WINDOW = 60
+VELOCITY_LIMITS = {
+    'sender': (20, 10000),
+    'receiver': (600, 200000),
+    'pair': (10, 5000),
+}
+# 'block' rejects anomalous transfers with a 429, 'flag' only logs and counts them
+VELOCITY_ACTION = 'block'
+# keep the windows in the cache, shared by the workers, instead of in memory
+VELOCITY_SHARED = os.environ.get('VELOCITY_SHARED') == '1'
+
+# Under a pre-fork server (gunicorn -w N) set METRICS_DIR to a directory
+# shared by the workers, each writes its metrics there every
+# METRICS_FLUSH_INTERVAL seconds and /metrics adds them up, see api/metrics.py.
+# Empty the directory when the server is (re)started.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 5
+
+# Days the outbox events are kept for consumers, see prune_events.
+OUTBOX_RETENTION_DAYS = 30
+
 # REST_FRAMEWORK = {
 #     'DEFAULT_AUTHENTICATION_CLASSES': [
 #         'rest_framework.authentication.TokenAuthentication',
@@ -126,6 +212,31 @@ AUTH_USER_MODEL = 'api.CustomUser'
 #     ]
 # }
 
+# Session login stays the default, clients can opt in to JWT by sending
+# "Authorization: Bearer <access>". Access tokens are checked without a DB lookup.
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework_simplejwt.authentication.JWTStatelessUserAuthentication',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        # many students share the campus NAT, so the per-IP limit is generous
+        'login_ip': '300/min',
+        'login_username': '10/min',
+        # sliding window limits on the payment endpoints, see api/throttles.py
+        'payment_user': '30/min',
+        'payment_global': '1200/min',
+    },
+}
+
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'ROTATE_REFRESH_TOKENS': True,
+    'USER_ID_FIELD': 'user_id',
+    'USER_ID_CLAIM': 'user_id',
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.1/topics/i18n/
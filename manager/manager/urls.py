@@ -16,8 +16,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from api.views import Metrics
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("api.urls")),
     path("auth/", include("auth_system.urls")),
+    path("metrics", Metrics.as_view(), name="metrics"),
 ]